@@ -23,6 +23,9 @@ def create_app():
     from app.routes.etl.staging2 import bp_staging2
     app.register_blueprint(bp_staging2)
 
+    from app.routes.etl.staging1 import bp_staging1
+    app.register_blueprint(bp_staging1)
+
     from app.routes.dashboard import bp_dashboard
     app.register_blueprint(bp_dashboard)
 
@@ -1,27 +1,36 @@
 from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
+from app.utils.upsert import counts_msg, run_counted_upsert, update_set
 
 # Ajuste aqui se quiser outro schema de saída
 MART_SCHEMA = "lacreisaude_mart"
 
-def _rodar_etl_mart(conn):
-    """
-    Constrói/atualiza as tabelas de Data Mart a partir das tabelas da camada MODEL (schema: lacreisaude_model).
-    - Tabelas: patients, patient_disability, professionals, professional_appointments
-    - Idempotente: usa ON CONFLICT (PK) DO UPDATE
-    - Assume que a MODEL (dim_*/fact_*) já foi populada no mesmo 'conn'
-    """
+# Colunas regravadas por cada upsert: o SET e a comparação de mudança saem da mesma
+# tupla (update_set)
+ATUALIZAVEIS = {
+    'patients': (
+        'total_patients', 'active_patients', 'inactive_patients', 'active_percentage',
+        'growth_rate',
+    ),
+    'patient_disability': (
+        'total_patients', 'active_patients', 'inactive_patients',
+    ),
+    'professionals': (
+        'sexual_orientation', 'ethnic_group', 'gender_identity', 'specialty', 'state',
+        'profile_status', 'active', 'total_appointments', 'avg_feedback_rating',
+    ),
+    'professional_appointments': (
+        'total_appointments', 'completed_appointments', 'completed_appointments_online',
+        'completed_appointments_presencial', 'cancelled_appointments_online',
+        'cancelled_appointments_presencial', 'cancellation_rate_online',
+        'cancellation_rate_presencial', 'completion_rate', 'avg_waiting_time', 'created_at',
+    ),
+}
 
-    # ---------------------------------------------------------------------
-    # 0) Schema da MART
-    # ---------------------------------------------------------------------
-    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {MART_SCHEMA};"))
-
-    # ---------------------------------------------------------------------
-    # 1) MART: patients
-    #     PK: (period_month, age_group, gender_identity, sexual_orientation)
-    # ---------------------------------------------------------------------
-    conn.execute(text(f"""
+# DDL da MART (schema e tabelas), aplicado uma única vez pela camada de migrações
+# (app/routes/etl/migrations.py), fora da execução do ETL.
+MART_DDL = [
+    f"CREATE SCHEMA IF NOT EXISTS {MART_SCHEMA};",
+    f"""
         CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.patients (
             period_month DATE NOT NULL,
             age_group VARCHAR(50),
@@ -36,9 +45,70 @@ def _rodar_etl_mart(conn):
             CONSTRAINT mart_patient_pk
             PRIMARY KEY (period_month, age_group, gender_identity, sexual_orientation, ethnic_group)
         );
-    """))
+    """,
+    f"""
+        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.patient_disability (
+            period_month DATE NOT NULL,
+            disability_type VARCHAR(255) NOT NULL,
+            total_patients INT,
+            active_patients INT,
+            inactive_patients INT,
+            CONSTRAINT mart_patient_disability_pk
+                PRIMARY KEY (period_month, disability_type)
+        );
+    """,
+    f"""
+        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.professionals (
+            professional_sk INTEGER PRIMARY KEY,
+            sexual_orientation VARCHAR(255),
+            ethnic_group VARCHAR(255),
+            gender_identity VARCHAR(255),
+            specialty VARCHAR(255),
+            state VARCHAR(255),
+            profile_status VARCHAR(255),
+            active BOOLEAN,
+            total_appointments INTEGER,
+            avg_feedback_rating NUMERIC(4,2)
+        );
+    """,
+    f"""
+        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.professional_appointments (
+            professional_sk INT NOT NULL,
+            appointment_period DATE NOT NULL,
+            specialty VARCHAR(255),
+            total_appointments INT,
+            completed_appointments INT,
+            completed_appointments_online INT,
+            completed_appointments_presencial INT,
+            cancelled_appointments_online INT,
+            cancelled_appointments_presencial INT,
+            completion_rate NUMERIC(5,2),
+            cancellation_rate_online NUMERIC(5,2),
+            cancellation_rate_presencial NUMERIC(5,2),
+            avg_waiting_time NUMERIC(10,2),
+            created_at DATE,
+            CONSTRAINT mart_professional_appointments_pk
+                PRIMARY KEY (professional_sk, appointment_period, specialty)
+        );
+    """,
+]
+
+def _rodar_etl_mart(conn):
+    """
+    Constrói/atualiza as tabelas de Data Mart a partir das tabelas da camada MODEL (schema: lacreisaude_model).
+    - Tabelas: patients, patient_disability, professionals, professional_appointments
+    - Idempotente: usa ON CONFLICT (PK) DO UPDATE
+    - Assume que a MODEL (dim_*/fact_*) já foi populada (etapa anterior, já confirmada)
+    - As tabelas já existem (MART_DDL, aplicado pelas migrações)
+    - Os DO UPDATE só regravam linhas com valores diferentes (ETL_SKIP_UNCHANGED)
+    """
+    contagens = {}
 
-    conn.execute(text(f"""
+    # ---------------------------------------------------------------------
+    # 1) MART: patients
+    #     PK: (period_month, age_group, gender_identity, sexual_orientation)
+    # ---------------------------------------------------------------------
+    contagens['patients'] = run_counted_upsert(conn, f"""
         WITH patient_base AS (
             SELECT
                 p.patient_id                                    AS patient_sk,
@@ -104,7 +174,14 @@ def _rodar_etl_mart(conn):
                 END AS growth_rate
             FROM aggregated a
             JOIN growth_calc gc USING (period_month)
-        )
+        ),
+        src AS (
+        SELECT
+            period_month, age_group, gender_identity, sexual_orientation, ethnic_group,
+            total_patients, active_patients, inactive_patients, active_percentage, growth_rate
+        FROM joined
+        ),
+        upsert AS (
         INSERT INTO {MART_SCHEMA}.patients
         (
             period_month, age_group, gender_identity, sexual_orientation, ethnic_group,
@@ -113,32 +190,18 @@ def _rodar_etl_mart(conn):
         SELECT
             period_month, age_group, gender_identity, sexual_orientation, ethnic_group,
             total_patients, active_patients, inactive_patients, active_percentage, growth_rate
-        FROM joined
-        ON CONFLICT (period_month, age_group, gender_identity, sexual_orientation, ethnic_group) DO UPDATE SET
-            total_patients    = EXCLUDED.total_patients,
-            active_patients   = EXCLUDED.active_patients,
-            inactive_patients = EXCLUDED.inactive_patients,
-            active_percentage = EXCLUDED.active_percentage,
-            growth_rate       = EXCLUDED.growth_rate;
-    """))
+        FROM src
+        ON CONFLICT (period_month, age_group, gender_identity, sexual_orientation, ethnic_group) DO UPDATE
+        {update_set(f'{MART_SCHEMA}.patients', ATUALIZAVEIS['patients'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # ---------------------------------------------------------------------
     # 2) MART: patient_disability
     #     PK: (period_month, disability_type)
     # ---------------------------------------------------------------------
-    conn.execute(text(f"""
-        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.patient_disability (
-            period_month DATE NOT NULL,
-            disability_type VARCHAR(255) NOT NULL,
-            total_patients INT,
-            active_patients INT,
-            inactive_patients INT,
-            CONSTRAINT mart_patient_disability_pk
-                PRIMARY KEY (period_month, disability_type)
-        );
-    """))
-
-    conn.execute(text(f"""
+    contagens['patient_disability'] = run_counted_upsert(conn, f"""
         WITH expanded AS (
             SELECT
                 DATE_TRUNC('month', p.created_at)::date           AS period_month,
@@ -156,39 +219,30 @@ def _rodar_etl_mart(conn):
                 SUM(CASE WHEN NOT is_active THEN 1 ELSE 0 END)     AS inactive_patients
             FROM expanded
             GROUP BY 1,2
-        )
+        ),
+        src AS (
+        SELECT period_month, disability_type, total_patients, active_patients, inactive_patients
+        FROM aggregated
+        ),
+        upsert AS (
         INSERT INTO {MART_SCHEMA}.patient_disability
         (
             period_month, disability_type, total_patients, active_patients, inactive_patients
         )
-        SELECT period_month, disability_type, total_patients, active_patients, inactive_patients
-        FROM aggregated
-        ON CONFLICT (period_month, disability_type) DO UPDATE SET
-            total_patients   = EXCLUDED.total_patients,
-            active_patients  = EXCLUDED.active_patients,
-            inactive_patients= EXCLUDED.inactive_patients;
-    """))
+        SELECT
+            period_month, disability_type, total_patients, active_patients, inactive_patients
+        FROM src
+        ON CONFLICT (period_month, disability_type) DO UPDATE
+        {update_set(f'{MART_SCHEMA}.patient_disability', ATUALIZAVEIS['patient_disability'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # ---------------------------------------------------------------------
     # 3) MART: professionals
     #     PK: professional_sk
     # ---------------------------------------------------------------------
-    conn.execute(text(f"""
-        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.professionals (
-            professional_sk INTEGER PRIMARY KEY,
-            sexual_orientation VARCHAR(255),
-            ethnic_group VARCHAR(255),
-            gender_identity VARCHAR(255),
-            specialty VARCHAR(255),
-            state VARCHAR(255),
-            profile_status VARCHAR(255),
-            active BOOLEAN,
-            total_appointments INTEGER,
-            avg_feedback_rating NUMERIC(4,2)
-        );
-    """))
-
-    conn.execute(text(f"""
+    contagens['professionals'] = run_counted_upsert(conn, f"""
         WITH professional AS (
             SELECT
                 p.professional_id                  AS professional_sk,
@@ -216,12 +270,8 @@ def _rodar_etl_mart(conn):
             JOIN lacreisaude_model.dim_lacreisaude_report dr
               ON dr.report_id = f.report_id
             GROUP BY f.professional_id
-        )
-        INSERT INTO {MART_SCHEMA}.professionals
-        (
-            professional_sk, sexual_orientation, ethnic_group, gender_identity, specialty, state,
-            profile_status, active, total_appointments, avg_feedback_rating
-        )
+        ),
+        src AS (
         SELECT
             p.professional_sk,
             p.sexual_orientation,
@@ -236,44 +286,28 @@ def _rodar_etl_mart(conn):
         FROM professional p
         LEFT JOIN appointments a USING (professional_sk)
         LEFT JOIN feedbacks   f USING (professional_sk)
-        ON CONFLICT (professional_sk) DO UPDATE SET
-            sexual_orientation   = EXCLUDED.sexual_orientation,
-            ethnic_group         = EXCLUDED.ethnic_group,
-            gender_identity      = EXCLUDED.gender_identity,
-            specialty            = EXCLUDED.specialty,
-            state                = EXCLUDED.state,
-            profile_status       = EXCLUDED.profile_status,
-            active               = EXCLUDED.active,
-            total_appointments   = EXCLUDED.total_appointments,
-            avg_feedback_rating  = EXCLUDED.avg_feedback_rating;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO {MART_SCHEMA}.professionals
+        (
+            professional_sk, sexual_orientation, ethnic_group, gender_identity, specialty, state,
+            profile_status, active, total_appointments, avg_feedback_rating
+        )
+        SELECT
+            professional_sk, sexual_orientation, ethnic_group, gender_identity, specialty, state,
+            profile_status, active, total_appointments, avg_feedback_rating
+        FROM src
+        ON CONFLICT (professional_sk) DO UPDATE
+        {update_set(f'{MART_SCHEMA}.professionals', ATUALIZAVEIS['professionals'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # ---------------------------------------------------------------------
     # 4) MART: professional_appointments
     #     PK: (professional_sk, appointment_period, specialty)
     # ---------------------------------------------------------------------
-    conn.execute(text(f"""
-        CREATE TABLE IF NOT EXISTS {MART_SCHEMA}.professional_appointments (
-            professional_sk INT NOT NULL,
-            appointment_period DATE NOT NULL,
-            specialty VARCHAR(255),
-            total_appointments INT,
-            completed_appointments INT,
-            completed_appointments_online INT,
-            completed_appointments_presencial INT,
-            cancelled_appointments_online INT,
-            cancelled_appointments_presencial INT,
-            completion_rate NUMERIC(5,2),
-            cancellation_rate_online NUMERIC(5,2),
-            cancellation_rate_presencial NUMERIC(5,2),
-            avg_waiting_time NUMERIC(10,2),
-            created_at DATE,
-            CONSTRAINT mart_professional_appointments_pk
-                PRIMARY KEY (professional_sk, appointment_period, specialty)
-        );
-    """))
-
-    conn.execute(text(f"""
+    contagens['professional_appointments'] = run_counted_upsert(conn, f"""
         WITH base AS (
             SELECT
                 f.professional_id                                            AS professional_sk,
@@ -307,13 +341,8 @@ def _rodar_etl_mart(conn):
                 MAX(created_at)                                    AS created_at
             FROM base
             GROUP BY 1,2,3
-        )
-        INSERT INTO {MART_SCHEMA}.professional_appointments
-        (
-            professional_sk, appointment_period, specialty,
-            total_appointments, completed_appointments,  completed_appointments_online, completed_appointments_presencial, cancelled_appointments_online, cancelled_appointments_presencial,
-            completion_rate, cancellation_rate_online, cancellation_rate_presencial, avg_waiting_time, created_at
-        )
+        ),
+        src AS (
         SELECT
             professional_sk,
             appointment_period,
@@ -330,23 +359,29 @@ def _rodar_etl_mart(conn):
             avg_waiting_time,
             created_at
         FROM agg
-        ON CONFLICT (professional_sk, appointment_period, specialty) DO UPDATE SET
-            total_appointments      = EXCLUDED.total_appointments,
-            completed_appointments  = EXCLUDED.completed_appointments,
-            completed_appointments_online = EXCLUDED.completed_appointments_online,
-            completed_appointments_presencial = EXCLUDED.completed_appointments_presencial,
-            cancelled_appointments_online = EXCLUDED.cancelled_appointments_online,
-            cancelled_appointments_presencial = EXCLUDED.cancelled_appointments_presencial,
-            cancellation_rate_online = EXCLUDED.cancellation_rate_online,
-            cancellation_rate_presencial = EXCLUDED.cancellation_rate_presencial,
-            completion_rate         = EXCLUDED.completion_rate,
-            avg_waiting_time        = EXCLUDED.avg_waiting_time,
-            created_at              = EXCLUDED.created_at;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO {MART_SCHEMA}.professional_appointments
+        (
+            professional_sk, appointment_period, specialty,
+            total_appointments, completed_appointments,  completed_appointments_online, completed_appointments_presencial, cancelled_appointments_online, cancelled_appointments_presencial,
+            completion_rate, cancellation_rate_online, cancellation_rate_presencial, avg_waiting_time, created_at
+        )
+        SELECT
+            professional_sk, appointment_period, specialty,
+            total_appointments, completed_appointments,  completed_appointments_online, completed_appointments_presencial, cancelled_appointments_online, cancelled_appointments_presencial,
+            completion_rate, cancellation_rate_online, cancellation_rate_presencial, avg_waiting_time, created_at
+        FROM src
+        ON CONFLICT (professional_sk, appointment_period, specialty) DO UPDATE
+        {update_set(f'{MART_SCHEMA}.professional_appointments', ATUALIZAVEIS['professional_appointments'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # Retorna um resumo indicando que o ETL da MART foi executado com sucesso
     return {
         "ok": True,
-        "msg": "MART ETL concluído com sucesso."
+        "msg": "MART ETL concluído com sucesso. " + "; ".join(counts_msg(t, c) for t, c in contagens.items()) + ".",
+        "tabelas": contagens,
     }
 
@@ -0,0 +1,169 @@
+import hashlib
+
+from sqlalchemy import text
+
+from app.utils.logger import get_logger
+
+# Migrações versionadas do schema do ETL (staging_01, staging_02, model, mart e meta).
+#
+# O DDL roda uma única vez por banco: cada versão aplicada fica registrada em
+# META.schema_version e a execução do ETL só lê o catálogo (information_schema) uma vez,
+# sem CREATE ... IF NOT EXISTS nem sondas por tabela no caminho quente.
+#
+# Para mudar o schema, acrescente uma nova versão ao fim de MIGRACOES; nunca altere uma
+# versão já aplicada (o checksum gravado denuncia a diferença no log).
+
+logger = get_logger(__name__)
+
+META = 'lacreisaude_etl_meta'
+# Schemas lidos na consulta única ao catálogo
+SCHEMAS = ('lacreisaude_staging_01', 'lacreisaude_staging_02', 'lacreisaude_model', 'lacreisaude_mart', META)
+
+
+def _ddl_staging02():
+    # import tardio: staging2 importa este módulo
+    from app.routes.etl.staging2 import STAGING2_SPECS
+    from app.routes.etl.table_spec import STAGING02, ddl_sql
+    return [f"CREATE SCHEMA IF NOT EXISTS {STAGING02}"] + [ddl_sql(spec) for spec in STAGING2_SPECS]
+
+
+def _ddl_juncoes_staging02():
+    from app.routes.etl.staging2 import STAGING2_SPECS
+    from app.routes.etl.table_spec import join_ddl_sql
+    return [sql for sql in map(join_ddl_sql, STAGING2_SPECS) if sql]
+
+
+def _ddl_chaves_staging01():
+    from app.routes.etl.staging2 import STAGING2_SPECS
+    from app.routes.etl.table_spec import chave_ddl_sql
+    return [chave_ddl_sql(spec) for spec in STAGING2_SPECS]
+
+
+def _ddl_staging01():
+    from app.routes.etl.staging1 import META_DDL, staging01_ddl
+    return staging01_ddl() + META_DDL
+
+
+def _ddl_sentinela():
+    from app.routes.etl.staging1 import SENTINELA_DDL
+    return SENTINELA_DDL
+
+
+def _ddl_model():
+    from app.routes.etl.model import MODEL_DDL
+    return MODEL_DDL
+
+
+def _ddl_mart():
+    from app.routes.etl.mart import MART_DDL
+    return MART_DDL
+
+
+def _ddl_funcoes():
+    from app.routes.etl.table_spec import FUNCOES_SQL
+    return FUNCOES_SQL
+
+
+def _ddl_status_etapas():
+    # último status de cada etapa do pipeline staging2/model/mart (reexecução só das falhas)
+    return [f"""
+        CREATE TABLE IF NOT EXISTS {META}.etl_step_status (
+            step        TEXT PRIMARY KEY,
+            status      TEXT NOT NULL,
+            msg         TEXT,
+            seconds     NUMERIC,
+            run_started TIMESTAMPTZ NOT NULL,
+            updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """]
+
+
+# (versão, descrição, função que devolve a lista de statements)
+MIGRACOES = [
+    (1, 'staging_02: schema e tabelas das specs', _ddl_staging02),
+    (2, 'model: schema, dimensões, fato e índices', _ddl_model),
+    (3, 'mart: schema e tabelas', _ddl_mart),
+    (4, 'meta: status por etapa do pipeline', _ddl_status_etapas),
+    (5, 'staging2: funções de conversão safe_int, safe_bool e safe_utc_ts', _ddl_funcoes),
+    (6, 'staging_02: índices das chaves de junção e estatísticas estendidas', _ddl_juncoes_staging02),
+    (7, 'staging_01: tabelas, colunas de lote/digest e índice de lote; meta: lotes, checkpoints e marcas d\'água',
+     _ddl_staging01),
+    (8, 'staging_01: sentinela de perda das tabelas UNLOGGED após queda do servidor', _ddl_sentinela),
+    (9, 'staging_01: índices (lote, chave convertida) para o upsert do staging2 em faixas', _ddl_chaves_staging01),
+]
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+# versão já conferida neste processo (evita reler schema_version a cada execução)
+_versao_conferida = None
+
+
+def _checksum(statements):
+    return hashlib.sha1('\n'.join(statements).encode()).hexdigest()
+
+
+def catalog_tables(conn):
+    """Tabelas existentes nos schemas do ETL, numa única leitura do information_schema:
+    {'schema.tabela', ...}."""
+    return {
+        f"{r[0]}.{r[1]}" for r in conn.execute(text("""
+            SELECT table_schema, table_name
+            FROM information_schema.tables
+            WHERE table_schema = ANY(:s)
+        """), {'s': list(SCHEMAS)}).all()
+    }
+
+
+def migrate(engine):
+    """Aplica as migrações pendentes, cada uma em transação própria e sob advisory lock
+    (duas execuções concorrentes não aplicam a mesma versão). Retorna as versões aplicadas."""
+    aplicadas = []
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE SCHEMA IF NOT EXISTS {META};
+            CREATE TABLE IF NOT EXISTS {META}.schema_version (
+                version     INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                checksum    TEXT NOT NULL,
+                applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """))
+    for versao, descricao, ddl in MIGRACOES:
+        statements = ddl()
+        checksum = _checksum(statements)
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('lacreisaude_schema_version'))"))
+            gravado = conn.execute(text(f"SELECT checksum FROM {META}.schema_version WHERE version = :v"),
+                                   {'v': versao}).scalar()
+            if gravado is not None:
+                if gravado != checksum:
+                    logger.warning(f"migração {versao} ({descricao}) mudou depois de aplicada; "
+                                   f"crie uma nova versão em vez de editar a existente")
+                continue
+            for sql in statements:
+                conn.execute(text(sql))
+            conn.execute(text(f"""
+                INSERT INTO {META}.schema_version (version, description, checksum)
+                VALUES (:v, :d, :c)
+            """), {'v': versao, 'd': descricao, 'c': checksum})
+            aplicadas.append(versao)
+            logger.info(f"migração {versao} aplicada: {descricao}")
+    return aplicadas
+
+
+def ensure_schema(engine):
+    """Lê o catálogo uma vez e aplica as migrações só quando o banco ainda não está na
+    versão atual. Retorna (tabelas existentes, versões aplicadas agora)."""
+    global _versao_conferida
+    with engine.connect() as conn:
+        tabelas = catalog_tables(conn)
+        versao = None
+        if f"{META}.schema_version" in tabelas:
+            versao = _versao_conferida or conn.execute(
+                text(f"SELECT MAX(version) FROM {META}.schema_version")).scalar()
+    aplicadas = []
+    if versao != VERSAO_ATUAL:
+        aplicadas = migrate(engine)
+        with engine.connect() as conn:
+            tabelas = catalog_tables(conn)
+    _versao_conferida = VERSAO_ATUAL
+    return tabelas, aplicadas
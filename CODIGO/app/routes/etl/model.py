@@ -1,22 +1,35 @@
 from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
+from app.utils.upsert import counts_msg, run_counted_upsert, update_set
 
-def _rodar_etl_model(conn):
-    """
-    Popula/atualiza o schema lacreisaude_model a partir da staging_02.
-    - Usa chaves naturais com UNIQUE INDEX para garantir idempotência.
-    - Todos os INSERTs usam ON CONFLICT (<colunas>) ... (não por nome de constraint).
-    """
+# Colunas regravadas por cada upsert: o SET e a comparação de mudança saem da mesma
+# tupla (update_set)
+ATUALIZAVEIS = {
+    'dim_lacreisaude_clinic': (
+        'created_at', 'is_presential_clinic', 'is_online_clinic', 'zip_code', 'consult_price',
+        'duration_minutes', 'accepts_insurance_providers', 'provides_accessibility_standards',
+        'online_clinic_consult_price', 'online_clinic_duration_minutes',
+        'online_clinic_accepts_insurance_providers',
+    ),
+    'dim_lacreisaude_professional': (
+        'created_at', 'profile_status', 'active', 'published', 'specialty', 'ethnic_group',
+        'gender_identity', 'pronoun', 'sexual_orientation', 'disability_type',
+    ),
+    'dim_lacreisaude_patient': (
+        'created_at', 'is_active', 'profile_type', 'ethnic_group', 'gender_identity', 'pronoun',
+        'sexual_orientation', 'disability_type',
+    ),
+    'fact_lacreisaude_appointments': (
+        'created_date_id', 'status', 'type', 'date_id', 'waiting_time', 'professional_id',
+        'patient_id', 'clinic_id', 'report_id', 'cancellation_created_at',
+        'cancellation_reason',
+    ),
+}
 
-    # -------------------------------------------------------------------------
-    # 0) Schema
-    # -------------------------------------------------------------------------
-    conn.execute(text("CREATE SCHEMA IF NOT EXISTS lacreisaude_model;"))
-
-    # -------------------------------------------------------------------------
-    # 1) DIM DATE
-    # -------------------------------------------------------------------------
-    conn.execute(text("""
+# DDL do schema do modelo (schema, dimensões, fato e índices). Aplicado uma única vez
+# pela camada de migrações (app/routes/etl/migrations.py), fora da execução do ETL.
+MODEL_DDL = [
+    "CREATE SCHEMA IF NOT EXISTS lacreisaude_model;",
+    """
         CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_date
         (
             date_id       INTEGER PRIMARY KEY, -- datakey no formato YYYYMMDD
@@ -27,8 +40,124 @@ def _rodar_etl_model(conn):
             week          INTEGER NOT NULL,
             quarter       INTEGER NOT NULL
         );
-    """))
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_report
+        (
+            report_id   INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            created_at  TIMESTAMP WITHOUT TIME ZONE,
+            feedback    VARCHAR,
+            evaluation  INTEGER
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_report_created_feedback_eval
+            ON lacreisaude_model.dim_lacreisaude_report (created_at, feedback, evaluation);
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_clinic
+        (
+            clinic_id                               INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            created_at                              TIMESTAMP WITHOUT TIME ZONE,
+            is_presential_clinic                    BOOLEAN,
+            is_online_clinic                        BOOLEAN,
+            name                                    VARCHAR,
+            zip_code                                VARCHAR,
+            city                                    VARCHAR,
+            consult_price                           NUMERIC(10,2),
+            duration_minutes                        INTEGER,
+            accepts_insurance_providers             BOOLEAN,
+            provides_accessibility_standards        BOOLEAN,
+            online_clinic_consult_price             NUMERIC(10,2),
+            online_clinic_duration_minutes          INTEGER,
+            online_clinic_accepts_insurance_providers BOOLEAN,
+            state                                   VARCHAR
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_clinic_name_city_state
+            ON lacreisaude_model.dim_lacreisaude_clinic (name, city, state);
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_professional
+        (
+            professional_id  INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            created_at       TIMESTAMP WITHOUT TIME ZONE,
+            full_name        VARCHAR,
+            profile_status   VARCHAR,
+            active           BOOLEAN,
+            published        BOOLEAN,
+            specialty        VARCHAR,
+            ethnic_group     VARCHAR,
+            gender_identity  VARCHAR,
+            pronoun          VARCHAR,
+            sexual_orientation VARCHAR,
+            profile_type     VARCHAR,
+            disability_type  TEXT[],
+            state            VARCHAR
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_prof_fullname_state
+            ON lacreisaude_model.dim_lacreisaude_professional (full_name, state);
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_patient
+        (
+            patient_id      INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            patient_key     VARCHAR,
+            created_at      TIMESTAMP WITHOUT TIME ZONE,
+            first_name      VARCHAR,
+            last_name       VARCHAR,
+            birth_date      TIMESTAMP WITHOUT TIME ZONE,
+            is_active       BOOLEAN,
+            profile_type    VARCHAR,
+            ethnic_group    VARCHAR,
+            gender_identity VARCHAR,
+            pronoun         VARCHAR,
+            sexual_orientation VARCHAR,
+            disability_type TEXT[]
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_patient_key
+    ON lacreisaude_model.dim_lacreisaude_patient (patient_key);
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS lacreisaude_model.fact_lacreisaude_appointments
+        (
+            id_fact_appointment INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            appointment_fingerprint VARCHAR,
+            created_date_id     INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_date(date_id),
+            status              VARCHAR,
+            type                VARCHAR,
+            date_id             INTEGER NOT NULL REFERENCES lacreisaude_model.dim_lacreisaude_date(date_id),
+            waiting_time        NUMERIC,
+            professional_id     INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_professional(professional_id),
+            patient_id          INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_patient(patient_id),
+            clinic_id           INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_clinic(clinic_id),
+            report_id           INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_report(report_id),
+            -- Denormalized cancellation attributes (no source ids stored in dims)
+            cancellation_created_at TIMESTAMP WITHOUT TIME ZONE,
+            cancellation_reason     VARCHAR
+        );
+        CREATE INDEX IF NOT EXISTS idx_fact_date_id          ON lacreisaude_model.fact_lacreisaude_appointments(date_id);
+        CREATE INDEX IF NOT EXISTS idx_fact_created_date_id  ON lacreisaude_model.fact_lacreisaude_appointments(created_date_id);
+        CREATE INDEX IF NOT EXISTS idx_fact_professional_id  ON lacreisaude_model.fact_lacreisaude_appointments(professional_id);
+        CREATE INDEX IF NOT EXISTS idx_fact_patient_id       ON lacreisaude_model.fact_lacreisaude_appointments(patient_id);
+        CREATE INDEX IF NOT EXISTS idx_fact_report_id        ON lacreisaude_model.fact_lacreisaude_appointments(report_id);
+        CREATE INDEX IF NOT EXISTS idx_fact_cancellation_created_at ON lacreisaude_model.fact_lacreisaude_appointments(cancellation_created_at);
+        CREATE INDEX IF NOT EXISTS idx_fact_clinic_id        ON lacreisaude_model.fact_lacreisaude_appointments(clinic_id);
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_appointment_fingerprint
+            ON lacreisaude_model.fact_lacreisaude_appointments (appointment_fingerprint);
+    """,
+]
+
+def _rodar_etl_model(conn):
+    """
+    Popula/atualiza o schema lacreisaude_model a partir da staging_02.
+    - Usa chaves naturais com UNIQUE INDEX para garantir idempotência.
+    - As tabelas já existem (MODEL_DDL, aplicado pelas migrações).
+    - Todos os INSERTs usam ON CONFLICT (<colunas>) ... (não por nome de constraint).
+    - Os DO UPDATE só regravam linhas com valores diferentes (ETL_SKIP_UNCHANGED).
+    """
+    contagens = {}
 
+    # -------------------------------------------------------------------------
+    # 1) DIM DATE
+    # -------------------------------------------------------------------------
     # Popula dim_lacreisaude_date incrementalmente.
     # Determina min/max das datas da staging_02.lacreiid_appointment, encontra a maior data atual na dim e 
     # gera apenas as datas faltantes usando generate_series  
@@ -96,18 +225,6 @@ def _rodar_etl_model(conn):
     # -------------------------------------------------------------------------
     # 3) DIM REPORT  (chave natural: created_at, feedback, evaluation)
     # -------------------------------------------------------------------------
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_report
-        (
-            report_id   INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            created_at  TIMESTAMP WITHOUT TIME ZONE,
-            feedback    VARCHAR,
-            evaluation  INTEGER
-        );
-        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_report_created_feedback_eval
-            ON lacreisaude_model.dim_lacreisaude_report (created_at, feedback, evaluation);
-    """))
-
     conn.execute(text("""
         INSERT INTO lacreisaude_model.dim_lacreisaude_report (created_at, feedback, evaluation)
         SELECT DISTINCT r.created_at, r.feedback, r.eval
@@ -119,37 +236,8 @@ def _rodar_etl_model(conn):
     # -------------------------------------------------------------------------
     # 4) DIM CLINIC  (chave natural: name, city, state)
     # -------------------------------------------------------------------------
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_clinic
-        (
-            clinic_id                               INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            created_at                              TIMESTAMP WITHOUT TIME ZONE,
-            is_presential_clinic                    BOOLEAN,
-            is_online_clinic                        BOOLEAN,
-            name                                    VARCHAR,
-            zip_code                                VARCHAR,
-            city                                    VARCHAR,
-            consult_price                           NUMERIC(10,2),
-            duration_minutes                        INTEGER,
-            accepts_insurance_providers             BOOLEAN,
-            provides_accessibility_standards        BOOLEAN,
-            online_clinic_consult_price             NUMERIC(10,2),
-            online_clinic_duration_minutes          INTEGER,
-            online_clinic_accepts_insurance_providers BOOLEAN,
-            state                                   VARCHAR
-        );
-        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_clinic_name_city_state
-            ON lacreisaude_model.dim_lacreisaude_clinic (name, city, state);
-    """))
-
-    conn.execute(text("""
-        INSERT INTO lacreisaude_model.dim_lacreisaude_clinic
-        (
-            created_at, is_presential_clinic, is_online_clinic, name, zip_code, city,
-            consult_price, duration_minutes, accepts_insurance_providers,
-            provides_accessibility_standards, online_clinic_consult_price,
-            online_clinic_duration_minutes, online_clinic_accepts_insurance_providers, state
-        )
+    contagens['dim_lacreisaude_clinic'] = run_counted_upsert(conn, f"""
+        WITH src AS (
         SELECT DISTINCT
             c.created_at, c.is_presential_clinic, c.is_online_clinic, c.name, c.zip_code, c.city,
             c.consult_price, c.duration_minutes, c.accepts_insurance_providers,
@@ -160,46 +248,31 @@ def _rodar_etl_model(conn):
             LEFT JOIN lacreisaude_staging_02.address_state s
             ON s.id = c.state_id
         WHERE c.name IS NOT NULL
-        ON CONFLICT (name, city, state) DO UPDATE SET
-            created_at                       = EXCLUDED.created_at,
-            is_presential_clinic             = EXCLUDED.is_presential_clinic,
-            is_online_clinic                 = EXCLUDED.is_online_clinic,
-            zip_code                         = EXCLUDED.zip_code,
-            consult_price                    = EXCLUDED.consult_price,
-            duration_minutes                 = EXCLUDED.duration_minutes,
-            accepts_insurance_providers      = EXCLUDED.accepts_insurance_providers,
-            provides_accessibility_standards = EXCLUDED.provides_accessibility_standards,
-            online_clinic_consult_price      = EXCLUDED.online_clinic_consult_price,
-            online_clinic_duration_minutes   = EXCLUDED.online_clinic_duration_minutes,
-            online_clinic_accepts_insurance_providers = EXCLUDED.online_clinic_accepts_insurance_providers;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO lacreisaude_model.dim_lacreisaude_clinic
+        (
+            created_at, is_presential_clinic, is_online_clinic, name, zip_code, city,
+            consult_price, duration_minutes, accepts_insurance_providers,
+            provides_accessibility_standards, online_clinic_consult_price,
+            online_clinic_duration_minutes, online_clinic_accepts_insurance_providers, state
+        )
+        SELECT
+            created_at, is_presential_clinic, is_online_clinic, name, zip_code, city,
+            consult_price, duration_minutes, accepts_insurance_providers,
+            provides_accessibility_standards, online_clinic_consult_price,
+            online_clinic_duration_minutes, online_clinic_accepts_insurance_providers, state
+        FROM src
+        ON CONFLICT (name, city, state) DO UPDATE
+        {update_set('lacreisaude_model.dim_lacreisaude_clinic', ATUALIZAVEIS['dim_lacreisaude_clinic'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # -------------------------------------------------------------------------
     # 5) DIM PROFESSIONAL  (chave natural: full_name, state)
     # -------------------------------------------------------------------------
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_professional
-        (
-            professional_id  INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            created_at       TIMESTAMP WITHOUT TIME ZONE,
-            full_name        VARCHAR,
-            profile_status   VARCHAR,
-            active           BOOLEAN,
-            published        BOOLEAN,
-            specialty        VARCHAR,
-            ethnic_group     VARCHAR,
-            gender_identity  VARCHAR,
-            pronoun          VARCHAR,
-            sexual_orientation VARCHAR,
-            profile_type     VARCHAR,
-            disability_type  TEXT[],
-            state            VARCHAR
-        );
-        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_prof_fullname_state
-            ON lacreisaude_model.dim_lacreisaude_professional (full_name, state);
-    """))
-
-    conn.execute(text("""
+    contagens['dim_lacreisaude_professional'] = run_counted_upsert(conn, f"""
         WITH disab AS (
             SELECT pdt.professional_id,
                 ARRAY_REMOVE(ARRAY_AGG(dt.name::text), NULL) AS disab_arr
@@ -207,13 +280,8 @@ def _rodar_etl_model(conn):
             LEFT JOIN lacreisaude_staging_02.lacreiid_disabilitytype dt
             ON pdt.disabilitytype_id = dt.id
             GROUP BY pdt.professional_id
-        )
-        INSERT INTO lacreisaude_model.dim_lacreisaude_professional
-        (
-            created_at, full_name, profile_status, active, published, specialty,
-            ethnic_group, gender_identity, pronoun, sexual_orientation, profile_type,
-            disability_type, state
-        )
+        ),
+        src AS (
         SELECT DISTINCT
             p.created_at, p.full_name, p.profile_status, p.active, p.published, p.specialty,
             COALESCE(eg.name::text, p.ethnic_group::text) AS ethnic_group,
@@ -232,44 +300,29 @@ def _rodar_etl_model(conn):
         LEFT JOIN lacreisaude_staging_02.lacrei_privacydocument pd ON pd.id = p.privacy_document_id
         LEFT JOIN lacreisaude_staging_02.address_state s_prof ON s_prof.id = p.state_id
         WHERE p.full_name IS NOT NULL
-        ON CONFLICT (full_name, state) DO UPDATE SET
-            created_at        = EXCLUDED.created_at,
-            profile_status    = EXCLUDED.profile_status,
-            active            = EXCLUDED.active,
-            published         = EXCLUDED.published,
-            specialty         = EXCLUDED.specialty,
-            ethnic_group      = EXCLUDED.ethnic_group,
-            gender_identity   = EXCLUDED.gender_identity,
-            pronoun           = EXCLUDED.pronoun,
-            sexual_orientation= EXCLUDED.sexual_orientation,
-            disability_type   = EXCLUDED.disability_type;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO lacreisaude_model.dim_lacreisaude_professional
+        (
+            created_at, full_name, profile_status, active, published, specialty,
+            ethnic_group, gender_identity, pronoun, sexual_orientation, profile_type,
+            disability_type, state
+        )
+        SELECT
+            created_at, full_name, profile_status, active, published, specialty,
+            ethnic_group, gender_identity, pronoun, sexual_orientation, profile_type,
+            disability_type, state
+        FROM src
+        ON CONFLICT (full_name, state) DO UPDATE
+        {update_set('lacreisaude_model.dim_lacreisaude_professional', ATUALIZAVEIS['dim_lacreisaude_professional'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # -------------------------------------------------------------------------
     # 6) DIM PATIENT  (chave natural: patient_key (hash de first_name, last_name, birth_date))
     # -------------------------------------------------------------------------
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS lacreisaude_model.dim_lacreisaude_patient
-        (
-            patient_id      INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            patient_key     VARCHAR,
-            created_at      TIMESTAMP WITHOUT TIME ZONE,
-            first_name      VARCHAR,
-            last_name       VARCHAR,
-            birth_date      TIMESTAMP WITHOUT TIME ZONE,
-            is_active       BOOLEAN,
-            profile_type    VARCHAR,
-            ethnic_group    VARCHAR,
-            gender_identity VARCHAR,
-            pronoun         VARCHAR,
-            sexual_orientation VARCHAR,
-            disability_type TEXT[]
-        );
-        CREATE UNIQUE INDEX IF NOT EXISTS ux_dim_patient_key
-    ON lacreisaude_model.dim_lacreisaude_patient (patient_key);
-    """))
-
-    conn.execute(text("""
+    contagens['dim_lacreisaude_patient'] = run_counted_upsert(conn, f"""
         WITH prof_disab AS (
          SELECT pdt.profile_id,
              ARRAY_REMOVE(ARRAY_AGG(dt.name::text), NULL) AS disab_arr
@@ -303,62 +356,35 @@ def _rodar_etl_model(conn):
          LEFT JOIN lacreisaude_staging_02.lacreiid_pronoun prn_pr ON prn_pr.id = pr.pronoun
          LEFT JOIN lacreisaude_staging_02.lacreiid_sexualorientation so_pr ON so_pr.id = pr.sexual_orientation
          WHERE pd.profile_type = 'Paciente'  -- Considerar apenas profiles do tipo Paciente (alterar para o tipo correto se necessário)
-        )
-        INSERT INTO lacreisaude_model.dim_lacreisaude_patient
-        (
-            patient_key, created_at, first_name, last_name, birth_date, is_active, profile_type,
-            ethnic_group, gender_identity, pronoun, sexual_orientation, disability_type
-        )
+        ),
+        src AS (
         SELECT DISTINCT
             md5(lower(coalesce(first_name,'') || '|' || coalesce(last_name,'') || '|' || coalesce(birth_date::text,''))) AS patient_key,
             created_at, first_name, last_name, birth_date, is_active, profile_type,
             ethnic_group, gender_identity, pronoun, sexual_orientation, disability_type
         FROM base
         WHERE first_name IS NOT NULL OR last_name IS NOT NULL OR birth_date IS NOT NULL
-        ON CONFLICT (patient_key) DO UPDATE SET
-            created_at       = EXCLUDED.created_at,
-            is_active        = EXCLUDED.is_active,
-            profile_type     = EXCLUDED.profile_type,
-            ethnic_group     = EXCLUDED.ethnic_group,
-            gender_identity  = EXCLUDED.gender_identity,
-            pronoun          = EXCLUDED.pronoun,
-            sexual_orientation = EXCLUDED.sexual_orientation,
-            disability_type  = EXCLUDED.disability_type;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO lacreisaude_model.dim_lacreisaude_patient
+        (
+            patient_key, created_at, first_name, last_name, birth_date, is_active, profile_type,
+            ethnic_group, gender_identity, pronoun, sexual_orientation, disability_type
+        )
+        SELECT
+            patient_key, created_at, first_name, last_name, birth_date, is_active, profile_type,
+            ethnic_group, gender_identity, pronoun, sexual_orientation, disability_type
+        FROM src
+        ON CONFLICT (patient_key) DO UPDATE
+        {update_set('lacreisaude_model.dim_lacreisaude_patient', ATUALIZAVEIS['dim_lacreisaude_patient'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # -------------------------------------------------------------------------
     # 7) FACT APPOINTMENTS
     # -------------------------------------------------------------------------
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS lacreisaude_model.fact_lacreisaude_appointments
-        (
-            id_fact_appointment INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
-            appointment_fingerprint VARCHAR,
-            created_date_id     INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_date(date_id),
-            status              VARCHAR,
-            type                VARCHAR,
-            date_id             INTEGER NOT NULL REFERENCES lacreisaude_model.dim_lacreisaude_date(date_id),
-            waiting_time        NUMERIC,
-            professional_id     INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_professional(professional_id),
-            patient_id          INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_patient(patient_id),
-            clinic_id           INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_clinic(clinic_id),
-            report_id           INTEGER REFERENCES lacreisaude_model.dim_lacreisaude_report(report_id),
-            -- Denormalized cancellation attributes (no source ids stored in dims)
-            cancellation_created_at TIMESTAMP WITHOUT TIME ZONE,
-            cancellation_reason     VARCHAR
-        );
-        CREATE INDEX IF NOT EXISTS idx_fact_date_id          ON lacreisaude_model.fact_lacreisaude_appointments(date_id);
-        CREATE INDEX IF NOT EXISTS idx_fact_created_date_id  ON lacreisaude_model.fact_lacreisaude_appointments(created_date_id);
-        CREATE INDEX IF NOT EXISTS idx_fact_professional_id  ON lacreisaude_model.fact_lacreisaude_appointments(professional_id);
-        CREATE INDEX IF NOT EXISTS idx_fact_patient_id       ON lacreisaude_model.fact_lacreisaude_appointments(patient_id);
-        CREATE INDEX IF NOT EXISTS idx_fact_report_id        ON lacreisaude_model.fact_lacreisaude_appointments(report_id);
-        CREATE INDEX IF NOT EXISTS idx_fact_cancellation_created_at ON lacreisaude_model.fact_lacreisaude_appointments(cancellation_created_at);
-        CREATE INDEX IF NOT EXISTS idx_fact_clinic_id        ON lacreisaude_model.fact_lacreisaude_appointments(clinic_id);
-        CREATE UNIQUE INDEX IF NOT EXISTS ux_fact_appointment_fingerprint
-            ON lacreisaude_model.fact_lacreisaude_appointments (appointment_fingerprint);
-    """))
-
-    conn.execute(text("""
+    contagens['fact_lacreisaude_appointments'] = run_counted_upsert(conn, f"""
         WITH ap AS (
             SELECT
                 a.id,
@@ -490,15 +516,10 @@ def _rodar_etl_model(conn):
                                    AND COALESCE(dr.evaluation, -2147483648) = COALESCE(rs.eval, -2147483648)
 
             LEFT JOIN canc_src cs  ON cs.appointment_id = ap.id::varchar
-        )
+        ),
         -- Compute a deterministic fingerprint for each appointment (hashed source id)
         -- We store only the hash to avoid keeping source IDs in the model
-        INSERT INTO lacreisaude_model.fact_lacreisaude_appointments
-        (
-            appointment_fingerprint, created_date_id, status, type, date_id, waiting_time,
-            professional_id, patient_id, clinic_id, report_id,
-            cancellation_created_at, cancellation_reason
-        )
+        src AS (
         SELECT DISTINCT
             md5(COALESCE(j.src_appointment_id::text, '') || '|' || COALESCE(j.date_id::text, '')) AS appointment_fingerprint,
             j.created_date_id, j.status, j.type, j.date_id, j.waiting_time,
@@ -513,23 +534,34 @@ def _rodar_etl_model(conn):
                 NULL AS first_name, NULL AS last_name
             FROM joined ap
         ) j
-        ON CONFLICT (appointment_fingerprint) DO UPDATE SET
-            created_date_id = EXCLUDED.created_date_id,
-            status = EXCLUDED.status,
-            type = EXCLUDED.type,
-            date_id = EXCLUDED.date_id,
-            waiting_time = EXCLUDED.waiting_time,
-            professional_id = EXCLUDED.professional_id,
-            patient_id = EXCLUDED.patient_id,
-            clinic_id = EXCLUDED.clinic_id,
-            report_id = EXCLUDED.report_id,
-            cancellation_created_at = EXCLUDED.cancellation_created_at,
-            cancellation_reason = EXCLUDED.cancellation_reason;
-    """))
+        ),
+        upsert AS (
+        INSERT INTO lacreisaude_model.fact_lacreisaude_appointments
+        (
+            appointment_fingerprint, created_date_id, status, type, date_id, waiting_time,
+            professional_id, patient_id, clinic_id, report_id,
+            cancellation_created_at, cancellation_reason
+        )
+        SELECT
+            appointment_fingerprint, created_date_id, status, type, date_id, waiting_time,
+            professional_id, patient_id, clinic_id, report_id,
+            cancellation_created_at, cancellation_reason
+        FROM src
+        ON CONFLICT (appointment_fingerprint) DO UPDATE
+        {update_set('lacreisaude_model.fact_lacreisaude_appointments', ATUALIZAVEIS['fact_lacreisaude_appointments'])}
+        RETURNING (xmax = 0) AS inserted_flag
+        )
+    """)
 
     # Anonimiza os campos first_name e last_name após uso nos joins (adicionar outros campos sensíveis de outras tabelas se necessário)
     conn.execute(text("""
         UPDATE lacreisaude_model.dim_lacreisaude_patient
-        SET first_name = NULL, last_name = NULL;
+        SET first_name = NULL, last_name = NULL
+        WHERE first_name IS NOT NULL OR last_name IS NOT NULL;
     """))
-    return {"ok": True, "msg": "ETL do modelo concluído (dimensões e fato atualizados e nomes anonimizados)."}
\ No newline at end of file
+    return {
+        "ok": True,
+        "msg": "ETL do modelo concluído (dimensões e fato atualizados e nomes anonimizados). "
+               + "; ".join(counts_msg(t, c) for t, c in contagens.items()) + ".",
+        "tabelas": contagens,
+    }
\ No newline at end of file
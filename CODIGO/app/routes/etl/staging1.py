@@ -1,11 +1,33 @@
 
-from flask import Blueprint, jsonify
-from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
+from flask import Blueprint, jsonify, request, session
+from flasgger import swag_from
+from sqlalchemy import event, text
 from app.db.engine import get_engine
+from app.routes.etl.migrations import ensure_schema
+from app.utils.logger import get_logger
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from psycopg2.extensions import adapt
+from psycopg2.extras import execute_values
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, Field, File, MultipartDecoder
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import json
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import date, datetime
+from decimal import Decimal
 
 bp_staging1 = Blueprint('upload_staging1', __name__)
 engine = get_engine()
@@ -15,10 +37,304 @@ source_engine = None
 if SOURCE_DATABASE_URL:
     source_engine = create_engine(SOURCE_DATABASE_URL)
 
+# Modo de extração da fonte para o staging_01:
+#   - 'insert': SELECT projetado + INSERT das linhas lidas (comportamento original)
+#   - 'copy'  : COPY ... TO STDOUT na fonte direto para COPY ... FROM STDIN no destino
+#   - 'stream': cursor nomeado (server-side) na fonte + INSERTs multi-linha em lotes
+#   - 'files' : lê exportações do parceiro (CSV/JSONL/Parquet/XLSX) em STAGING1_FILES_DIR
+#   - 'fdw'   : postgres_fdw no destino; INSERT ... SELECT da tabela estrangeira, sem passar pelo app
+STAGING1_MODE = os.getenv('STAGING1_MODE', 'insert')
+STAGING1_MODES = ('insert', 'copy', 'stream', 'files', 'fdw')
+# Modo 'fdw': servidor estrangeiro (criado a partir de SOURCE_DATABASE_URL), schema local
+# onde as tabelas da fonte são importadas e linhas por ida-e-volta do fdw (fetch_size)
+STAGING1_FDW_SERVER = os.getenv('STAGING1_FDW_SERVER', 'lacrei_source')
+STAGING1_FDW_SCHEMA = os.getenv('STAGING1_FDW_SCHEMA', 'lacreisaude_fdw_source')
+STAGING1_FDW_FETCH_SIZE = int(os.getenv('STAGING1_FDW_FETCH_SIZE', '10000'))
+# Modo 'files': pasta com um arquivo por tabela (<tabela>.csv, .csv.gz, .jsonl, .jsonl.gz,
+# .ndjson, .parquet ou .xlsx) e linhas lidas/gravadas (COPY) por bloco
+STAGING1_FILES_DIR = os.getenv('STAGING1_FILES_DIR')
+STAGING1_FILE_CHUNK_ROWS = int(os.getenv('STAGING1_FILE_CHUNK_ROWS', '50000'))
+# Upload HTTP (POST /upload/staging1/<tabela>): token do parceiro (Authorization: Bearer)
+# e tamanho dos blocos lidos da requisição
+STAGING1_UPLOAD_TOKEN = os.getenv('STAGING1_UPLOAD_TOKEN')
+STAGING1_UPLOAD_CHUNK_BYTES = int(os.getenv('STAGING1_UPLOAD_CHUNK_BYTES', str(256 * 1024)))
+# Linhas buscadas por FETCH no cursor da fonte e gravadas por INSERT no modo 'stream'
+STAGING1_BATCH_SIZE = int(os.getenv('STAGING1_BATCH_SIZE', '5000'))
+# Extração incremental por marca d'água (high-water mark) por tabela; full_refresh ignora a marca
+STAGING1_INCREMENTAL = os.getenv('STAGING1_INCREMENTAL', 'true').lower() in ('1', 'true', 'sim')
+# Colunas candidatas a marca d'água, em ordem de preferência
+WATERMARK_COLUMNS = ('updated_at', 'created_at', 'id')
+# Marca em updated_at/created_at: relê também os últimos N segundos antes da marca, para pegar
+# linhas confirmadas depois do MAX lido com horário anterior a ele (transações longas);
+# as repetidas são deduplicadas pelo staging2. 0 desliga. Não se aplica à marca em id
+STAGING1_WATERMARK_OVERLAP_SECONDS = int(os.getenv('STAGING1_WATERMARK_OVERLAP_SECONDS', '300'))
+# Tabelas extraídas em paralelo (1 = sequencial); cada tabela ou faixa é copiada em
+# transação própria e registrada no checkpoint do lote
+STAGING1_WORKERS = int(os.getenv('STAGING1_WORKERS', '1'))
+# Modo paralelo: tabelas com mais linhas estimadas (pg_class.reltuples) que isso são
+# divididas em faixas de id/created_at copiadas em paralelo (0 desliga)
+STAGING1_CHUNK_ROWS = int(os.getenv('STAGING1_CHUNK_ROWS', '500000'))
+# Novas tentativas de uma faixa que falhou (sem reiniciar a tabela inteira)
+STAGING1_CHUNK_RETRIES = int(os.getenv('STAGING1_CHUNK_RETRIES', '2'))
+# Tipos aceitos como coluna de particionamento das faixas
+CHUNK_COLUMN_TYPES = {
+    'id': ('smallint', 'integer', 'bigint', 'numeric'),
+    'created_at': ('timestamp with time zone', 'timestamp without time zone', 'date'),
+}
 
-def _create_staging01_tables(conn):
-    # Cria schema e tabelas de staging_01 com colunas em TEXT (raw/texto)
-    conn.execute(text("""
+# Lotes de carga (batch) com linhas de cada tabela mantidos no staging_01; os mais
+# antigos são apagados ao fim de cada execução/upload
+STAGING1_KEEP_BATCHES = int(os.getenv('STAGING1_KEEP_BATCHES', '2'))
+
+# Extração consistente: todas as leituras na fonte usam o mesmo snapshot exportado
+# (pg_export_snapshot) por uma transação REPEATABLE READ aberta durante a execução
+STAGING1_SNAPSHOT = os.getenv('STAGING1_SNAPSHOT', 'false').lower() in ('1', 'true', 'sim')
+
+# Proteção da fonte (banco de produção do app) durante a extração; 0 desliga cada limite:
+#   - linhas/s e bytes/s lidos da fonte, somando todos os workers
+#   - conexões simultâneas na fonte (unidades copiando ao mesmo tempo)
+#   - recuo adaptativo: se o custo por linha/byte de uma leitura passar de
+#     STAGING1_BACKOFF_RATIO vezes a referência da tabela, a extração reduz seu ritmo
+STAGING1_MAX_ROWS_PER_SEC = float(os.getenv('STAGING1_MAX_ROWS_PER_SEC', '0'))
+STAGING1_MAX_BYTES_PER_SEC = float(os.getenv('STAGING1_MAX_BYTES_PER_SEC', '0'))
+STAGING1_MAX_SOURCE_CONNECTIONS = int(os.getenv('STAGING1_MAX_SOURCE_CONNECTIONS', '0'))
+STAGING1_BACKOFF_RATIO = float(os.getenv('STAGING1_BACKOFF_RATIO', '0'))
+
+# Armazenamento dos schemas de staging (staging_01 e staging_02), cópias reconstruíveis:
+#   - 'logged'  : tabelas normais, com WAL (padrão)
+#   - 'unlogged': tabelas UNLOGGED (sem WAL); cargas completas do staging_01 fazem
+#                 TRUNCATE + carga. Model e mart continuam sempre logged.
+STAGING_STORAGE = os.getenv('STAGING_STORAGE', 'logged')
+STAGING_STORAGES = ('logged', 'unlogged')
+
+logger = get_logger(__name__)
+
+# id do snapshot exportado em uso pela thread atual (None = leitura normal)
+_source_snapshot = threading.local()
+
+
+def _attach_source_snapshot(dbapi_conn, connection_record, connection_proxy):
+    # toda conexão retirada do pool da fonte por uma thread com snapshot ativo
+    # abre sua transação já presa a ele, antes de qualquer consulta
+    snapshot_id = getattr(_source_snapshot, 'id', None)
+    if snapshot_id is None:
+        return
+    cur = dbapi_conn.cursor()
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+    cur.execute(f'SET TRANSACTION SNAPSHOT {_sql_literal(snapshot_id)}')
+    cur.close()
+
+
+if source_engine is not None:
+    event.listen(source_engine, 'checkout', _attach_source_snapshot)
+
+
+class _SourceThrottle:
+    """Limita a carga da extração na fonte, compartilhado por todos os workers da execução.
+    - consume(): limite de taxa (linhas/s e bytes/s) por relógio virtual, com até 1s de rajada
+    - slot(): semáforo de conexões simultâneas na fonte
+    - observe(): recuo adaptativo; se a latência por linha/byte sobe acima da referência
+      da tabela, reduz o ciclo de trabalho pela metade e recupera aos poucos quando normaliza"""
+
+    FATOR_MINIMO = 0.05
+    PAUSA_MAXIMA = 30.0
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, rows_per_sec=0, bytes_per_sec=0, max_connections=0, backoff_ratio=0):
+        self.rows_per_sec = rows_per_sec or 0
+        self.bytes_per_sec = bytes_per_sec or 0
+        self.max_connections = max_connections or 0
+        self.backoff_ratio = backoff_ratio or 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections) if max_connections > 0 else None
+        self._livre = time.monotonic()
+        self._fator = 1.0
+        self._referencia = {}
+        self.stats = {
+            'rows': 0,
+            'bytes': 0,
+            'sleep_seconds': 0.0,
+            'slot_wait_seconds': 0.0,
+            'backoffs': 0,
+            'min_factor': 1.0,
+        }
+
+    @property
+    def mede_bytes(self):
+        return self.bytes_per_sec > 0
+
+    def _dormir(self, segundos):
+        if segundos <= 0:
+            return
+        time.sleep(segundos)
+        with self._lock:
+            self.stats['sleep_seconds'] += segundos
+
+    @contextmanager
+    def slot(self):
+        if self._slots is None:
+            yield
+            return
+        inicio = time.perf_counter()
+        self._slots.acquire()
+        with self._lock:
+            self.stats['slot_wait_seconds'] += time.perf_counter() - inicio
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def consume(self, rows=0, nbytes=0):
+        """Contabiliza linhas/bytes lidos e espera o necessário para manter a taxa."""
+        with self._lock:
+            self.stats['rows'] += rows
+            self.stats['bytes'] += nbytes
+            custo = 0.0
+            # com recuo ativo, a taxa permitida cai junto com o fator
+            if self.rows_per_sec:
+                custo = max(custo, rows / (self.rows_per_sec * self._fator))
+            if self.bytes_per_sec:
+                custo = max(custo, nbytes / (self.bytes_per_sec * self._fator))
+            if not custo:
+                return
+            agora = time.monotonic()
+            self._livre = max(self._livre, agora - 1.0) + custo
+            espera = self._livre - agora
+        self._dormir(espera)
+
+    def observe(self, chave, segundos, unidades):
+        """Registra a latência de uma leitura na fonte (`unidades` linhas ou bytes da
+        tabela `chave`) e pausa proporcionalmente se a extração estiver em recuo."""
+        if not self.backoff_ratio or unidades <= 0 or segundos <= 0:
+            return
+        custo = segundos / unidades
+        with self._lock:
+            referencia = self._referencia.get(chave)
+            if referencia is None:
+                self._referencia[chave] = custo
+                return
+            if custo > referencia * self.backoff_ratio:
+                self._fator = max(self._fator / 2, self.FATOR_MINIMO)
+                self.stats['backoffs'] += 1
+                self.stats['min_factor'] = min(self.stats['min_factor'], self._fator)
+            else:
+                # referência acompanha devagar a latência normal da tabela
+                self._referencia[chave] = 0.9 * referencia + 0.1 * custo
+                self._fator = min(1.0, self._fator + 0.05)
+            # ciclo de trabalho: para cada segundo lendo, pausa (1/fator - 1) segundos
+            pausa = min(segundos * (1 / self._fator - 1), self.PAUSA_MAXIMA)
+        self._dormir(pausa)
+
+    def resumo(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                sleep_seconds=round(self.stats['sleep_seconds'], 3),
+                slot_wait_seconds=round(self.stats['slot_wait_seconds'], 3),
+                max_rows_per_sec=self.rows_per_sec or None,
+                max_bytes_per_sec=self.bytes_per_sec or None,
+                max_source_connections=self.max_connections or None,
+                backoff_ratio=self.backoff_ratio or None,
+            )
+
+
+# limites da execução em andamento (reconfigurado a cada criar_popular_staging1)
+_source_throttle = _SourceThrottle()
+
+
+def _current_rss_mb():
+    """Memória residente atual do processo (MB, de /proc/self/statm), ou None fora do Linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            paginas = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+
+class _RssSampler:
+    """Pico de memória residente de uma execução: RSS no início e o maior valor amostrado
+    depois (a cada lote/bloco lido, no máximo a cada `intervalo` segundos). O ru_maxrss do
+    getrusage é o pico da vida inteira do processo e, num worker Flask de longa duração,
+    mostraria a maior execução já feita, não esta."""
+
+    def __init__(self, intervalo=0.05):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.inicio = _current_rss_mb()
+            self.pico = self.inicio
+            self._ultima = time.monotonic()
+
+    def sample(self, forcar=False):
+        agora = time.monotonic()
+        if not forcar and agora - self._ultima < self.intervalo:
+            return
+        atual = _current_rss_mb()
+        with self._lock:
+            self._ultima = agora
+            if atual is not None and (self.pico is None or atual > self.pico):
+                self.pico = atual
+
+    def resumo(self):
+        self.sample(forcar=True)
+        delta = None if self.inicio is None or self.pico is None else round(self.pico - self.inicio, 1)
+        return {'rss_start_mb': self.inicio, 'rss_peak_mb': self.pico, 'rss_peak_delta_mb': delta}
+
+
+# memória da extração em andamento (as execuções do staging1 são serializadas pelo _run_lock)
+_run_rss = _RssSampler()
+
+
+def _approx_bytes(linhas):
+    # tamanho aproximado das linhas lidas (valores já vêm como texto da fonte)
+    return sum(len(v) for r in linhas for v in r if v is not None)
+
+
+@contextmanager
+def _exported_snapshot(enabled):
+    """Abre uma transação REPEATABLE READ na fonte e exporta seu snapshot.
+    A transação fica aberta (e o snapshot válido) até o fim do bloco."""
+    if not enabled or source_engine is None:
+        yield None
+        return
+    with source_engine.connect() as snap_conn:
+        snap_conn.execution_options(isolation_level='REPEATABLE READ')
+        snapshot_id = snap_conn.execute(text('SELECT pg_export_snapshot()')).scalar()
+        logger.info(f"staging1: snapshot da fonte exportado ({snapshot_id})")
+        try:
+            yield snapshot_id
+        finally:
+            snap_conn.rollback()
+
+
+@contextmanager
+def _run_lock():
+    """Advisory lock de sessão que serializa as extrações do staging1, mantido numa
+    conexão dedicada durante toda a execução. Entrega False se outra extração já o
+    detém: lotes 'running' são tratados como interrompidos (retomados ou descartados),
+    então duas execuções simultâneas apagariam uma o lote da outra."""
+    with engine.connect() as lock_conn:
+        obtido = lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext('lacreisaude_staging1'))")).scalar()
+        # o lock é da sessão: não deixa a conexão parada dentro de transação
+        lock_conn.commit()
+        try:
+            yield obtido
+        finally:
+            if obtido:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext('lacreisaude_staging1'))"))
+                lock_conn.commit()
+
+
+# DDL do staging_01 (colunas em TEXT, raw/texto) e dos metadados de controle do ETL.
+# Aplicado uma única vez pela camada de migrações (app/routes/etl/migrations.py), fora da
+# execução do ETL: nada de ALTER TABLE/CREATE INDEX (e seus locks) a cada carga ou upload.
+STAGING01_TABLES_DDL = """
         CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_01;
 
         CREATE TABLE IF NOT EXISTS lacreisaude_staging_01.lacrei_privacydocument (
@@ -239,7 +555,341 @@ def _create_staging01_tables(conn):
             active TEXT,
             country_id TEXT
         );
-    """))
+"""
+
+
+def staging01_ddl():
+    # tabelas, mais lote de carga, horário de carga e digest (md5) do conteúdo de cada linha
+    return [STAGING01_TABLES_DDL] + [f"""
+        ALTER TABLE lacreisaude_staging_01.{t}
+            ADD COLUMN IF NOT EXISTS _batch_id BIGINT,
+            ADD COLUMN IF NOT EXISTS _loaded_at TIMESTAMPTZ DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS _row_digest TEXT;
+        CREATE INDEX IF NOT EXISTS ix_{t}__batch_id ON lacreisaude_staging_01.{t} (_batch_id);
+    """ for t in STAGING1_TABLES]
+
+
+# Metadados de controle do ETL (lotes, checkpoints e marcas d'água do staging1 e do staging2)
+META_DDL = ["""
+        CREATE SCHEMA IF NOT EXISTS lacreisaude_etl_meta;
+
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging1_watermark (
+            table_name       TEXT PRIMARY KEY,
+            watermark_column TEXT NOT NULL,
+            watermark_value  TEXT,
+            rows_last_run    BIGINT,
+            full_refresh     BOOLEAN,
+            updated_at       TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging1_batch (
+            batch_id     BIGSERIAL PRIMARY KEY,
+            started_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at  TIMESTAMPTZ,
+            status       TEXT NOT NULL DEFAULT 'running',
+            modo         TEXT,
+            full_refresh BOOLEAN
+        );
+
+        -- checkpoints da extração: faixa 0 = tabela (plano e status final),
+        -- faixas 1..n = unidades copiadas (tabela inteira ou faixas de id/created_at)
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging1_checkpoint (
+            batch_id   BIGINT NOT NULL,
+            tabela     TEXT NOT NULL,
+            faixa      INTEGER NOT NULL,
+            predicado  TEXT,
+            plano      JSONB,
+            status     TEXT NOT NULL DEFAULT 'pending',
+            rows       BIGINT,
+            attempts   INTEGER,
+            erro       TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (batch_id, tabela, faixa)
+        );
+
+        -- staging2 incremental: lotes do staging_01 já processados por tabela do staging_02
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging2_batch (
+            table_name   TEXT NOT NULL,
+            batch_id     BIGINT NOT NULL,
+            processed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (table_name, batch_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging2_watermark (
+            table_name         TEXT PRIMARY KEY,
+            batch_id           BIGINT,
+            full_reconciled_at TIMESTAMPTZ,
+            rows_last_run      BIGINT,
+            full_refresh       BOOLEAN,
+            updated_at         TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        -- progresso do upsert em faixas (STAGING2_CHUNK_ROWS), confirmado a cada faixa
+        CREATE TABLE IF NOT EXISTS lacreisaude_etl_meta.staging2_progress (
+            table_name   TEXT PRIMARY KEY,
+            chunks_done  INTEGER NOT NULL,
+            chunks_total INTEGER NOT NULL,
+            rows_done    BIGINT,
+            status       TEXT NOT NULL,
+            started_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+"""]
+
+# Sentinela de queda do servidor: uma linha numa tabela do staging_01, que muda de
+# LOGGED/UNLOGGED junto com as demais (set_schema_persistence). Nasce com a linha para
+# um banco que já tem cargas não ser tomado por perdido na primeira execução.
+SENTINELA_DDL = ["""
+        CREATE TABLE IF NOT EXISTS lacreisaude_staging_01._storage_sentinel (
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        INSERT INTO lacreisaude_staging_01._storage_sentinel
+        SELECT now() WHERE NOT EXISTS (SELECT 1 FROM lacreisaude_staging_01._storage_sentinel);
+"""]
+
+
+def _start_batch(conn, modo, full_refresh):
+    return conn.execute(text("""
+        INSERT INTO lacreisaude_etl_meta.staging1_batch (modo, full_refresh)
+        VALUES (:m, :f)
+        RETURNING batch_id
+    """), {'m': modo, 'f': full_refresh}).scalar()
+
+
+def _finish_batch(batch_id, status):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE lacreisaude_etl_meta.staging1_batch
+            SET status = :s, finished_at = now()
+            WHERE batch_id = :b
+        """), {'s': status, 'b': batch_id})
+
+
+def set_schema_persistence(conn, schema, unlogged):
+    """Converte as tabelas do schema para UNLOGGED (ou de volta para LOGGED) quando
+    diferem do modo pedido. Cada conversão reescreve a tabela uma única vez.
+    Retorna as tabelas alteradas."""
+    desejada = 'u' if unlogged else 'p'
+    tabelas = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :s AND c.relkind = 'r' AND c.relpersistence <> :p
+        ORDER BY c.relname
+    """), {'s': schema, 'p': desejada}).scalars().all()
+    for t in tabelas:
+        conn.execute(text(f'ALTER TABLE "{schema}"."{t}" SET {"UNLOGGED" if unlogged else "LOGGED"}'))
+    return tabelas
+
+
+def _staging_lost_by_crash(conn):
+    """Tabelas UNLOGGED são esvaziadas pelo Postgres após uma queda do servidor.
+    A sentinela (SENTINELA_DDL, criada pela migração) tem sempre uma linha e segue a
+    persistência do staging_01: se está vazia mas já houve carga (marcas d'água gravadas),
+    staging_01/02 perderam os dados. Só SELECT/INSERT, sem DDL a cada extração."""
+    if conn.execute(text('SELECT EXISTS (SELECT 1 FROM lacreisaude_staging_01._storage_sentinel)')).scalar():
+        return False
+    perdido = conn.execute(text('SELECT EXISTS (SELECT 1 FROM lacreisaude_etl_meta.staging1_watermark)')).scalar()
+    conn.execute(text('INSERT INTO lacreisaude_staging_01._storage_sentinel DEFAULT VALUES'))
+    return perdido
+
+
+def _truncate_replaceable(conn, t):
+    """Truncate-and-load de uma tabela, na transação da sua cópia: esvazia a tabela antes
+    de recarregá-la, a menos que ela tenha linhas de uploads que o staging2 ainda não
+    processou (aí segue o append e a retenção apaga os lotes antigos). Retorna se truncou."""
+    # o lock segura uploads na tabela entre a conferência e o TRUNCATE
+    conn.execute(text(f'LOCK TABLE lacreisaude_staging_01.{t} IN ACCESS EXCLUSIVE MODE'))
+    uploads_pendentes = conn.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM lacreisaude_etl_meta.staging1_batch b
+            WHERE b.modo = 'upload' AND b.status IN ('ok', 'running')
+              AND EXISTS (SELECT 1 FROM lacreisaude_staging_01.{t} x WHERE x._batch_id = b.batch_id)
+              AND NOT EXISTS (SELECT 1 FROM lacreisaude_etl_meta.staging2_batch p
+                              WHERE p.table_name = :t AND p.batch_id = b.batch_id)
+        )
+    """), {'t': t}).scalar()
+    if uploads_pendentes:
+        logger.info(f"staging1 {t}: uploads ainda não processados pelo staging2; carga completa sem TRUNCATE")
+        return False
+    conn.execute(text(f'TRUNCATE lacreisaude_staging_01.{t}'))
+    return True
+
+
+def current_wal_lsn(conn):
+    """Posição atual de inserção no WAL (None se indisponível, ex.: réplica)."""
+    try:
+        with conn.begin_nested():
+            return conn.execute(text('SELECT pg_current_wal_insert_lsn()::text')).scalar()
+    except Exception as e:
+        logger.warning(f"WAL: posição indisponível: {e}")
+        return None
+
+
+def wal_bytes_since(conn, lsn):
+    """Bytes de WAL gerados no cluster desde `lsn` (inclui atividade de outras sessões)."""
+    if lsn is None:
+        return None
+    atual = current_wal_lsn(conn)
+    if atual is None:
+        return None
+    return int(conn.execute(text('SELECT pg_wal_lsn_diff(CAST(:a AS pg_lsn), CAST(:b AS pg_lsn))'),
+                            {'a': atual, 'b': lsn}).scalar())
+
+
+def _pending_batch(conn):
+    """Último lote de extração não concluído (falhou ou foi interrompido) posterior ao
+    último lote publicado; é o candidato a ser retomado. Uploads não entram."""
+    return conn.execute(text("""
+        SELECT batch_id, modo, full_refresh
+        FROM lacreisaude_etl_meta.staging1_batch
+        WHERE status IN ('failed', 'running') AND modo <> 'upload'
+          AND batch_id > COALESCE((SELECT MAX(batch_id) FROM lacreisaude_etl_meta.staging1_batch
+                                   WHERE status = 'ok' AND modo <> 'upload'), 0)
+        ORDER BY batch_id DESC
+        LIMIT 1
+    """)).mappings().first()
+
+
+def _abandon_batches(conn, keep_batch_id=None):
+    """Descarta lotes de extração não concluídos (exceto o retomado): apaga suas linhas
+    do staging_01 e marca o lote como 'abandoned'. Retorna os ids descartados."""
+    ids = conn.execute(text("""
+        SELECT batch_id FROM lacreisaude_etl_meta.staging1_batch
+        WHERE status IN ('failed', 'running') AND modo <> 'upload'
+          AND batch_id IS DISTINCT FROM :k
+    """), {'k': keep_batch_id}).scalars().all()
+    if not ids:
+        return []
+    for t in STAGING1_TABLES:
+        conn.execute(text(f'DELETE FROM lacreisaude_staging_01.{t} WHERE _batch_id = ANY(:ids)'), {'ids': ids})
+    conn.execute(text("""
+        UPDATE lacreisaude_etl_meta.staging1_batch
+        SET status = 'abandoned', finished_at = COALESCE(finished_at, now())
+        WHERE batch_id = ANY(:ids)
+    """), {'ids': ids})
+    return ids
+
+
+def _resume_batch(conn, batch_id):
+    conn.execute(text("""
+        UPDATE lacreisaude_etl_meta.staging1_batch
+        SET status = 'running', finished_at = NULL
+        WHERE batch_id = :b
+    """), {'b': batch_id})
+
+
+def _publish_batch(batch_id, full_refresh):
+    """Conclui o lote: grava as marcas d'água das tabelas extraídas nele e marca o lote
+    como 'ok' na mesma transação. A marca só avança quando o lote fica visível ao staging2."""
+    with engine.begin() as conn:
+        tabelas = conn.execute(text("""
+            SELECT tabela, plano, rows FROM lacreisaude_etl_meta.staging1_checkpoint
+            WHERE batch_id = :b AND faixa = 0 AND status = 'ok'
+        """), {'b': batch_id}).mappings().all()
+        for r in tabelas:
+            _save_watermark(conn, r['tabela'], r['plano'], r['rows'], full_refresh)
+        conn.execute(text("""
+            UPDATE lacreisaude_etl_meta.staging1_batch
+            SET status = 'ok', finished_at = now()
+            WHERE batch_id = :b
+        """), {'b': batch_id})
+
+
+def _load_checkpoints(conn, batch_id):
+    """Checkpoints de um lote: {tabela: {'plano', 'status', 'rows', 'unidades': [...]}}."""
+    registros = conn.execute(text("""
+        SELECT tabela, faixa, predicado, plano, status, rows, attempts
+        FROM lacreisaude_etl_meta.staging1_checkpoint
+        WHERE batch_id = :b
+        ORDER BY tabela, faixa
+    """), {'b': batch_id}).mappings().all()
+    checkpoints = {}
+    for r in registros:
+        if r['faixa'] == 0:
+            checkpoints.setdefault(r['tabela'], {'unidades': []}).update(
+                plano=r['plano'], status=r['status'], rows=r['rows']
+            )
+        else:
+            checkpoints.setdefault(r['tabela'], {'unidades': []})['unidades'].append(dict(r))
+    return checkpoints
+
+
+def _save_plan_checkpoint(conn, batch_id, t, plano, predicados):
+    # plano da tabela (recorte incremental) e suas unidades, gravados antes da cópia:
+    # ao retomar, as faixas são exatamente as mesmas
+    plano_json = {k: plano[k] for k in ('column', 'from', 'to', 'where_sql')}
+    conn.execute(text("""
+        INSERT INTO lacreisaude_etl_meta.staging1_checkpoint (batch_id, tabela, faixa, plano)
+        VALUES (:b, :t, 0, CAST(:p AS JSONB))
+    """), {'b': batch_id, 't': t, 'p': json.dumps(plano_json)})
+    conn.execute(text("""
+        INSERT INTO lacreisaude_etl_meta.staging1_checkpoint (batch_id, tabela, faixa, predicado)
+        VALUES (:b, :t, :f, :p)
+    """), [{'b': batch_id, 't': t, 'f': i, 'p': p} for i, p in enumerate(predicados, start=1)])
+
+
+def _save_checkpoint(conn, batch_id, t, faixa, status, rows=None, attempts=None, erro=None):
+    conn.execute(text("""
+        UPDATE lacreisaude_etl_meta.staging1_checkpoint
+        SET status = :s, rows = :n, attempts = :a, erro = :e, updated_at = now()
+        WHERE batch_id = :b AND tabela = :t AND faixa = :f
+    """), {'s': status, 'n': rows, 'a': attempts, 'e': erro, 'b': batch_id, 't': t, 'f': faixa})
+
+
+def _ok_batches_with_rows_sql(table_name):
+    # lotes concluídos que têm linhas da tabela (o índice em _batch_id torna o EXISTS barato)
+    return f"""
+        SELECT b.batch_id FROM lacreisaude_etl_meta.staging1_batch b
+        WHERE b.status = 'ok'
+          AND EXISTS (SELECT 1 FROM lacreisaude_staging_01.{table_name} x WHERE x._batch_id = b.batch_id)
+    """
+
+
+def _prune_batches(keep, tables=None):
+    """Retenção: por tabela, remove do staging_01 as linhas de lotes fora dos `keep` últimos
+    concluídos com linhas dela (e as linhas antigas sem lote). Lotes concluídos que o staging2
+    ainda não processou nunca são removidos. Retorna {tabela: linhas removidas}."""
+    podados = {}
+    cortes = []
+    with engine.begin() as conn:
+        for t in tables or STAGING1_TABLES:
+            corte = conn.execute(text(f"""
+                SELECT MIN(batch_id) FROM (
+                    {_ok_batches_with_rows_sql(t)}
+                    ORDER BY b.batch_id DESC
+                    LIMIT :k
+                ) recentes
+            """), {'k': keep}).scalar()
+            if corte is None:
+                # nenhum lote com dados: o staging2 ainda lê as linhas sem lote
+                continue
+            pendente = conn.execute(text(f"""
+                SELECT MIN(batch_id) FROM ({_ok_batches_with_rows_sql(t)}) lotes
+                WHERE NOT EXISTS (SELECT 1 FROM lacreisaude_etl_meta.staging2_batch p
+                                  WHERE p.table_name = :t AND p.batch_id = lotes.batch_id)
+            """), {'t': t}).scalar()
+            if pendente is not None:
+                corte = min(corte, pendente)
+            cortes.append(corte)
+            res = conn.execute(
+                text(f'DELETE FROM lacreisaude_staging_01.{t} WHERE _batch_id IS NULL OR _batch_id < :c'), {'c': corte}
+            )
+            podados[t] = res.rowcount
+        if cortes and tables is None:
+            conn.execute(text("""
+                DELETE FROM lacreisaude_etl_meta.staging1_checkpoint
+                WHERE batch_id < :c
+            """), {'c': min(cortes)})
+            conn.execute(text("""
+                DELETE FROM lacreisaude_etl_meta.staging1_batch
+                WHERE batch_id < :c AND status <> 'running'
+            """), {'c': min(cortes)})
+            conn.execute(text("""
+                DELETE FROM lacreisaude_etl_meta.staging2_batch
+                WHERE batch_id < :c
+            """), {'c': min(cortes)})
+    return podados
 
 
 # Lista de colunas usadas nas tabelas de staging_01 (todas em TEXT)
@@ -268,6 +918,16 @@ TABLE_COLUMNS['lacreiid_genderidentity'] = ['id','created_at','updated_at','bagd
 # include address_state so we can resolve state names when building the model
 TABLE_COLUMNS['address_state'] = ['id','created_at','updated_at','name','code','ibge_code','active','country_id']
 
+# Ordem de extração das tabelas do staging_01
+STAGING1_TABLES = [
+    'lacrei_privacydocument', 'lacreiid_appointment', 'lacreiid_cancellation',
+    'lacreiid_profile', 'lacreiid_profile_disability_types', 'lacreiid_report',
+    # lookup/reference tables
+    'lacreiid_sexualorientation', 'lacreiid_pronoun', 'lacreiid_ethnicgroup', 'lacreiid_genderidentity',
+    'lacreiid_user', 'lacreisaude_clinic', 'lacreisaude_professional',
+    'lacreisaude_professional_disability_types', 'lacreiid_disabilitytype', 'address_state'
+]
+
 # campos que serão sempre nulificados/omitidos no staging (PII sensível)
 SENSITIVE_NULL = {
     'password',
@@ -281,100 +941,1353 @@ SENSITIVE_NULL = {
 }
 
 
-def _to_text(v):
-    if v is None:
+def _copy_table_from_source(conn, source_engine, source_schema, table_name, staging_cols, where_sql='', batch_id=None):
+    """Copia linhas da tabela source_schema.table_name no source_engine para a tabela
+    lacreisaude_staging_01.table_name (colunas em texto). Retorna número de linhas inseridas,
+    0 se a tabela não existir na fonte ou None em caso de erro."""
+    if source_engine is None:
+        return 0
+
+    # SELECT projetado: só as colunas do staging_01 que existem na fonte, já em texto,
+    # com os campos sensíveis como NULL (não trafegam nem passam pelo Python)
+    try:
+        source_cols = _source_columns(source_engine, source_schema, table_name)
+    except Exception as e:
+        logger.error(f"staging1 {table_name}: falha ao ler colunas da fonte: {e}")
+        return None
+    cols_to_insert, select_sql = _projected_select(source_schema, table_name, staging_cols, source_cols, where_sql,
+                                                   batch_id)
+    if not cols_to_insert:
+        # tabela não existe na fonte (ou sem colunas em comum): nada a copiar
+        return 0
+
+    col_list = ','.join([f'"{c}"' for c in cols_to_insert])
+    param_list = ','.join([f':{c}' for c in cols_to_insert])
+    insert_sql = text(f'INSERT INTO lacreisaude_staging_01."{table_name}" ({col_list}) VALUES ({param_list})')
+    try:
+        with source_engine.connect() as src_conn:
+            inicio = time.perf_counter()
+            rows = src_conn.execute(text(select_sql)).mappings().all()
+        _source_throttle.observe(table_name, time.perf_counter() - inicio, len(rows))
+        _source_throttle.consume(len(rows), _approx_bytes(r.values() for r in rows) if _source_throttle.mede_bytes else 0)
+        _run_rss.sample()
+        if rows:
+            conn.execute(insert_sql, [dict(r) for r in rows])
+    except Exception as e:
+        logger.error(f"staging1 {table_name}: falha na extração: {e}")
         return None
-    if isinstance(v, datetime):
-        return v.isoformat()
-    return str(v)
 
+    return len(rows)
 
-def _copy_table_from_source(conn, source_engine, source_schema, table_name, staging_cols):
-    """Copia linhas da tabela source_schema.table_name no source_engine para a tabela
-    lacreisaude_staging_01.table_name (colunas em texto). Retorna número de linhas inseridas."""
+
+# Colunas da fonte por (schema, tabela), lidas uma vez por execução em _load_source_columns
+_source_columns_cache = {}
+_source_columns_lock = threading.Lock()
+
+
+def _load_source_columns(source_engine, source_schema, tables):
+    """Lê de uma vez as colunas de todas as tabelas extraídas (uma única consulta ao
+    information_schema) e renova o cache usado por _source_columns."""
+    sel = text("""
+        SELECT table_name, column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = ANY(:tables)
+        ORDER BY table_name, ordinal_position
+    """)
+    colunas = {t: {} for t in tables}
+    with source_engine.connect() as src_conn:
+        for table_name, column_name, data_type in src_conn.execute(sel, {'schema': source_schema, 'tables': list(tables)}):
+            colunas[table_name][column_name] = data_type
+    with _source_columns_lock:
+        for t, cols in colunas.items():
+            _source_columns_cache[(source_schema, t)] = cols
+
+
+def _source_columns(source_engine, source_schema, table_name):
+    """Colunas existentes na tabela da fonte, em ordem, como {nome: data_type}
+    (vazio se a tabela não existir). Usa o cache da execução quando disponível."""
+    with _source_columns_lock:
+        cached = _source_columns_cache.get((source_schema, table_name))
+    if cached is not None:
+        return cached
+    sel = text("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :table
+        ORDER BY ordinal_position
+    """)
+    with source_engine.connect() as src_conn:
+        cols = {r[0]: r[1] for r in src_conn.execute(sel, {'schema': source_schema, 'table': table_name})}
+    with _source_columns_lock:
+        _source_columns_cache[(source_schema, table_name)] = cols
+    return cols
+
+
+def _projected_select(source_schema, table_name, staging_cols, source_cols, where_sql='', batch_id=None):
+    """Monta o SELECT da fonte já projetado nas colunas do staging_01.
+    Colunas sensíveis viram NULL na própria consulta (não trafegam pela rede).
+    Acrescenta _row_digest (md5 das colunas projetadas, calculado na fonte) e,
+    com batch_id, a coluna _batch_id como literal.
+    Retorna (colunas_destino, sql_select)."""
+    cols_to_insert = [c for c in staging_cols if c in source_cols]
+    if not cols_to_insert:
+        return [], ''
+    valores = ['NULL::text' if c in SENSITIVE_NULL else f'"{c}"::text' for c in cols_to_insert]
+    exprs = [f'{v} AS "{c}"' for v, c in zip(valores, cols_to_insert)]
+    # digest estável: mesma ordem de colunas (TABLE_COLUMNS) e campos sensíveis já nulos
+    exprs.append(f'md5(ROW({", ".join(valores)})::text) AS "_row_digest"')
+    cols_to_insert = cols_to_insert + ['_row_digest']
+    if batch_id is not None:
+        cols_to_insert = cols_to_insert + ['_batch_id']
+        exprs.append(f'{int(batch_id)}::bigint AS "_batch_id"')
+    sql = f'SELECT {", ".join(exprs)} FROM "{source_schema}"."{table_name}" {where_sql}'.rstrip()
+    return cols_to_insert, sql
+
+
+def _watermark_column(source_cols):
+    for c in WATERMARK_COLUMNS:
+        if c in source_cols:
+            return c
+    return None
+
+
+def _sql_literal(value):
+    # literal SQL escapado (o COPY não aceita parâmetros)
+    return adapt(str(value)).getquoted().decode('utf-8')
+
+
+def _plan_incremental(conn, source_engine, source_schema, table_name, source_cols, full_refresh):
+    """Decide o recorte da extração de uma tabela.
+    Lê a marca d'água salva e o MAX atual da coluna na fonte; retorna dict com
+    'column', 'from', 'to' e 'where_sql' (vazio = carga completa)."""
+    column = _watermark_column(source_cols)
+    plano = {'column': column, 'from': None, 'to': None, 'where_sql': ''}
+    if column is None:
+        return plano
+
+    with source_engine.connect() as src_conn:
+        plano['to'] = src_conn.execute(
+            text(f'SELECT MAX("{column}")::text FROM "{source_schema}"."{table_name}"')
+        ).scalar()
+
+    if full_refresh:
+        return plano
+
+    salvo = conn.execute(text("""
+        SELECT watermark_column, watermark_value
+        FROM lacreisaude_etl_meta.staging1_watermark
+        WHERE table_name = :t
+    """), {'t': table_name}).mappings().first()
+    # sem marca (1ª carga) ou coluna mudou na fonte: faz carga completa
+    if not salvo or salvo['watermark_column'] != column or salvo['watermark_value'] is None:
+        return plano
+
+    plano['from'] = salvo['watermark_value']
+    if plano['to'] is None:
+        # tabela esvaziada na fonte: nada novo
+        plano['where_sql'] = 'WHERE false'
+        return plano
+    de = _sql_literal(plano['from'])
+    if column != 'id' and STAGING1_WATERMARK_OVERLAP_SECONDS > 0:
+        # janela de sobreposição no tipo da própria coluna (timestamp com ou sem fuso)
+        de = f"CAST({de} AS {source_cols[column]}) - make_interval(secs => {STAGING1_WATERMARK_OVERLAP_SECONDS})"
+    plano['where_sql'] = f'WHERE "{column}" > {de} AND "{column}" <= {_sql_literal(plano["to"])}'
+    return plano
+
+
+def _save_watermark(conn, table_name, plano, rows, full_refresh):
+    if plano['column'] is None:
+        return
+    conn.execute(text("""
+        INSERT INTO lacreisaude_etl_meta.staging1_watermark
+            (table_name, watermark_column, watermark_value, rows_last_run, full_refresh, updated_at)
+        VALUES (:t, :c, :v, :n, :f, now())
+        ON CONFLICT (table_name) DO UPDATE SET
+            watermark_column = EXCLUDED.watermark_column,
+            -- delta vazio não pode regredir a marca
+            watermark_value  = COALESCE(EXCLUDED.watermark_value, lacreisaude_etl_meta.staging1_watermark.watermark_value),
+            rows_last_run    = EXCLUDED.rows_last_run,
+            full_refresh     = EXCLUDED.full_refresh,
+            updated_at       = EXCLUDED.updated_at
+    """), {'t': table_name, 'c': plano['column'], 'v': plano['to'], 'n': rows, 'f': full_refresh})
+
+
+class _CopyPipe:
+    """Buffer limitado em memória que liga o COPY TO da fonte (produtor, write)
+    ao COPY FROM do destino (consumidor, read) sem materializar a tabela."""
+
+    def __init__(self, max_chunks=256, table_name=None):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self._aborted = threading.Event()
+        self.error = None
+        self.bytes = 0
+        # com tabela, o produtor passa pelos limites da fonte (_source_throttle)
+        self._table_name = table_name
+        self._ultimo = time.perf_counter()
+
+    # lado produtor (psycopg2 copy_expert com COPY ... TO STDOUT)
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self._table_name is not None:
+            # intervalo entre writes = tempo esperando o próximo bloco da fonte;
+            # dormir aqui segura o COPY TO, e a fonte para de enviar (backpressure)
+            _source_throttle.observe(self._table_name, time.perf_counter() - self._ultimo, len(data))
+            _source_throttle.consume(data.count(b'\n') if _source_throttle.rows_per_sec else 0, len(data))
+            _run_rss.sample()
+        while True:
+            if self._aborted.is_set():
+                raise RuntimeError('COPY de destino abortado')
+            try:
+                self._queue.put(data, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.bytes += len(data)
+        self._ultimo = time.perf_counter()
+        return len(data)
+
+    def finish(self, error=None):
+        self.error = error
+        while True:
+            if self._aborted.is_set():
+                return
+            try:
+                self._queue.put(None, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def abort(self):
+        self._aborted.set()
+
+    # lado consumidor (psycopg2 copy_expert com COPY ... FROM STDIN)
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                break
+            self._buffer.extend(chunk)
+        if self._eof and self.error is not None:
+            # falha na leitura da fonte: aborta o COPY FROM em vez de gravar dados parciais
+            raise RuntimeError(f'Falha no COPY da fonte: {self.error}')
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _copy_table_bulk(conn, source_engine, source_schema, table_name, staging_cols, where_sql='', batch_id=None):
+    """Variante de _copy_table_from_source usando COPY em streaming:
+    COPY (SELECT projetado) TO STDOUT na fonte ➜ COPY ... FROM STDIN no staging_01.
+    Mantém a projeção em TABLE_COLUMNS e a nulificação de SENSITIVE_NULL.
+    Retorna número de linhas copiadas (None em caso de erro)."""
+    if source_engine is None:
+        return 0
+
+    try:
+        source_cols = _source_columns(source_engine, source_schema, table_name)
+    except Exception as e:
+        logger.error(f"staging1 {table_name}: falha ao ler colunas da fonte: {e}")
+        return None
+    cols_to_insert, select_sql = _projected_select(source_schema, table_name, staging_cols, source_cols, where_sql,
+                                                   batch_id)
+    if not cols_to_insert:
+        # tabela inexistente na fonte (ou sem colunas em comum)
+        return 0
+
+    col_list = ','.join([f'"{c}"' for c in cols_to_insert])
+    copy_out = f'COPY ({select_sql}) TO STDOUT WITH (FORMAT csv)'
+    copy_in = f'COPY lacreisaude_staging_01."{table_name}" ({col_list}) FROM STDIN WITH (FORMAT csv)'
+
+    pipe = _CopyPipe(table_name=table_name)
+    # o produtor roda em outra thread: propaga o snapshot da thread atual
+    snapshot_id = getattr(_source_snapshot, 'id', None)
+
+    def _produtor():
+        src_raw = None
+        _source_snapshot.id = snapshot_id
+        try:
+            src_raw = source_engine.raw_connection()
+            cur = src_raw.cursor()
+            cur.copy_expert(copy_out, pipe)
+            cur.close()
+            pipe.finish()
+        except Exception as e:
+            pipe.finish(error=e)
+        finally:
+            if src_raw is not None:
+                try:
+                    src_raw.rollback()
+                finally:
+                    src_raw.close()
+
+    produtor = threading.Thread(target=_produtor, name=f'copy-{table_name}', daemon=True)
+    # savepoint: uma falha no COPY desta tabela não aborta a transação das demais
+    savepoint = conn.begin_nested()
+    try:
+        produtor.start()
+        cur = conn.connection.cursor()
+        cur.copy_expert(copy_in, pipe)
+        copied = cur.rowcount
+        cur.close()
+        savepoint.commit()
+    except Exception as e:
+        pipe.abort()
+        savepoint.rollback()
+        logger.error(f"staging1 {table_name}: falha no COPY: {e}")
+        return None
+    finally:
+        produtor.join()
+
+    return copied if copied and copied > 0 else 0
+
+
+def _stream_table_from_source(conn, source_engine, source_schema, table_name, staging_cols, batch_size, where_sql='',
+                              batch_id=None):
+    """Variante de _copy_table_from_source com memória limitada: lê a fonte por um
+    cursor server-side (FETCH de batch_size linhas) e grava cada lote com um único
+    INSERT multi-linha. O pico de memória depende do lote, não do tamanho da tabela.
+    Retorna número de linhas inseridas (None em caso de erro)."""
     if source_engine is None:
         return 0
 
-    # Consulta todas as linhas da tabela fonte
-    # Protege nomes com aspas (schema pode ter hífen)
-    sel = text(f'SELECT * FROM "{source_schema}"."{table_name}"')
+    try:
+        source_cols = _source_columns(source_engine, source_schema, table_name)
+    except Exception as e:
+        logger.error(f"staging1 {table_name}: falha ao ler colunas da fonte: {e}")
+        return None
+    cols_to_insert, select_sql = _projected_select(source_schema, table_name, staging_cols, source_cols, where_sql,
+                                                   batch_id)
+    if not cols_to_insert:
+        return 0
+
+    col_list = ','.join([f'"{c}"' for c in cols_to_insert])
+    insert_sql = f'INSERT INTO lacreisaude_staging_01."{table_name}" ({col_list}) VALUES %s'
+
     inserted = 0
+    savepoint = conn.begin_nested()
     try:
         with source_engine.connect() as src_conn:
-            rows = src_conn.execute(sel).mappings().all()
-            for r in rows:
-                params = {}
-                cols_to_insert = []
-                for c in staging_cols:
-                    # alguns nomes de colunas do staging podem não existir na fonte; só copia os que existirem
-                    if c in r:
-                        cols_to_insert.append(c)
-                        # nulifica campos sensíveis para não trazer PII
-                        if c in SENSITIVE_NULL:
-                            params[c] = None
-                        else:
-                            params[c] = _to_text(r[c])
-
-                if not cols_to_insert:
-                    continue
+            # yield_per => psycopg2 usa cursor nomeado e busca batch_size linhas por vez
+            result = src_conn.execution_options(yield_per=batch_size).execute(text(select_sql))
+            cur = conn.connection.cursor()
+            lotes = result.partitions(batch_size)
+            while True:
+                inicio = time.perf_counter()
+                lote = next(lotes, None)
+                if lote is None:
+                    break
+                # cada FETCH é uma leitura na fonte: mede latência e respeita a taxa
+                _source_throttle.observe(table_name, time.perf_counter() - inicio, len(lote))
+                _source_throttle.consume(len(lote), _approx_bytes(lote) if _source_throttle.mede_bytes else 0)
+                execute_values(cur, insert_sql, [tuple(r) for r in lote], page_size=batch_size)
+                inserted += len(lote)
+                # o lote ainda está em memória: é aqui que o pico do modo stream aparece
+                _run_rss.sample()
+            cur.close()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.error(f"staging1 {table_name}: falha na extração em lotes: {e}")
+        return None
+
+    return inserted
+
+
+# ---------------------------------------------------------------------------
+# Modo 'fdw': fonte no mesmo cluster (ou alcançável pelo servidor do destino)
+# ---------------------------------------------------------------------------
+
+def _setup_fdw(conn, reimportar=False):
+    """Prepara o postgres_fdw no destino: extensão, servidor e user mapping com os dados
+    de SOURCE_DATABASE_URL, e importa as tabelas da fonte em STAGING1_FDW_SCHEMA só quando
+    faltam (ou a lista de tabelas/schema da fonte mudou) ou com `reimportar` (colunas
+    novas ou removidas na fonte). Retorna se importou."""
+    url = make_url(SOURCE_DATABASE_URL)
+    opcoes_servidor = {
+        'host': url.host,
+        'port': url.port,
+        'dbname': url.database,
+        'fetch_size': STAGING1_FDW_FETCH_SIZE,
+    }
+    opcoes_servidor = {k: v for k, v in opcoes_servidor.items() if v is not None}
+    opcoes_usuario = {k: v for k, v in {'user': url.username, 'password': url.password}.items() if v is not None}
+
+    def _opcoes(opcoes, prefixo=''):
+        return ', '.join(f'{prefixo}{k} {_sql_literal(v)}' for k, v in opcoes.items())
+
+    server = f'"{STAGING1_FDW_SERVER}"'
+    # cursor cru: senha/host vão como literais e não podem ser lidos como :parâmetros
+    cur = conn.connection.cursor()
+    cur.execute('CREATE EXTENSION IF NOT EXISTS postgres_fdw')
+    cur.execute(f'CREATE SERVER IF NOT EXISTS {server} FOREIGN DATA WRAPPER postgres_fdw OPTIONS ({_opcoes(opcoes_servidor)})')
+    # servidor já existente: atualiza as opções (a URL da fonte pode ter mudado)
+    cur.execute(f'ALTER SERVER {server} OPTIONS ({_opcoes(opcoes_servidor, "SET ")})')
+    if opcoes_usuario:
+        cur.execute(f'CREATE USER MAPPING IF NOT EXISTS FOR CURRENT_USER SERVER {server} OPTIONS ({_opcoes(opcoes_usuario)})')
+        cur.execute(f'ALTER USER MAPPING FOR CURRENT_USER SERVER {server} OPTIONS ({_opcoes(opcoes_usuario, "SET ")})')
+    cur.close()
+
+    if not reimportar and _fdw_importado(conn):
+        return False
+    tabelas = ', '.join(f'"{t}"' for t in STAGING1_TABLES)
+    conn.execute(text(f'DROP SCHEMA IF EXISTS "{STAGING1_FDW_SCHEMA}" CASCADE'))
+    conn.execute(text(f'CREATE SCHEMA "{STAGING1_FDW_SCHEMA}"'))
+    conn.execute(text(
+        f'IMPORT FOREIGN SCHEMA "{SOURCE_SCHEMA}" LIMIT TO ({tabelas}) '
+        f'FROM SERVER {server} INTO "{STAGING1_FDW_SCHEMA}"'
+    ))
+    logger.info(f"staging1: tabelas da fonte importadas em {STAGING1_FDW_SCHEMA}")
+    return True
+
+
+def _fdw_importado(conn):
+    # tabelas estrangeiras já importadas, e de qual schema da fonte
+    importadas = conn.execute(text("""
+        SELECT c.relname, ft.ftoptions
+        FROM pg_foreign_table ft
+        JOIN pg_class c ON c.oid = ft.ftrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :s
+    """), {'s': STAGING1_FDW_SCHEMA}).all()
+    return (
+        {r[0] for r in importadas} == set(STAGING1_TABLES)
+        and all(f'schema_name={SOURCE_SCHEMA}' in (r[1] or []) for r in importadas)
+    )
+
 
-                col_list = ','.join([f'"{c}"' for c in cols_to_insert])
-                param_list = ','.join([f':{c}' for c in cols_to_insert])
-                insert_sql = f'INSERT INTO lacreisaude_staging_01."{table_name}" ({col_list}) VALUES ({param_list})'
-                conn.execute(text(insert_sql), params)
-                inserted += 1
-    except Exception:
-        # se tabela não existir na fonte ou erro, apenas retorna 0
+def _copy_table_fdw(conn, source_engine, source_schema, table_name, staging_cols, where_sql='', batch_id=None):
+    """Copia a tabela com um único INSERT ... SELECT executado no destino sobre a tabela
+    estrangeira: projeção, NULL dos campos sensíveis e filtros (marca d'água/faixa) vão
+    para a fonte pelo postgres_fdw e as linhas não passam pelo processo Python.
+    Retorna número de linhas inseridas (None em caso de erro)."""
+    if source_engine is None:
         return 0
 
-    return inserted
+    try:
+        source_cols = _source_columns(source_engine, source_schema, table_name)
+    except Exception as e:
+        logger.error(f"staging1 {table_name}: falha ao ler colunas da fonte: {e}")
+        return None
+    # mesmo SELECT projetado dos outros modos, lido da tabela estrangeira importada
+    cols_to_insert, select_sql = _projected_select(STAGING1_FDW_SCHEMA, table_name, staging_cols, source_cols,
+                                                   where_sql, batch_id)
+    if not cols_to_insert:
+        return 0
+
+    col_list = ','.join([f'"{c}"' for c in cols_to_insert])
+    savepoint = conn.begin_nested()
+    try:
+        inicio = time.perf_counter()
+        res = conn.execute(text(f'INSERT INTO lacreisaude_staging_01."{table_name}" ({col_list}) {select_sql}'))
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.error(f"staging1 {table_name}: falha na extração via fdw: {e}")
+        return None
+
+    # o INSERT ... SELECT roda inteiro no servidor: os limites valem entre unidades (use faixas)
+    _source_throttle.observe(table_name, time.perf_counter() - inicio, res.rowcount)
+    _source_throttle.consume(res.rowcount)
+    return res.rowcount
+
+
+# ---------------------------------------------------------------------------
+# Modo 'files': ingestão de exportações em arquivo
+# ---------------------------------------------------------------------------
+
+# Extensões aceitas, em ordem de preferência quando há mais de um arquivo para a tabela
+FILE_EXTENSIONS = ('.csv', '.csv.gz', '.jsonl', '.jsonl.gz', '.ndjson', '.parquet', '.xlsx')
+
+
+def _find_table_file(files_dir, table_name):
+    for ext in FILE_EXTENSIONS:
+        path = os.path.join(files_dir, table_name + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _file_value_text(v):
+    # valores tipados (JSON, Parquet, Excel) viram texto como no staging_01
+    if v is None:
+        return None
+    if isinstance(v, str):
+        return v
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, float):
+        if v != v:  # NaN
+            return None
+        # Excel guarda inteiros como float (1.0): preserva ids como '1'
+        return str(int(v)) if v.is_integer() else repr(v)
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, (int, Decimal)):
+        return str(v)
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False, default=str)
+    return str(v)
+
+
+def _iter_csv_chunks(path, chunk_rows):
+    import pandas as pd
+    # dtype=str + sem detecção de NA: cada célula chega como o texto do arquivo
+    leitor = pd.read_csv(path, dtype=str, keep_default_na=False, na_filter=False,
+                         chunksize=chunk_rows, compression='infer', encoding='utf-8-sig')
+    for df in leitor:
+        yield [str(c).strip() for c in df.columns], df.itertuples(index=False, name=None)
+
+
+def _iter_jsonl_chunks(path, chunk_rows):
+    abrir = gzip.open if path.endswith('.gz') else open
+    with abrir(path, 'rt', encoding='utf-8') as f:
+        lote = []
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            lote.append(json.loads(linha))
+            if len(lote) >= chunk_rows:
+                yield _records_chunk(lote)
+                lote = []
+        if lote:
+            yield _records_chunk(lote)
+
+
+def _records_chunk(registros):
+    # objetos JSON podem omitir chaves: a união das chaves do bloco vira o cabeçalho
+    colunas = []
+    for r in registros:
+        for c in r:
+            if c not in colunas:
+                colunas.append(c)
+    return colunas, ([r.get(c) for c in colunas] for r in registros)
+
+
+def _iter_parquet_chunks(path, chunk_rows, wanted_cols):
+    import pyarrow.parquet as pq
+    arquivo = pq.ParquetFile(path)
+    # lê só as colunas do staging_01 (o Parquet é colunar: as demais nem são lidas do disco)
+    colunas = [c for c in arquivo.schema_arrow.names if c in wanted_cols]
+    for lote in arquivo.iter_batches(batch_size=chunk_rows, columns=colunas):
+        yield colunas, zip(*(col.to_pylist() for col in lote.columns))
+
+
+def _iter_xlsx_chunks(path, chunk_rows):
+    from openpyxl import load_workbook
+    # read_only: percorre a planilha em streaming, sem carregar o arquivo todo
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = ['' if c is None else str(c).strip() for c in cabecalho]
+        lote = []
+        for linha in linhas:
+            lote.append(linha)
+            if len(lote) >= chunk_rows:
+                yield colunas, lote
+                lote = []
+        if lote:
+            yield colunas, lote
+    finally:
+        wb.close()
+
+
+def _iter_file_chunks(path, chunk_rows, wanted_cols):
+    """Gera blocos (colunas, linhas) de até chunk_rows linhas do arquivo."""
+    if path.endswith(('.csv', '.csv.gz')):
+        return _iter_csv_chunks(path, chunk_rows)
+    if path.endswith(('.jsonl', '.jsonl.gz', '.ndjson')):
+        return _iter_jsonl_chunks(path, chunk_rows)
+    if path.endswith('.parquet'):
+        return _iter_parquet_chunks(path, chunk_rows, wanted_cols)
+    return _iter_xlsx_chunks(path, chunk_rows)
+
+
+# caracteres que obrigam o record_out do Postgres a pôr o campo entre aspas (isspace do C incluso)
+_ROW_QUOTE_CHARS = frozenset('"\\(),' + ' \t\n\r\v\f')
+
+
+def _row_literal(valores):
+    """Texto de ROW(v1, v2, ...)::text para valores text, como o Postgres o escreve (record_out):
+    NULL vira campo vazio; texto vazio ou com aspas, barra invertida, parênteses, vírgula ou
+    espaço em branco vai entre aspas, com aspas e barras invertidas duplicadas."""
+    campos = []
+    for v in valores:
+        if v is None:
+            campos.append('')
+        elif v == '' or any(ch in _ROW_QUOTE_CHARS for ch in v):
+            campos.append('"' + v.replace('\\', '\\\\').replace('"', '""') + '"')
+        else:
+            campos.append(v)
+    return '(' + ','.join(campos) + ')'
+
+
+def _row_digest_py(valores):
+    # mesmo digest da fonte (md5(ROW(colunas::text)::text), ver _projected_select): a mesma
+    # linha tem o mesmo _row_digest vinda do banco, de arquivo ou de upload
+    return hashlib.md5(_row_literal(valores).encode('utf-8')).hexdigest()
+
+
+def _write_copy_rows(writer, posicoes, linhas, batch_id=None):
+    """Escreve as linhas no formato CSV do COPY: colunas de `posicoes` em texto,
+    SENSITIVE_NULL como NULL (\\N), _row_digest e _batch_id. Retorna linhas escritas."""
+    n = 0
+    for linha in linhas:
+        valores = [
+            None if c in SENSITIVE_NULL or i >= len(linha) else _file_value_text(linha[i])
+            for c, i in posicoes
+        ]
+        extra = [_row_digest_py(valores)]
+        if batch_id is not None:
+            extra.append(str(batch_id))
+        writer.writerow(['\\N' if v is None else v for v in valores] + extra)
+        n += 1
+    return n
+
+
+def _copy_columns(posicoes, batch_id=None):
+    cols = [c for c, _ in posicoes] + ['_row_digest']
+    if batch_id is not None:
+        cols.append('_batch_id')
+    return ','.join([f'"{c}"' for c in cols])
+
+
+def _ingest_table_file(conn, table_name, staging_cols, files_dir, chunk_rows, batch_id=None):
+    """Carrega o arquivo exportado da tabela no staging_01 por COPY, bloco a bloco.
+    Aplica a projeção em TABLE_COLUMNS e a nulificação de SENSITIVE_NULL; a memória
+    fica limitada a um bloco. Retorna linhas carregadas, 0 sem arquivo, None em erro."""
+    path = _find_table_file(files_dir, table_name) if files_dir else None
+    if path is None:
+        return 0
+
+    loaded = 0
+    savepoint = conn.begin_nested()
+    try:
+        cur = conn.connection.cursor()
+        for colunas, linhas in _iter_file_chunks(path, chunk_rows, set(staging_cols)):
+            # posição de cada coluna do staging_01 presente no arquivo (ordem de TABLE_COLUMNS)
+            posicoes = [(c, colunas.index(c)) for c in staging_cols if c in colunas]
+            if not posicoes:
+                break
+
+            buf = io.StringIO()
+            n = _write_copy_rows(csv.writer(buf, lineterminator='\n'), posicoes, linhas, batch_id)
+            if n == 0:
+                continue
+            buf.seek(0)
+            cur.copy_expert(
+                f"COPY lacreisaude_staging_01.\"{table_name}\" ({_copy_columns(posicoes, batch_id)}) "
+                f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buf,
+            )
+            loaded += n
+            _run_rss.sample()
+        cur.close()
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.error(f"staging1 {table_name}: falha ao carregar {path}: {e}")
+        return None
+
+    logger.info(f"staging1 [files] {table_name}: {loaded} linhas de {os.path.basename(path)}")
+    return loaded
+
+
+def _estimate_source_rows(source_engine, source_schema, table_name):
+    """Estimativa de linhas da tabela na fonte via pg_class.reltuples (-1 = desconhecida)."""
+    with source_engine.connect() as src_conn:
+        estimativa = src_conn.execute(text("""
+            SELECT c.reltuples::bigint
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = :table
+        """), {'schema': source_schema, 'table': table_name}).scalar()
+    return -1 if estimativa is None else int(estimativa)
+
+
+def _plan_chunks(source_engine, source_schema, table_name, source_cols, chunk_rows):
+    """Divide uma tabela grande em faixas contíguas de id (ou created_at).
+    Retorna a lista de predicados SQL; [None] quando a tabela não precisa ser dividida."""
+    if chunk_rows <= 0:
+        return [None]
+    column = next(
+        (c for c, tipos in CHUNK_COLUMN_TYPES.items() if source_cols.get(c) in tipos),
+        None,
+    )
+    if column is None:
+        return [None]
+    estimativa = _estimate_source_rows(source_engine, source_schema, table_name)
+    if estimativa <= chunk_rows:
+        return [None]
+    n = -(-estimativa // chunk_rows)
+
+    # limites internos igualmente espaçados entre MIN e MAX (funciona para inteiros e datas)
+    with source_engine.connect() as src_conn:
+        limites = [r[0] for r in src_conn.execute(text(f"""
+            SELECT b::text FROM (
+                SELECT DISTINCT lo + (hi - lo) * g / :n AS b
+                FROM (SELECT MIN("{column}") AS lo, MAX("{column}") AS hi
+                      FROM "{source_schema}"."{table_name}") m,
+                     generate_series(1, :n - 1) g
+                WHERE lo IS NOT NULL AND hi > lo
+            ) x
+            ORDER BY x.b
+        """), {'n': n})]
+    if not limites:
+        return [None]
+
+    col = f'"{column}"'
+    lits = [_sql_literal(b) for b in limites]
+    # primeira e última faixas são abertas, cobrindo linhas fora do MIN/MAX lido
+    predicados = [f'{col} < {lits[0]}']
+    predicados += [f'{col} >= {a} AND {col} < {b}' for a, b in zip(lits, lits[1:])]
+    predicados.append(f'{col} >= {lits[-1]}')
+    predicados.append(f'{col} IS NULL')
+    return predicados
+
+
+def _combine_where(where_sql, predicado):
+    if not predicado:
+        return where_sql
+    if where_sql:
+        return f'{where_sql} AND ({predicado})'
+    return f'WHERE {predicado}'
+
+
+def _plan_table(conn, t, full_refresh, modo):
+    """Lê as colunas da fonte e decide o recorte incremental da tabela."""
+    plano = {'column': None, 'from': None, 'to': None, 'where_sql': '', 'source_cols': {}}
+    if not source_engine or modo == 'files':
+        return plano
+    try:
+        source_cols = _source_columns(source_engine, SOURCE_SCHEMA, t)
+        plano['source_cols'] = source_cols
+        if source_cols:
+            plano.update(_plan_incremental(conn, source_engine, SOURCE_SCHEMA, t, source_cols, full_refresh))
+    except Exception as e:
+        logger.error(f"staging1 {t}: falha ao planejar extração incremental: {e}")
+    return plano
+
+
+def _copy_slice(conn, t, modo, batch_size, where_sql, batch_id):
+    """Copia um recorte (tabela inteira, delta ou faixa) no modo escolhido, marcando
+    as linhas com o lote da execução. Retorna linhas copiadas ou None em caso de erro."""
+    cols = TABLE_COLUMNS.get(t, [])
+    if modo == 'files':
+        return _ingest_table_file(conn, t, cols, STAGING1_FILES_DIR, STAGING1_FILE_CHUNK_ROWS, batch_id)
+    if not source_engine:
+        return 0
+    if modo == 'copy':
+        return _copy_table_bulk(conn, source_engine, SOURCE_SCHEMA, t, cols, where_sql, batch_id)
+    if modo == 'stream':
+        return _stream_table_from_source(conn, source_engine, SOURCE_SCHEMA, t, cols, batch_size, where_sql, batch_id)
+    if modo == 'fdw':
+        return _copy_table_fdw(conn, source_engine, SOURCE_SCHEMA, t, cols, where_sql, batch_id)
+    return _copy_table_from_source(conn, source_engine, SOURCE_SCHEMA, t, cols, where_sql, batch_id)
+
+
+def _finish_table(conn, t, modo, plano, loaded, extraction_ok, elapsed, batch_id):
+    """Fecha o checkpoint da tabela (a marca d'água é gravada ao publicar o lote),
+    confere a contagem, insere a linha de amostra quando necessário e monta o item de resumo."""
+    _save_checkpoint(conn, batch_id, t, 0, 'ok' if extraction_ok else 'failed', loaded)
+    rows_per_sec = round(loaded / elapsed, 1) if elapsed > 0 else 0.0
+    if source_engine or modo == 'files':
+        logger.info(f"staging1 [{modo}] {t}: {loaded} linhas em {elapsed:.2f}s ({rows_per_sec} linhas/s)")
+
+    # conta linhas do lote após tentativa de cópia
+    row_count = conn.execute(
+        text(f'SELECT COUNT(*) AS c FROM lacreisaude_staging_01.{t} WHERE _batch_id = :b'), {'b': batch_id}
+    ).mappings().one()['c']
+    # sem fonte configurada e tabela nunca carregada (nem por upload): insere linha de
+    # amostra para o pipeline ter o que processar. Com fonte, lote vazio é legítimo
+    # (ex.: delta incremental sem novidades).
+    vazia = row_count == 0 and not conn.execute(
+        text(f'SELECT EXISTS (SELECT 1 FROM lacreisaude_staging_01.{t})')
+    ).scalar()
+    if vazia and not source_engine and modo != 'files':
+        # insere uma linha de amostra básica com poucos campos (tudo como texto)
+        # tenta preencher colunas mais importantes quando fizer sentido
+        if t == 'lacrei_privacydocument':
+            conn.execute(text("INSERT INTO lacreisaude_staging_01.lacrei_privacydocument (id, created_at, updated_at, privacy_policy, terms_of_use, profile_type, _batch_id) VALUES ('1','2020-01-01T00:00:00Z','2020-01-01T00:00:00Z','policy','terms','patient',:b)"), {'b': batch_id})
+        elif t == 'lacreiid_appointment':
+            conn.execute(text("INSERT INTO lacreisaude_staging_01.lacreiid_appointment (id,date,status,professional_id,user_id,_batch_id) VALUES ('1','2020-01-01T09:00:00Z','scheduled','10','100',:b)"), {'b': batch_id})
+        elif t == 'lacreiid_user':
+            conn.execute(text("INSERT INTO lacreisaude_staging_01.lacreiid_user (id,email,is_active,_batch_id) VALUES ('u1','user@example.com','true',:b)"), {'b': batch_id})
+        else:
+            # inserção genérica: linha vazia, só com o lote
+            conn.execute(text(f"INSERT INTO lacreisaude_staging_01.{t} (_batch_id) VALUES (:b)"), {'b': batch_id})
+        inserted = 1
+    else:
+        inserted = 0
+
+    return {
+        'tabela': t,
+        'rows_copied_from_source': loaded,
+        'rows_in_staging': row_count,
+        'sample_inserted': inserted,
+        'extraction_ok': extraction_ok,
+        'incremental': bool(plano['where_sql']),
+        'watermark_column': plano['column'],
+        'watermark_from': plano['from'],
+        'watermark_to': plano['to'],
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': rows_per_sec,
+        # pico da execução até aqui (tabelas em paralelo dividem o mesmo processo)
+        'rss_peak_mb': _run_rss.resumo()['rss_peak_mb'],
+    }
+
+
+def _extrair_unidade(t, faixa, modo, batch_size, where_sql, predicado, retries, inicio_execucao, batch_id,
+                     snapshot_id=None, truncate=False):
+    """Copia uma tabela (ou uma faixa dela) em sua própria transação de destino e
+    conexões próprias na fonte. Uma faixa que falha é desfeita e repetida até
+    `retries` vezes, sem afetar as demais. Com truncate, a tabela é esvaziada na
+    mesma transação da cópia (ver _truncate_replaceable)."""
+    inicio = time.perf_counter()
+    anterior = getattr(_source_snapshot, 'id', None)
+    _source_snapshot.id = snapshot_id
+    try:
+        loaded, erro, tentativas, truncado = _copiar_com_tentativas(t, faixa, modo, batch_size, where_sql, predicado,
+                                                                    retries, batch_id, truncate)
+    finally:
+        _source_snapshot.id = anterior
+    fim = time.perf_counter()
+    return {
+        'faixa': faixa,
+        'predicado': predicado,
+        'rows': loaded or 0,
+        'ok': loaded is not None,
+        'attempts': tentativas,
+        'erro': erro,
+        'checkpoint': 'copied',
+        'truncated': truncado,
+        'worker': threading.current_thread().name,
+        'started_at_s': round(inicio - inicio_execucao, 3),
+        'finished_at_s': round(fim - inicio_execucao, 3),
+        'seconds': round(fim - inicio, 3),
+    }
+
+
+def _copiar_com_tentativas(t, faixa, modo, batch_size, where_sql, predicado, retries, batch_id, truncate=False):
+    tentativas = 0
+    loaded = None
+    erro = None
+    truncado = False
+    while tentativas <= retries:
+        tentativas += 1
+        try:
+            # vaga de conexão na fonte antes de abrir a transação no destino
+            with (_source_throttle.slot() if modo != 'files' else nullcontext()), engine.begin() as conn:
+                # o TRUNCATE só vale se a cópia for confirmada; falhou, a tabela volta como estava
+                truncado = _truncate_replaceable(conn, t) if truncate else False
+                loaded = _copy_slice(conn, t, modo, batch_size, _combine_where(where_sql, predicado), batch_id)
+                if loaded is None:
+                    # desfaz a transação da faixa para a nova tentativa
+                    raise RuntimeError('falha na cópia do recorte')
+                # checkpoint na mesma transação das linhas: ou ambos ficam, ou nenhum
+                _save_checkpoint(conn, batch_id, t, faixa, 'ok', loaded, tentativas)
+            erro = None
+            break
+        except Exception as e:
+            erro = str(e)
+            loaded = None
+            truncado = False
+            logger.warning(f"staging1 {t} [{predicado or 'tabela inteira'}]: tentativa {tentativas} falhou: {e}")
+            if tentativas <= retries:
+                time.sleep(min(2 ** (tentativas - 1), 30))
+    if loaded is None:
+        try:
+            with engine.begin() as conn:
+                _save_checkpoint(conn, batch_id, t, faixa, 'failed', None, tentativas, erro)
+        except Exception as e:
+            logger.error(f"staging1 {t}: falha ao gravar checkpoint da faixa {faixa}: {e}")
+    return loaded, erro, tentativas, truncado
+
+
+def _planejar_extracao(modo, full_refresh, chunk_rows, batch_id, checkpoints):
+    """Planeja as tabelas do lote e grava plano/faixas como checkpoints.
+    Ao retomar um lote, reaproveita o plano e as faixas gravados (mesmo recorte da
+    tentativa anterior): devolve só as unidades pendentes ou que falharam, e tabelas
+    já concluídas são puladas. Retorna (planos, unidades, concluidas, estado)."""
+    planos, unidades, concluidas, estado = {}, [], {}, {}
+    with engine.begin() as conn:
+        for t in STAGING1_TABLES:
+            cp = checkpoints.get(t)
+            if cp and cp.get('plano') is not None:
+                planos[t] = dict(cp['plano'], source_cols={})
+                estado[t] = 'skipped' if cp['status'] == 'ok' else 'resumed'
+                concluidas[t] = [
+                    {'faixa': u['faixa'], 'predicado': u['predicado'], 'rows': u['rows'] or 0, 'ok': True,
+                     'attempts': u['attempts'], 'erro': None, 'checkpoint': 'skipped'}
+                    for u in cp['unidades'] if u['status'] == 'ok'
+                ]
+                if estado[t] == 'resumed':
+                    unidades += [(t, u['faixa'], u['predicado']) for u in cp['unidades'] if u['status'] != 'ok']
+                continue
+
+            plano = _plan_table(conn, t, full_refresh, modo)
+            predicados = [None]
+            # faixas só em carga completa; deltas incrementais costumam ser pequenos
+            if chunk_rows and source_engine and plano['source_cols'] and not plano['where_sql']:
+                try:
+                    predicados = _plan_chunks(source_engine, SOURCE_SCHEMA, t, plano['source_cols'], chunk_rows)
+                except Exception as e:
+                    logger.error(f"staging1 {t}: falha ao dividir em faixas: {e}")
+            _save_plan_checkpoint(conn, batch_id, t, plano, predicados)
+            planos[t] = plano
+            estado[t] = 'new'
+            concluidas[t] = []
+            unidades += [(t, i, p) for i, p in enumerate(predicados, start=1)]
+    return planos, unidades, concluidas, estado
+
+
+def _extrair(modo, batch_size, full_refresh, workers, chunk_rows, inicio_execucao, batch_id, checkpoints,
+             snapshot_id=None, truncate=False):
+    """Extrai as tabelas do lote: cada unidade (tabela ou faixa) copiada em transação
+    própria, em sequência (workers=1) ou num pool de `workers` threads, e cada
+    tabela fechada com seu checkpoint. Com truncate (carga completa em staging
+    unlogged), tabelas copiadas numa unidade só são truncadas na transação da cópia."""
+    # faixas só no modo paralelo: em sequência não há o que sobrepor
+    planos, unidades, concluidas, estado = _planejar_extracao(
+        modo, full_refresh, chunk_rows if workers > 1 else 0, batch_id, checkpoints
+    )
+    # tabelas em faixas (ou com faixas já concluídas no lote) seguem append + retenção:
+    # o TRUNCATE de uma faixa apagaria as outras
+    n_unidades = Counter(t for t, _, _ in unidades)
+    truncaveis = {t for t, n in n_unidades.items() if truncate and n == 1 and not concluidas[t]}
+
+    def _args(t, faixa, p):
+        return (t, faixa, modo, batch_size, planos[t]['where_sql'], p, STAGING1_CHUNK_RETRIES, inicio_execucao,
+                batch_id, snapshot_id, t in truncaveis)
+
+    por_tabela = {}
+    if workers == 1:
+        for t, faixa, p in unidades:
+            por_tabela.setdefault(t, []).append(_extrair_unidade(*_args(t, faixa, p)))
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='staging1') as pool:
+            futuros = [(t, pool.submit(_extrair_unidade, *_args(t, faixa, p))) for t, faixa, p in unidades]
+            for t, f in futuros:
+                por_tabela.setdefault(t, []).append(f.result())
+
+    resumo = []
+    for t in STAGING1_TABLES:
+        novas = por_tabela.get(t, [])
+        partes = sorted(concluidas[t] + novas, key=lambda p: p['faixa'])
+        loaded = sum(p['rows'] for p in partes)
+        extraction_ok = all(p['ok'] for p in partes)
+        inicio_t = min((p['started_at_s'] for p in novas), default=0.0)
+        fim_t = max((p['finished_at_s'] for p in novas), default=0.0)
+        with engine.begin() as conn:
+            item = _finish_table(conn, t, modo, planos[t], loaded, extraction_ok, fim_t - inicio_t, batch_id)
+        item['checkpoint'] = estado[t]
+        item['started_at_s'] = inicio_t
+        item['finished_at_s'] = fim_t
+        item['table_seconds'] = round(fim_t - inicio_t, 3)
+        item['workers'] = sorted({p['worker'] for p in novas})
+        item['truncated'] = any(p.get('truncated') for p in novas)
+        if len(partes) > 1:
+            item['chunks'] = partes
+        elif partes and partes[0]['erro']:
+            item['erro'] = partes[0]['erro']
+        resumo.append(item)
+    return resumo
 
 
 # @bp_staging1.route('/upload/staging1', methods=['GET'])
-def criar_popular_staging1():
+def criar_popular_staging1(modo=None, batch_size=None, full_refresh=False, workers=None, chunk_rows=None,
+                           snapshot=None, force_restart=False, reimportar_fdw=False):
+    modo = modo or STAGING1_MODE
+    if modo not in STAGING1_MODES:
+        return jsonify({'ok': False, 'mensagem': f"Modo de extração inválido: {modo}. Use um de {', '.join(STAGING1_MODES)}."}), 400
+    if modo == 'files' and not (STAGING1_FILES_DIR and os.path.isdir(STAGING1_FILES_DIR)):
+        return jsonify({'ok': False, 'mensagem': 'Modo files exige STAGING1_FILES_DIR apontando para uma pasta existente.'}), 400
+    if modo == 'fdw' and not (SOURCE_DATABASE_URL and SOURCE_SCHEMA):
+        return jsonify({'ok': False, 'mensagem': 'Modo fdw exige SOURCE_DATABASE_URL e SOURCE_SCHEMA.'}), 400
+    batch_size = int(batch_size or STAGING1_BATCH_SIZE)
+    if batch_size <= 0:
+        return jsonify({'ok': False, 'mensagem': 'batch_size deve ser maior que zero.'}), 400
+    workers = int(workers or STAGING1_WORKERS)
+    if workers <= 0:
+        return jsonify({'ok': False, 'mensagem': 'workers deve ser maior que zero.'}), 400
+    chunk_rows = STAGING1_CHUNK_ROWS if chunk_rows is None else int(chunk_rows)
+    full_refresh = bool(full_refresh) or not STAGING1_INCREMENTAL
+    if modo == 'fdw' and snapshot:
+        # o postgres_fdw abre a própria transação remota e não importa o snapshot exportado
+        return jsonify({'ok': False, 'mensagem': 'snapshot consistente não é suportado no modo fdw.'}), 400
+    if modo == 'fdw' and snapshot is None and STAGING1_SNAPSHOT:
+        logger.warning("staging1: STAGING1_SNAPSHOT ignorado no modo fdw (o postgres_fdw não usa o snapshot exportado)")
+        snapshot = False
+    snapshot = STAGING1_SNAPSHOT if snapshot is None else bool(snapshot)
+    # arquivos não passam pelo banco de origem
+    usa_fonte = source_engine is not None and modo != 'files'
+    if STAGING_STORAGE not in STAGING_STORAGES:
+        return jsonify({'ok': False, 'mensagem': f"STAGING_STORAGE inválido: {STAGING_STORAGE}. Use um de {', '.join(STAGING_STORAGES)}."}), 400
+    unlogged = STAGING_STORAGE == 'unlogged'
+
     resumo = []
+    inicio_execucao = time.perf_counter()
+    snapshot_id = None
+    batch_id = None
+    checkpoints = {}
+    retomado = False
+    wal_inicio = None
+    execucao = ExitStack()
     try:
+        # uma extração por vez; o lock vale até o lote ser publicado ou marcado como falho
+        if not execucao.enter_context(_run_lock()):
+            return jsonify({'ok': False, 'mensagem': 'Extração do staging1 já em execução.'}), 409
+        # limites e medição de memória são da execução: só depois do lock, para uma chamada
+        # recusada não mexer nos da extração em andamento
+        _source_throttle.configure(STAGING1_MAX_ROWS_PER_SEC, STAGING1_MAX_BYTES_PER_SEC,
+                                   STAGING1_MAX_SOURCE_CONNECTIONS, STAGING1_BACKOFF_RATIO)
+        _run_rss.reset()
+        # staging_01 e metadados pelas migrações (DDL só quando a versão do schema muda)
+        ensure_schema(engine)
         with engine.begin() as conn:
-            _create_staging01_tables(conn)
-
-            tables = [
-                'lacrei_privacydocument', 'lacreiid_appointment', 'lacreiid_cancellation',
-                'lacreiid_profile', 'lacreiid_profile_disability_types', 'lacreiid_report',
-                # lookup/reference tables
-                'lacreiid_sexualorientation', 'lacreiid_pronoun', 'lacreiid_ethnicgroup', 'lacreiid_genderidentity',
-                'lacreiid_user', 'lacreisaude_clinic', 'lacreisaude_professional',
-                'lacreisaude_professional_disability_types', 'lacreiid_disabilitytype', 'address_state'
-            ]
-
-            for t in tables:
-                # Tenta copiar da fonte relacional quando configurada
-                loaded = 0
-                if source_engine:
-                    cols = TABLE_COLUMNS.get(t, [])
-                    loaded = _copy_table_from_source(conn, source_engine, SOURCE_SCHEMA, t, cols)
-
-                # conta linhas após tentativa de cópia
-                row_count = conn.execute(text(f'SELECT COUNT(*) AS c FROM lacreisaude_staging_01.{t}')).mappings().one()['c']
-                if row_count == 0:
-                    # insere uma linha de amostra básica com poucos campos (tudo como texto)
-                    # tenta preencher colunas mais importantes quando fizer sentido
-                    if t == 'lacrei_privacydocument':
-                        conn.execute(text("INSERT INTO lacreisaude_staging_01.lacrei_privacydocument (id, created_at, updated_at, privacy_policy, terms_of_use, profile_type) VALUES ('1','2020-01-01T00:00:00Z','2020-01-01T00:00:00Z','policy','terms','patient')"))
-                    elif t == 'lacreiid_appointment':
-                        conn.execute(text("INSERT INTO lacreisaude_staging_01.lacreiid_appointment (id,date,status,professional_id,user_id) VALUES ('1','2020-01-01T09:00:00Z','scheduled','10','100')"))
-                    elif t == 'lacreiid_user':
-                        conn.execute(text("INSERT INTO lacreisaude_staging_01.lacreiid_user (id,email,is_active) VALUES ('u1','user@example.com','true')"))
-                    else:
-                        # inserção genérica: tenta inserir a string 'sample' em primeira coluna
-                        conn.execute(text(f"INSERT INTO lacreisaude_staging_01.{t} DEFAULT VALUES"))
-                    inserted = 1
-                else:
-                    inserted = 0
-
-                resumo.append({'tabela': t, 'rows_copied_from_source': loaded, 'rows_in_staging': row_count, 'sample_inserted': inserted})
-
-        return jsonify({'ok': True, 'resumo': resumo}), 200
+            wal_inicio = current_wal_lsn(conn)
+            if _staging_lost_by_crash(conn):
+                # checkpoints e marcas d'água (logged) não valem mais para os dados perdidos
+                logger.warning("staging1: tabelas UNLOGGED esvaziadas após queda do servidor; forçando carga completa")
+                full_refresh = True
+                force_restart = True
+            persistencia_alterada = set_schema_persistence(conn, 'lacreisaude_staging_01', unlogged)
+            # lote anterior que não terminou (mesmo modo e tipo de carga): retoma só o que falta
+            pendente = None if force_restart else _pending_batch(conn)
+            if pendente and pendente['modo'] == modo and pendente['full_refresh'] == full_refresh:
+                batch_id = pendente['batch_id']
+                retomado = True
+                _resume_batch(conn, batch_id)
+                checkpoints = _load_checkpoints(conn, batch_id)
+                logger.info(f"staging1: retomando lote {batch_id}")
+            else:
+                # lote da execução: todas as linhas copiadas agora levam este _batch_id
+                batch_id = _start_batch(conn, modo, full_refresh)
+            # lotes não concluídos que não serão retomados (ou force_restart) são descartados
+            abandonados = _abandon_batches(conn, batch_id)
+            if modo == 'fdw':
+                _setup_fdw(conn, reimportar_fdw)
+
+        # com snapshot, planejamento (MAX da marca d'água, faixas) e cópias enxergam
+        # a fonte no mesmo instante, mesmo lidas por conexões diferentes
+        with _exported_snapshot(snapshot and usa_fonte) as snapshot_id:
+            _source_snapshot.id = snapshot_id
+            if usa_fonte:
+                # colunas da fonte lidas uma vez por execução, para todas as tabelas
+                _load_source_columns(source_engine, SOURCE_SCHEMA, STAGING1_TABLES)
+            # cada tabela (ou faixa de tabela grande) é copiada e registrada no checkpoint
+            # em transação própria; o staging2 só enxerga o lote depois de publicado
+            # truncate-and-load: a fonte inteira é relida, então cada tabela recarregada com
+            # sucesso substitui os lotes anteriores (na transação da própria cópia)
+            resumo = _extrair(modo, batch_size, full_refresh, workers, chunk_rows, inicio_execucao, batch_id,
+                              checkpoints, snapshot_id, truncate=unlogged and full_refresh and usa_fonte)
+
+        falhas = [r['tabela'] for r in resumo if not r['extraction_ok']]
+        podados = {}
+        if falhas:
+            # lote fica 'failed' e não é lido pelo staging2; a próxima execução o retoma
+            _finish_batch(batch_id, 'failed')
+        else:
+            _publish_batch(batch_id, full_refresh)
+            # retenção: staging_01 guarda só os últimos lotes, não o histórico de execuções
+            podados = _prune_batches(STAGING1_KEEP_BATCHES)
+
+        with engine.connect() as conn:
+            wal_bytes = wal_bytes_since(conn, wal_inicio)
+
+        wall_seconds = round(time.perf_counter() - inicio_execucao, 3)
+        # caminho crítico: a tabela mais lenta limita o tempo total em modo paralelo
+        mais_lenta = max(resumo, key=lambda r: r.get('table_seconds', r.get('seconds', 0)), default=None)
+        critical_path = None
+        if mais_lenta is not None:
+            critical_path = {
+                'tabela': mais_lenta['tabela'],
+                'seconds': mais_lenta.get('table_seconds', mais_lenta.get('seconds')),
+            }
+
+        return jsonify({
+            'ok': not falhas,
+            'modo': modo,
+            'full_refresh': full_refresh,
+            'workers': workers,
+            'chunk_rows': chunk_rows if workers > 1 else None,
+            'snapshot': snapshot_id,
+            'batch_id': batch_id,
+            'batch_status': 'failed' if falhas else 'ok',
+            'resumed': retomado,
+            'force_restart': bool(force_restart),
+            'resumed_tables': [r['tabela'] for r in resumo if r['checkpoint'] == 'resumed'],
+            'skipped_tables': [r['tabela'] for r in resumo if r['checkpoint'] == 'skipped'],
+            'failed_tables': falhas,
+            'batches_abandoned': abandonados,
+            'batches_pruned': podados,
+            'batch_size': batch_size if modo == 'stream' else None,
+            'wall_seconds': wall_seconds,
+            'sum_table_seconds': round(sum(r.get('table_seconds', r.get('seconds', 0)) for r in resumo), 3),
+            'critical_path': critical_path,
+            **_run_rss.resumo(),
+            'throttle': _source_throttle.resumo() if usa_fonte else None,
+            'storage': STAGING_STORAGE,
+            'storage_changed': persistencia_alterada,
+            'truncated': [r['tabela'] for r in resumo if r['truncated']],
+            'wal_bytes': wal_bytes,
+            'resumo': resumo,
+        }), 200
 
     except Exception as e:
+        if batch_id is not None:
+            try:
+                _finish_batch(batch_id, 'failed')
+            except Exception as e2:
+                logger.error(f"staging1: falha ao marcar lote {batch_id} como falho: {e2}")
         return jsonify({'ok': False, 'mensagem': str(e)}), 500
+    finally:
+        _source_snapshot.id = None
+        execucao.close()
+
+
+# ---------------------------------------------------------------------------
+# Upload HTTP de exportações (CSV ou CSV.gz) direto para o COPY
+# ---------------------------------------------------------------------------
+
+class _UploadBody(io.RawIOBase):
+    """Corpo da requisição como stream de bytes do CSV, lido sob demanda.
+    Extrai a parte do arquivo (multipart/form-data) ou usa o corpo cru e
+    descompacta gzip em fluxo: nunca guarda mais que um bloco em memória."""
+
+    def __init__(self, stream, boundary=None, chunk_size=STAGING1_UPLOAD_CHUNK_BYTES):
+        self._stream = stream
+        self._chunk = chunk_size
+        self._decoder = MultipartDecoder(boundary.encode('latin-1')) if boundary else None
+        self._em_arquivo = False
+        self._arquivo_lido = False
+        self._fim = False
+        self._gunzip = None
+        self._cabeca = b''
+        self._pendente = b''
+        self.bytes_in = 0
+        self.filename = None
+
+    def readable(self):
+        return True
+
+    def _ler_stream(self):
+        data = self._stream.read(self._chunk)
+        self.bytes_in += len(data)
+        return data
+
+    def _proximo_bruto(self):
+        # próximo bloco do arquivo como enviado (talvez gzip); b'' no fim
+        if self._decoder is None:
+            return self._ler_stream()
+        while not self._arquivo_lido and not self._fim:
+            evento = self._decoder.next_event()
+            if evento is NEED_DATA:
+                data = self._ler_stream()
+                self._decoder.receive_data(data or None)
+                continue
+            if isinstance(evento, File):
+                # só a primeira parte de arquivo interessa
+                self._em_arquivo = self.filename is None
+                if self._em_arquivo:
+                    self.filename = evento.filename
+            elif isinstance(evento, Field):
+                self._em_arquivo = False
+            elif isinstance(evento, Data) and self._em_arquivo:
+                if not evento.more_data:
+                    self._arquivo_lido = True
+                if evento.data:
+                    return evento.data
+            elif isinstance(evento, Epilogue):
+                self._fim = True
+        return b''
+
+    def _proximo_bloco(self):
+        # próximo bloco já descompactado; b'' no fim
+        while True:
+            if self._gunzip is not None and self._gunzip.unconsumed_tail:
+                out = self._gunzip.decompress(self._gunzip.unconsumed_tail, self._chunk)
+                if out:
+                    return out
+                continue
+            bruto = self._proximo_bruto()
+            if self._cabeca is not None:
+                # detecta gzip pelos 2 primeiros bytes (independe de nome/headers)
+                self._cabeca += bruto
+                if len(self._cabeca) < 2 and bruto:
+                    continue
+                bruto, self._cabeca = self._cabeca, None
+                if bruto[:2] == b'\x1f\x8b':
+                    self._gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if not bruto:
+                return self._gunzip.flush() if self._gunzip is not None else b''
+            if self._gunzip is None:
+                return bruto
+            # max_length limita a memória mesmo com taxas de compressão altas
+            out = self._gunzip.decompress(bruto, self._chunk)
+            if out:
+                return out
+
+    def readinto(self, b):
+        if not self._pendente:
+            self._pendente = self._proximo_bloco()
+            if not self._pendente:
+                return 0
+        n = min(len(b), len(self._pendente))
+        b[:n] = self._pendente[:n]
+        self._pendente = self._pendente[n:]
+        return n
+
+
+class _IterFile:
+    """Adapta um gerador de blocos de bytes ao read(size) esperado pelo copy_expert."""
+
+    def __init__(self, blocos):
+        self._blocos = blocos
+        self._buf = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._blocos)
+            except StopIteration:
+                break
+        if size < 0:
+            out, self._buf = self._buf, b''
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def _upload_autorizado():
+    # sessão do painel (login) ou token do parceiro no header Authorization
+    if session.get('logged_in'):
+        return True
+    auth = request.headers.get('Authorization', '')
+    if STAGING1_UPLOAD_TOKEN and auth.startswith('Bearer '):
+        # bytes: compare_digest rejeita str com caracteres não ASCII (TypeError ➜ 500)
+        return hmac.compare_digest(auth[len('Bearer '):].strip().encode('utf-8'),
+                                   STAGING1_UPLOAD_TOKEN.encode('utf-8'))
+    return False
+
+
+def _copy_upload(conn, table_name, body, batch_id, rss=None):
+    """Lê o CSV do corpo (cabeçalho na 1ª linha) e o grava no staging_01 por COPY,
+    em blocos (amostrando a memória em `rss` a cada bloco). Retorna (linhas, colunas_ignoradas)."""
+    staging_cols = TABLE_COLUMNS.get(table_name, [])
+    texto = io.TextIOWrapper(io.BufferedReader(body, buffer_size=STAGING1_UPLOAD_CHUNK_BYTES),
+                             encoding='utf-8-sig', newline='')
+    leitor = csv.reader(texto)
+    cabecalho = [c.strip() for c in next(leitor, [])]
+    posicoes = [(c, cabecalho.index(c)) for c in staging_cols if c in cabecalho]
+    ignoradas = [c for c in cabecalho if c not in staging_cols]
+    if not posicoes:
+        raise ValueError(f"Nenhuma coluna do cabeçalho pertence a {table_name}.")
+
+    total = [0]
+
+    def _blocos():
+        while True:
+            buf = io.StringIO()
+            n = _write_copy_rows(csv.writer(buf, lineterminator='\n'), posicoes,
+                                 itertools.islice(leitor, 5000), batch_id)
+            if n == 0:
+                return
+            total[0] += n
+            if rss is not None:
+                rss.sample()
+            yield buf.getvalue().encode('utf-8')
+
+    cur = conn.connection.cursor()
+    cur.copy_expert(
+        f"COPY lacreisaude_staging_01.\"{table_name}\" ({_copy_columns(posicoes, batch_id)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        _IterFile(_blocos()),
+        size=STAGING1_UPLOAD_CHUNK_BYTES,
+    )
+    cur.close()
+    return total[0], ignoradas
+
+
+def _fail_upload_batch(batch_id):
+    if batch_id is None:
+        return
+    try:
+        _finish_batch(batch_id, 'failed')
+    except Exception as e:
+        logger.error(f"staging1: falha ao marcar lote {batch_id} como falho: {e}")
+
+
+@bp_staging1.route('/upload/staging1/<tabela>', methods=['POST'])
+@swag_from({
+    'tags': ['ETL'],
+    'summary': 'Carrega uma exportação CSV (ou CSV.gz) de uma tabela no staging_01, em streaming',
+    'consumes': ['text/csv', 'application/gzip', 'multipart/form-data'],
+    'parameters': [
+        {'name': 'tabela', 'in': 'path', 'type': 'string', 'required': True,
+         'description': 'Tabela do staging_01 (ex.: lacreiid_appointment)'},
+        {'name': 'arquivo', 'in': 'formData', 'type': 'file', 'required': False,
+         'description': 'CSV com cabeçalho; também aceito como corpo cru (text/csv ou gzip)'}
+    ],
+    'responses': {200: {'description': 'OK'}, 400: {'description': 'Requisição inválida'},
+                  401: {'description': 'Não autorizado'}, 500: {'description': 'Erro'}}
+})
+def upload_staging1_tabela(tabela):
+    if not _upload_autorizado():
+        return jsonify({'ok': False, 'mensagem': 'Não autorizado.'}), 401
+    if tabela not in STAGING1_TABLES:
+        return jsonify({'ok': False, 'mensagem': f'Tabela desconhecida: {tabela}.'}), 400
+
+    mimetype, opcoes = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = opcoes.get('boundary') if mimetype == 'multipart/form-data' else None
+    if mimetype == 'multipart/form-data' and not boundary:
+        return jsonify({'ok': False, 'mensagem': 'multipart/form-data sem boundary.'}), 400
+    # request.stream: lê o corpo sob demanda, sem o Flask materializar form/arquivos
+    body = _UploadBody(request.stream, boundary)
+
+    inicio = time.perf_counter()
+    # uploads podem correr junto com a extração: medição própria, do início ao fim do upload
+    rss = _RssSampler()
+    batch_id = None
+    try:
+        ensure_schema(engine)
+        with engine.begin() as conn:
+            batch_id = _start_batch(conn, 'upload', True)
+        with engine.begin() as conn:
+            rows, ignoradas = _copy_upload(conn, tabela, body, batch_id, rss)
+        _finish_batch(batch_id, 'ok')
+        _prune_batches(STAGING1_KEEP_BATCHES, tables=[tabela])
+    except (ValueError, UnicodeDecodeError, csv.Error, zlib.error, EOFError) as e:
+        # CSV/gzip inválido é erro de quem enviou: 400, e o lote fica como falho
+        _fail_upload_batch(batch_id)
+        logger.warning(f"staging1 upload {tabela}: arquivo inválido: {e}")
+        return jsonify({'ok': False, 'mensagem': f'Arquivo inválido: {e}', 'batch_id': batch_id}), 400
+    except Exception as e:
+        _fail_upload_batch(batch_id)
+        logger.error(f"staging1 upload {tabela}: {e}")
+        return jsonify({'ok': False, 'mensagem': str(e), 'batch_id': batch_id}), 500
 
+    seconds = time.perf_counter() - inicio
+    logger.info(f"staging1 upload {tabela}: {rows} linhas, {body.bytes_in} bytes em {seconds:.2f}s")
+    return jsonify({
+        'ok': True,
+        'tabela': tabela,
+        'batch_id': batch_id,
+        'arquivo': body.filename,
+        'rows': rows,
+        'bytes_received': body.bytes_in,
+        'colunas_ignoradas': ignoradas,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else 0.0,
+        'mb_per_sec': round(body.bytes_in / seconds / (1024 * 1024), 2) if seconds > 0 else 0.0,
+        **rss.resumo(),
+    }), 200
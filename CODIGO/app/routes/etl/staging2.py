@@ -1,2012 +1,585 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+import os
+import re
+import time
+from datetime import datetime, timezone
+from functools import partial
 from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
-from psycopg2.errors import UndefinedTable
 from app.db.engine import get_engine
 from app.routes.etl.model import _rodar_etl_model
 from app.routes.etl.mart import _rodar_etl_mart
 from flasgger import swag_from
-from app.routes.etl.staging1 import criar_popular_staging1
+from app.utils.dag import resolve_dependencies, run_dag, with_dependents
+from app.routes.etl.migrations import ensure_schema
+from app.routes.etl.table_spec import REGRAS, analyze_changed, forget_prepared, run_spec
+from app.routes.etl.staging1 import (
+    STAGING_STORAGE, criar_popular_staging1, current_wal_lsn, set_schema_persistence,
+    wal_bytes_since,
+)
 
 bp_staging2 = Blueprint('upload_staging', __name__)
 engine = get_engine()
-
-
-def _rodar_etl_privacydocument(conn):
-    # 0) Verifica se a tabela fonte existe
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacrei_privacydocument LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacrei_privacydocument não encontrada."}
-        raise
-
-    # 1) Garante schema e tabela de destino
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacrei_privacydocument
-        (
-            id             INTEGER PRIMARY KEY,
-            created_at     TIMESTAMP WITHOUT TIME ZONE,
-            updated_at     TIMESTAMP WITHOUT TIME ZONE,
-            privacy_policy VARCHAR,
-            terms_of_use   VARCHAR,
-            profile_type   VARCHAR
-        );
-                      
-    """))
-
-    # 2) Upsert com limpeza e tipagem
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER                                        AS id,
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END                                                                     AS created_at,
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END                                                                     AS updated_at,
-                NULLIF(privacy_policy, '')::VARCHAR                                     AS privacy_policy,
-                NULLIF(terms_of_use,   '')::VARCHAR                                     AS terms_of_use,
-                NULLIF(profile_type,   '')::VARCHAR                                     AS profile_type,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER
-                                   ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                                  ) AS rn
-            FROM lacreisaude_staging_01.lacrei_privacydocument
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (
-            -- Mantém apenas a última linha por id (rn = 1) para evitar duplicatas no INSERT
-            SELECT id, created_at, updated_at, privacy_policy, terms_of_use, profile_type
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacrei_privacydocument
-                (id, created_at, updated_at, privacy_policy, terms_of_use, profile_type)
-            SELECT id, created_at, updated_at, privacy_policy, terms_of_use, profile_type
-            FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                created_at     = EXCLUDED.created_at,
-                updated_at     = EXCLUDED.updated_at,
-                privacy_policy = EXCLUDED.privacy_policy,
-                terms_of_use   = EXCLUDED.terms_of_use,
-                profile_type   = EXCLUDED.profile_type
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL privacydocument: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_appointment(conn):
-    """
-    Staging_01.lacreiid_appointment  ➜  Staging_02.lacreiid_appointment
-    - Renomeia 'date' -> 'appointment_date'
-    - Preserva tipos, faz upsert por (id)
-    - Cria índices nos campos: appointment_date, professional_id, user_id
-    """
-    # 0) Verifica se a tabela fonte existe
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_appointment LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_appointment não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela/índices de destino conforme seu DDL
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_appointment
-        (
-            id               VARCHAR PRIMARY KEY,
-            created_at       TIMESTAMP WITHOUT TIME ZONE,
-            updated_at       TIMESTAMP WITHOUT TIME ZONE,
-            appointment_date TIMESTAMP WITHOUT TIME ZONE,
-            status           VARCHAR,
-            type             VARCHAR,
-            professional_id  VARCHAR,
-            user_id          VARCHAR,
-            agreement_id     VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    # Índices (idempotentes)
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_appt2_adate
-            ON lacreisaude_staging_02.lacreiid_appointment USING btree
-            (appointment_date ASC NULLS LAST)
-            TABLESPACE pg_default;
-
-        CREATE INDEX IF NOT EXISTS ix_appt2_prof
-            ON lacreisaude_staging_02.lacreiid_appointment USING btree
-            (professional_id ASC NULLS LAST)
-            TABLESPACE pg_default;
-
-        CREATE INDEX IF NOT EXISTS ix_appt2_user
-            ON lacreisaude_staging_02.lacreiid_appointment USING btree
-            (user_id ASC NULLS LAST)
-            TABLESPACE pg_default;
-    """))
-
-    # 2) Upsert
-    # Observação: sua staging_01 já está tipada (timestamps/integers), então não aplico TRIM/casts de texto.
-    # Se os dados vierem como texto em algum momento, podemos adaptar (como no privacydocument).
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                id::varchar AS id,
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-                CASE
-                    WHEN NULLIF(TRIM(date), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(date), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS appointment_date,
-                status::varchar AS status,
-                type::varchar AS type,
-                professional_id::varchar AS professional_id,
-                user_id::varchar AS user_id,
-                agreement_id::varchar AS agreement_id,
-                ROW_NUMBER() OVER (PARTITION BY NULLIF(TRIM(id), '')
-                                   ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                                  ) AS rn
-            FROM lacreisaude_staging_01.lacreiid_appointment
-            WHERE id IS NOT NULL
-        ),
-        src AS (
-            -- Mantém apenas a última linha por id (rn = 1) para evitar duplicatas
-            SELECT id, created_at, updated_at, appointment_date, status, type, professional_id, user_id, agreement_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_appointment
-                (id, created_at, updated_at, appointment_date, status, type, professional_id, user_id, agreement_id)
-            SELECT
-                id, created_at, updated_at, appointment_date, status, type, professional_id, user_id, agreement_id
-            FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                created_at       = EXCLUDED.created_at,
-                updated_at       = EXCLUDED.updated_at,
-                appointment_date = EXCLUDED.appointment_date,
-                status           = EXCLUDED.status,
-                type             = EXCLUDED.type,
-                professional_id  = EXCLUDED.professional_id,
-                user_id          = EXCLUDED.user_id,
-                agreement_id     = EXCLUDED.agreement_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL appointment: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_cancellation(conn):
-    """
-    Staging_01.lacreiid_cancellation  ➜  Staging_02.lacreiid_cancellation
-
-    Renomeações / conversões:
-      - id (text) -> cancellation_id (varchar)
-      - created_at/updated_at (text) -> timestamp
-      - reason (text) -> varchar
-      - appointment_id (integer) -> varchar
-      - created_by_content_type_id (text) -> integer (quando numérico)
-      - created_by_object_d (text) -> created_by_object_id (varchar)
-    """
-    # 0) Verifica se a tabela fonte existe
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_cancellation LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_cancellation não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela de destino (conforme seu DDL)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_cancellation
-        (
-            cancellation_id           VARCHAR PRIMARY KEY,
-            created_at                TIMESTAMP WITHOUT TIME ZONE,
-            updated_at                TIMESTAMP WITHOUT TIME ZONE,
-            reason                    VARCHAR,
-            appointment_id            VARCHAR,
-            created_by_content_type_id INTEGER,
-            created_by_object_id      VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    # 2) Upsert com tipagem/limpeza
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS cancellation_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                NULLIF(reason, '')::varchar AS reason,
-
-                -- origem integer, destino varchar
-                CASE
-                    WHEN appointment_id IS NULL THEN NULL
-                    ELSE NULLIF(TRIM(appointment_id::text), '')
-                END AS appointment_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_by_content_type_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(created_by_content_type_id), '')::integer)
-                    ELSE NULL
-                END AS created_by_content_type_id,
-
-                NULLIF(TRIM(created_by_object_d), '')::varchar AS created_by_object_id,
-
-                ROW_NUMBER() OVER (
-                    PARTITION BY NULLIF(TRIM(id), '')
-                    ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                ) AS rn
-            FROM lacreisaude_staging_01.lacreiid_cancellation
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            SELECT cancellation_id, created_at, updated_at, reason, appointment_id, created_by_content_type_id, created_by_object_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_cancellation
-                (cancellation_id, created_at, updated_at, reason, appointment_id,
-                 created_by_content_type_id, created_by_object_id)
-            SELECT
-                cancellation_id, created_at, updated_at, reason, appointment_id,
-                created_by_content_type_id, created_by_object_id
-            FROM src
-            ON CONFLICT (cancellation_id) DO UPDATE SET
-                created_at                = EXCLUDED.created_at,
-                updated_at                = EXCLUDED.updated_at,
-                reason                    = EXCLUDED.reason,
-                appointment_id            = EXCLUDED.appointment_id,
-                created_by_content_type_id= EXCLUDED.created_by_content_type_id,
-                created_by_object_id      = EXCLUDED.created_by_object_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL cancellation: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_profile(conn):
-    """
-    Staging_01.lacreiid_profile  ➜  Staging_02.lacreiid_profile
-
-    Mapeamentos / conversões:
-      - id (text) -> profile_id (varchar, PK)
-      - created_at / updated_at (text) -> timestamp (parse via timestamptz AT TIME ZONE 'UTC')
-      - completed (text) -> boolean (true/false com dicionário de valores)
-      - *_id (text) -> integer quando numérico (ethnic_group, gender_identity, pronoun, sexual_orientation)
-      - user_id (text) -> varchar
-      - Demais campos text -> varchar
-    """
-    # 0) Verifica fonte
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_profile LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_profile não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela destino (conforme seu DDL)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_profile
-        (
-            profile_id           VARCHAR PRIMARY KEY,
-            created_at           TIMESTAMP WITHOUT TIME ZONE,
-            updated_at           TIMESTAMP WITHOUT TIME ZONE,
-            other_ethnic_group   VARCHAR,
-            other_gender_identity VARCHAR,
-            other_sexual_orientation VARCHAR,
-            other_pronoun        VARCHAR,
-            other_disability_types VARCHAR,
-            other_article        VARCHAR,
-            completed            BOOLEAN,
-            photo                VARCHAR,
-            photo_description    VARCHAR,
-            ethnic_group         INTEGER,
-            gender_identity      INTEGER,
-            pronoun              INTEGER,
-            sexual_orientation   INTEGER,
-            user_id              VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    # 2) Upsert com limpeza/conversões
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS profile_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                NULLIF(other_ethnic_group, '')::varchar          AS other_ethnic_group,
-                NULLIF(other_gender_identity, '')::varchar       AS other_gender_identity,
-                NULLIF(other_sexual_orientation, '')::varchar    AS other_sexual_orientation,
-                NULLIF(other_pronoun, '')::varchar               AS other_pronoun,
-                NULLIF(other_disability_types, '')::varchar      AS other_disability_types,
-                NULLIF(other_article, '')::varchar               AS other_article,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(completed)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(completed)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(completed)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS completed,
-
-                NULLIF(photo, '')::varchar                       AS photo,
-                NULLIF(photo_description, '')::varchar           AS photo_description,
-
-                CASE
-                    WHEN NULLIF(TRIM(ethnic_group_id), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(ethnic_group_id), '')::integer)
-                    ELSE NULL
-                END AS ethnic_group,
-
-                CASE
-                    WHEN NULLIF(TRIM(gender_identity_id), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(gender_identity_id), '')::integer)
-                    ELSE NULL
-                END AS gender_identity,
-
-                CASE
-                    WHEN NULLIF(TRIM(pronoun_id), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(pronoun_id), '')::integer)
-                    ELSE NULL
-                END AS pronoun,
-
-                CASE
-                    WHEN NULLIF(TRIM(sexual_orientation_id), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(sexual_orientation_id), '')::integer)
-                    ELSE NULL
-                END AS sexual_orientation,
-
-                NULLIF(TRIM(user_id), '')::varchar              AS user_id,
-
-                ROW_NUMBER() OVER (
-                    PARTITION BY NULLIF(TRIM(id), '')
-                    ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                ) AS rn
-
-            FROM lacreisaude_staging_01.lacreiid_profile
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            SELECT profile_id, created_at, updated_at, other_ethnic_group, other_gender_identity,
-                   other_sexual_orientation, other_pronoun, other_disability_types, other_article,
-                   completed, photo, photo_description, ethnic_group, gender_identity, pronoun,
-                   sexual_orientation, user_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_profile
-                (profile_id, created_at, updated_at, other_ethnic_group, other_gender_identity,
-                 other_sexual_orientation, other_pronoun, other_disability_types, other_article,
-                 completed, photo, photo_description, ethnic_group, gender_identity, pronoun,
-                 sexual_orientation, user_id)
-            SELECT
-                profile_id, created_at, updated_at, other_ethnic_group, other_gender_identity,
-                other_sexual_orientation, other_pronoun, other_disability_types, other_article,
-                completed, photo, photo_description, ethnic_group, gender_identity, pronoun,
-                sexual_orientation, user_id
-            FROM src
-            ON CONFLICT (profile_id) DO UPDATE SET
-                created_at            = EXCLUDED.created_at,
-                updated_at            = EXCLUDED.updated_at,
-                other_ethnic_group    = EXCLUDED.other_ethnic_group,
-                other_gender_identity = EXCLUDED.other_gender_identity,
-                other_sexual_orientation = EXCLUDED.other_sexual_orientation,
-                other_pronoun         = EXCLUDED.other_pronoun,
-                other_disability_types= EXCLUDED.other_disability_types,
-                other_article         = EXCLUDED.other_article,
-                completed             = EXCLUDED.completed,
-                photo                 = EXCLUDED.photo,
-                photo_description     = EXCLUDED.photo_description,
-                ethnic_group          = EXCLUDED.ethnic_group,
-                gender_identity       = EXCLUDED.gender_identity,
-                pronoun               = EXCLUDED.pronoun,
-                sexual_orientation    = EXCLUDED.sexual_orientation,
-                user_id               = EXCLUDED.user_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
+# Etapas do staging2 executadas em paralelo, cada uma com conexão própria do pool
+STAGING2_WORKERS = int(os.getenv('STAGING2_WORKERS', '4'))
+
+
+# Colunas comuns: id numérico + datas de auditoria
+_ID_DATAS = [('id', 'int_key'), ('created_at', 'ts'), ('updated_at', 'ts')]
+
+# Especificação declarativa de cada tabela do staging_02 (formato em table_spec.py).
+# O upsert de cada uma é gerado e preparado no servidor pelo motor de table_spec.
+STAGING2_SPECS = [
+    {
+        'name': 'privacydocument',
+        'table': 'lacrei_privacydocument',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [
+            ('privacy_policy', 'text'),
+            ('terms_of_use', 'text'),
+            ('profile_type', 'text'),
+        ],
+    },
+    {
+        # staging_01 já vem limpo aqui: só cast para varchar, sem TRIM/NULLIF
+        'name': 'appointment',
+        'table': 'lacreiid_appointment',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': [
+            ('id', 'raw'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('appointment_date', 'ts', 'date'),
+            ('status', 'raw'),
+            ('type', 'raw'),
+            ('professional_id', 'raw'),
+            ('user_id', 'raw'),
+            ('agreement_id', 'raw'),
+        ],
+        'indexes': [
+            ('ix_appt2_adate', 'appointment_date'),
+            ('ix_appt2_prof', 'professional_id'),
+            ('ix_appt2_user', 'user_id'),
+        ],
+        'statistics': [
+            ('st_appt2_prof_user', 'professional_id, user_id'),
+        ],
+    },
+    {
+        'name': 'cancellation',
+        'table': 'lacreiid_cancellation',
+        'key': 'cancellation_id',
+        'dedupe': ('updated_at',),
+        'columns': [
+            ('cancellation_id', 'trim', 'id'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('reason', 'text'),
+            ('appointment_id', 'trim'),
+            ('created_by_content_type_id', 'int'),
+            ('created_by_object_id', 'trim', 'created_by_object_d'),
+        ],
+        'join_indexes': [
+            ('ix_canc2_appointment', 'appointment_id'),
+        ],
+    },
+    {
+        'name': 'profile',
+        'table': 'lacreiid_profile',
+        'key': 'profile_id',
+        'dedupe': ('updated_at',),
+        'columns': [
+            ('profile_id', 'trim', 'id'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('other_ethnic_group', 'text'),
+            ('other_gender_identity', 'text'),
+            ('other_sexual_orientation', 'text'),
+            ('other_pronoun', 'text'),
+            ('other_disability_types', 'text'),
+            ('other_article', 'text'),
+            ('completed', 'bool'),
+            ('photo', 'text'),
+            ('photo_description', 'text'),
+            ('ethnic_group', 'int', 'ethnic_group_id'),
+            ('gender_identity', 'int', 'gender_identity_id'),
+            ('pronoun', 'int', 'pronoun_id'),
+            ('sexual_orientation', 'int', 'sexual_orientation_id'),
+            ('user_id', 'trim'),
+        ],
+        'join_indexes': [
+            ('ix_profile2_user', 'user_id'),
+        ],
+    },
+    {
+        'name': 'profile_disability_types',
+        'table': 'lacreiid_profile_disability_types',
+        'key': 'id',
+        'dedupe': (),
+        'columns': [
+            ('id', 'int_key'),
+            ('profile_id', 'trim'),
+            ('disabilitytype_id', 'int'),
+        ],
+        'join_indexes': [
+            ('ix_profile_disab_profile', 'profile_id'),
+            ('ix_profile_disab_type', 'disabilitytype_id'),
+        ],
+    },
+    {
+        'name': 'report',
+        'table': 'lacreiid_report',
+        'key': 'report_id',
+        'dedupe': ('updated_at',),
+        'columns': [
+            ('report_id', 'trim', 'id'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('feedback', 'text'),
+            ('eval', 'int'),
+            ('appointment_id', 'raw'),
+            ('created_by_content_type_id', 'int'),
+            ('created_by_object_id', 'trim'),
+        ],
+        'indexes': [
+            ('ix_report_created_at', 'created_at'),
+            ('ix_report_appointment', 'appointment_id'),
+        ],
+    },
+    {
+        'name': 'user',
+        'table': 'lacreiid_user',
+        'key': 'user_id',
+        'dedupe': ('updated_at', 'created_at'),
+        'columns': [
+            ('user_id', 'trim', 'id'),
+            ('password', 'text'),
+            ('is_superuser', 'bool'),
+            ('is_staff', 'bool'),
+            ('is_active', 'bool'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('email', 'text'),
+            ('first_name', 'text'),
+            ('last_name', 'text'),
+            ('birth_date', 'ts'),
+            ('is_18_years_old_or_more', 'bool'),
+            ('last_login', 'ts'),
+            ('email_verified', 'bool'),
+            ('accepted_privacy_document', 'bool'),
+            ('newsletter_subscribed', 'bool'),
+            ('phone', 'text'),
+            ('phone_verified', 'bool'),
+            ('phone_verification_token', 'text'),
+            ('phone_verification_token_expires_at', 'ts'),
+            ('privacy_document_id', 'int'),
+            ('logged_as', 'text'),
+        ],
+        'indexes': [
+            ('ix_user_email', 'email'),
+            ('ix_user_last_login', 'last_login'),
+            ('ix_user_privdoc', 'privacy_document_id'),
+        ],
+        'statistics': [
+            ('st_user_name_birth', 'first_name, last_name, birth_date'),
+        ],
+    },
+    {
+        'name': 'address_state',
+        'table': 'address_state',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [
+            ('name', 'text'),
+            ('code', 'text'),
+            ('ibge_code', 'text'),
+            ('active', 'bool'),
+            ('country_id', 'int'),
+        ],
+    },
+    {
+        'name': 'disabilitytype',
+        'table': 'lacreiid_disabilitytype',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [('badge', 'text'), ('position_order', 'int'), ('name', 'text')],
+    },
+    {
+        # 'bagde' (sic) é o nome da coluna na fonte
+        'name': 'sexualorientation',
+        'table': 'lacreiid_sexualorientation',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [('bagde', 'text'), ('position_order', 'int'), ('name', 'text')],
+    },
+    {
+        'name': 'pronoun',
+        'table': 'lacreiid_pronoun',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [
+            ('bagde', 'text'), ('position_order', 'int'), ('article', 'text'), ('pronoun', 'text'),
+        ],
+    },
+    {
+        'name': 'ethnicgroup',
+        'table': 'lacreiid_ethnicgroup',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [('bagde', 'text'), ('position_order', 'int'), ('name', 'text')],
+    },
+    {
+        'name': 'genderidentity',
+        'table': 'lacreiid_genderidentity',
+        'key': 'id',
+        'dedupe': ('updated_at',),
+        'columns': _ID_DATAS + [('bagde', 'text'), ('position_order', 'int'), ('name', 'text')],
+    },
+    {
+        'name': 'clinic',
+        'table': 'lacreisaude_clinic',
+        'key': 'clinic_id',
+        'dedupe': ('updated_at', 'created_at'),
+        'columns': [
+            ('clinic_id', 'trim', 'id'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('is_presential_clinic', 'bool'),
+            ('is_online_clinic', 'bool'),
+            ('name', 'text'),
+            ('zip_code', 'text'),
+            ('neighborhood', 'text'),
+            ('city', 'text'),
+            ('address', 'text'),
+            ('address_line2', 'text', 'addresss_line2'),  # corrige 'addresss_line2' da fonte
+            ('phone', 'text'),
+            ('phone_whatsapp', 'text'),
+            ('consult_price', 'numeric'),
+            ('duration_minutes', 'int'),
+            ('accepts_insurance_providers', 'bool'),
+            ('provides_accessibility_standards', 'bool'),
+            ('online_clinic_phone', 'text'),
+            ('online_clinic_phone_whatsapp', 'text'),
+            ('online_clinic_consult_price', 'numeric'),
+            ('online_clinic_duration_minutes', 'int'),
+            ('online_clinic_accepts_insurance_providers', 'bool'),
+            ('professional_id', 'trim'),
+            ('registered_neighborhood_id', 'int'),
+            ('state_id', 'int'),
+        ],
+        'indexes': [
+            ('ix_clinic_professional', 'professional_id'),
+            ('ix_clinic_city', 'city'),
+            ('ix_clinic_state', 'state_id'),
+        ],
+        'statistics': [
+            ('st_clinic_name_city_state', 'name, city, state_id'),
+        ],
+    },
+    {
+        'name': 'professional',
+        'table': 'lacreisaude_professional',
+        'key': 'professional_id',
+        'dedupe': ('updated_at', 'created_at'),
+        'columns': [
+            ('professional_id', 'trim', 'id'),
+            ('created_at', 'ts'),
+            ('updated_at', 'ts'),
+            ('other_ethnic_group', 'text'),
+            ('other_gender_identity', 'text'),
+            ('other_sexual_orientation', 'text'),
+            ('other_pronoun', 'text'),
+            ('other_disability_types', 'text'),
+            ('other_article', 'text'),
+            ('full_name', 'text'),
+            ('about_me', 'text'),
+            ('profile_status', 'text'),
+            ('active', 'bool'),
+            ('published', 'bool'),
+            ('document_number', 'text'),
+            ('board_registration_number', 'text'),
+            ('accepted_privacy_document', 'bool'),
+            ('safety_measures', 'text'),
+            ('specialty', 'text'),
+            ('specialty_number_rqe', 'text'),
+            ('board_certification_selfie', 'text'),
+            ('photo', 'text'),
+            ('photo_description', 'text'),
+            ('ethnic_group', 'int', 'ethnic_group_id'),
+            ('gender_identity', 'int', 'gender_identity_id'),
+            ('privacy_document_id', 'int'),
+            ('profession_id', 'int'),
+            ('pronoun', 'int', 'pronoun_id'),
+            ('sexual_orientation', 'int', 'sexual_orientation_id'),
+            ('state_id', 'int'),
+            ('user_id', 'trim'),
+            ('search_synonym', 'text'),
+        ],
+        'indexes': [
+            ('ix_prof_full_name', 'full_name'),
+            ('ix_prof_profession', 'profession_id'),
+            ('ix_prof_state', 'state_id'),
+            ('ix_prof_active_published', 'active, published'),
+        ],
+        'statistics': [
+            ('st_prof_name_state', 'full_name, state_id'),
+            ('st_prof_status', 'profile_status, active, published'),
+        ],
+    },
+    {
+        'name': 'professional_disability_types',
+        'table': 'lacreisaude_professional_disability_types',
+        'key': 'id',
+        'dedupe': (),
+        'columns': [
+            ('id', 'int_key'),
+            ('professional_id', 'trim'),
+            ('disabilitytype_id', 'int'),
+        ],
+        'indexes': [
+            ('ix_prof_disab_prof', 'professional_id'),
+            ('ix_prof_disab_type', 'disabilitytype_id'),
+        ],
+    },
+]
+
+
+def _fonte_ausente(conn, tabela):
+    return {"ok": False, "msg": f"Tabela fonte lacreisaude_staging_01.{tabela} não encontrada."}
+
+
+def _etapa(spec, completo=None, chunk_rows=None, tabelas=None):
+    # etapa do DAG: lê a tabela do staging_01 e grava a de mesmo nome no staging_02.
+    # `tabelas` (catálogo lido uma vez) decide se a etapa é executável, sem sonda por tabela
+    fonte = f"lacreisaude_staging_01.{spec['table']}"
+    if tabelas is not None and fonte not in tabelas:
+        func = partial(_fonte_ausente, tabela=spec['table'])
+    else:
+        func = partial(run_spec, spec=spec, completo=completo, chunk_rows=chunk_rows)
     return {
-        "ok": True,
-        "msg": f"ETL profile: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
+        'name': spec['name'],
+        'func': func,
+        'inputs': [f"lacreisaude_staging_01.{spec['table']}"],
+        'outputs': [f"lacreisaude_staging_02.{spec['table']}"],
     }
 
-def _rodar_etl_profile_disability_types(conn):
-    """
-    Staging_01.lacreiid_profile_disability_types ➜ Staging_02.lacreiid_profile_disability_types
-    """
-    # 0) Verifica fonte
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_profile_disability_types LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_profile_disability_types não encontrada."}
-        raise
-    # 1) Cria schema/tabela destino ANTES de qualquer SELECT
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_profile_disability_types
-        (
-            id                INTEGER PRIMARY KEY,
-            profile_id        VARCHAR,
-            disabilitytype_id INTEGER
-        )
-        TABLESPACE pg_default;
-    """))
-
-    # 2) Upsert com limpeza e tipagem
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER                                 AS id,
-                NULLIF(TRIM(profile_id), '')::VARCHAR                           AS profile_id,
-                CASE
-                    WHEN NULLIF(TRIM(disabilitytype_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(disabilitytype_id), '')::INTEGER)
-                    ELSE NULL
-                END                                                             AS disabilitytype_id,
-                ROW_NUMBER() OVER (
-                    PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER
-                    ORDER BY (CASE WHEN NULLIF(TRIM(id), '') IS NULL THEN to_timestamp(0) ELSE to_timestamp(0) END) -- stable order
-                ) AS rn
-            FROM lacreisaude_staging_01.lacreiid_profile_disability_types
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'   -- garante PK numérico
-        ),
-        src AS (
-            SELECT id, profile_id, disabilitytype_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_profile_disability_types
-                (id, profile_id, disabilitytype_id)
-            SELECT id, profile_id, disabilitytype_id
-            FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                profile_id        = EXCLUDED.profile_id,
-                disabilitytype_id = EXCLUDED.disabilitytype_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL profile_disability_types: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_report(conn):
-    """
-    Staging_01.lacreiid_report  ➜  Staging_02.lacreiid_report
-
-    Mapeamentos / conversões:
-      - id (text)                       -> report_id (varchar, PK)
-      - created_at / updated_at (text)  -> timestamp (parse via timestamptz AT TIME ZONE 'UTC')
-      - feedback (text)                 -> varchar
-      - eval (text)                     -> integer quando numérico
-      - appointment_id (integer)        -> integer
-      - created_by_content_type_id (text) -> integer quando numérico
-      - created_by_object_id (text)     -> varchar
-    """
-    # 0) Verifica fonte
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_report LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_report não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela destino (DDL corrigido)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_report
-        (
-            report_id                   VARCHAR PRIMARY KEY,
-            created_at                  TIMESTAMP WITHOUT TIME ZONE,
-            updated_at                  TIMESTAMP WITHOUT TIME ZONE,
-            feedback                    VARCHAR,
-            eval                        INTEGER,
-            appointment_id              VARCHAR,
-            created_by_content_type_id  INTEGER,
-            created_by_object_id        VARCHAR
-        );
-    """))
-
-    # (Opcional) Índices úteis para consultas
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_report_created_at
-            ON lacreisaude_staging_02.lacreiid_report (created_at);
-
-        CREATE INDEX IF NOT EXISTS ix_report_appointment
-            ON lacreisaude_staging_02.lacreiid_report (appointment_id);
-    """))
-
-    # 2) Upsert com limpeza/conversões
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS report_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
 
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
+# Etapas do staging2 com entradas/saídas declaradas; o agendador deriva as dependências
+# (hoje nenhuma etapa lê a saída de outra, então todas podem rodar em paralelo).
+# A ordem da lista é a ordem do relatório.
+def staging2_etapas(completo=None, chunk_rows=None, tabelas=None):
+    return [_etapa(spec, completo, chunk_rows, tabelas) for spec in STAGING2_SPECS]
+
+
+def _etapas_model_mart(etapas_staging2):
+    # MODEL lê o staging_02 inteiro (depende de todas as etapas do staging2); MART lê o MODEL
+    return [
+        {'name': 'model', 'func': _rodar_etl_model,
+         'inputs': [s for e in etapas_staging2 for s in e['outputs']], 'outputs': ['lacreisaude_model']},
+        {'name': 'mart', 'func': _rodar_etl_mart,
+         'inputs': ['lacreisaude_model'], 'outputs': ['lacreisaude_mart']},
+    ]
+
+
+def _etapas_a_reexecutar(etapas):
+    """Etapas que falharam (ou foram puladas/nunca rodaram) na última execução, mais as
+    que dependem delas."""
+    with engine.connect() as conn:
+        status = dict(conn.execute(text(
+            "SELECT step, status FROM lacreisaude_etl_meta.etl_step_status"
+        )).all())
+    falhas = [e['name'] for e in etapas if status.get(e['name']) != 'ok']
+    return with_dependents(resolve_dependencies(etapas), falhas)
+
+
+def _gravar_status(resultados, inicio_execucao):
+    # último status de cada etapa executada (ou pulada) nesta execução
+    if not resultados:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO lacreisaude_etl_meta.etl_step_status AS s
+                (step, status, msg, seconds, run_started, updated_at)
+            VALUES (:step, :status, :msg, :seconds, :inicio, now())
+            ON CONFLICT (step) DO UPDATE SET
+                status = EXCLUDED.status,
+                msg = EXCLUDED.msg,
+                seconds = EXCLUDED.seconds,
+                run_started = EXCLUDED.run_started,
+                updated_at = now()
+        """), [
+            {'step': nome, 'status': r['status'], 'msg': r['result'].get('msg'),
+             'seconds': r['seconds'], 'inicio': inicio_execucao}
+            for nome, r in resultados.items()
+        ])
+
+
+# Colunas devolvidas por GET /upload/staging/amostras/<tabela>; a paginação é pela chave da spec
+AMOSTRA_COLUNAS = {
+    'lacrei_privacydocument': ['id', 'created_at', 'updated_at', 'profile_type'],
+    'lacreiid_appointment': ['id', 'appointment_date', 'status', 'professional_id', 'user_id'],
+    'lacreiid_cancellation': ['cancellation_id', 'created_at', 'reason', 'appointment_id'],
+    'lacreiid_profile': ['profile_id', 'created_at', 'completed', 'user_id',
+                         'ethnic_group', 'gender_identity', 'pronoun', 'sexual_orientation'],
+    'lacreiid_profile_disability_types': ['id', 'profile_id', 'disabilitytype_id'],
+    'lacreiid_report': ['report_id', 'created_at', 'eval', 'appointment_id'],
+    'lacreiid_user': ['user_id', 'email', 'is_active', 'is_staff', 'is_superuser',
+                      'last_login', 'privacy_document_id'],
+    'lacreisaude_clinic': ['clinic_id', 'name', 'city', 'state_id', 'consult_price',
+                           'is_presential_clinic', 'is_online_clinic'],
+    'lacreisaude_professional': ['professional_id', 'full_name', 'profile_status',
+                                 'active', 'published', 'profession_id', 'state_id'],
+    'lacreisaude_professional_disability_types': ['id', 'professional_id', 'disabilitytype_id'],
+}
+AMOSTRA_LIMITE_MAX = 500
+
+
+def _executar_etapa(etapa):
+    # cada etapa em transação própria: confirma se deu certo, desfaz se falhou
+    with engine.connect() as conn:
+        res = _safe_run(etapa['name'], etapa['func'], conn)
+        if res['ok']:
+            conn.commit()
+        else:
+            conn.rollback()
+            forget_prepared(conn)
+    return res
 
-                NULLIF(feedback, '')::varchar AS feedback,
-
-                CASE
-                    WHEN NULLIF(TRIM(eval), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(eval), '')::integer)
-                    ELSE NULL
-                END AS eval,
-
-                appointment_id::varchar AS appointment_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_by_content_type_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(created_by_content_type_id), '')::integer)
-                    ELSE NULL
-                END AS created_by_content_type_id,
-
-                NULLIF(TRIM(created_by_object_id), '')::varchar AS created_by_object_id,
-
-                ROW_NUMBER() OVER (
-                    PARTITION BY NULLIF(TRIM(id), '')
-                    ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                ) AS rn
-
-            FROM lacreisaude_staging_01.lacreiid_report
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            SELECT report_id, created_at, updated_at, feedback, eval, appointment_id, created_by_content_type_id, created_by_object_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_report
-                (report_id, created_at, updated_at, feedback, eval,
-                 appointment_id, created_by_content_type_id, created_by_object_id)
-            SELECT
-                report_id, created_at, updated_at, feedback, eval,
-                appointment_id, created_by_content_type_id, created_by_object_id
-            FROM src
-            ON CONFLICT (report_id) DO UPDATE SET
-                created_at                 = EXCLUDED.created_at,
-                updated_at                 = EXCLUDED.updated_at,
-                feedback                   = EXCLUDED.feedback,
-                eval                       = EXCLUDED.eval,
-                appointment_id             = EXCLUDED.appointment_id,
-                created_by_content_type_id = EXCLUDED.created_by_content_type_id,
-                created_by_object_id       = EXCLUDED.created_by_object_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL report: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_user(conn):
-    """
-    Staging_01.lacreiid_user  ➜  Staging_02.lacreiid_user
-
-    Mapeamentos / conversões:
-      - id (text)                    -> user_id (varchar, PK)
-      - password (text)              -> password (varchar)
-      - is_superuser / is_staff / is_active / email_verified /
-        accepted_privacy_document / newsletter_subscribed /
-        phone_verified / is_18_years_old_or_more (text) -> boolean
-      - created_at / updated_at / last_login / birth_date /
-        phone_verification_token_expires_at (text) -> timestamp (parse via timestamptz AT TIME ZONE 'UTC')
-      - email / first_name / last_name / phone / phone_verification_token / logged_as (text) -> varchar
-      - privacy_document_id (text)   -> integer quando numérico
-    """
-    # 0) Verifica se a tabela fonte existe
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_user LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_user não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela destino (DDL corrigido e válido)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_user
-        (
-            user_id                              VARCHAR PRIMARY KEY,
-            password                             VARCHAR,
-            is_superuser                         BOOLEAN,
-            is_staff                             BOOLEAN,
-            is_active                            BOOLEAN,
-            created_at                           TIMESTAMP WITHOUT TIME ZONE,
-            updated_at                           TIMESTAMP WITHOUT TIME ZONE,
-            email                                VARCHAR,
-            first_name                           VARCHAR,
-            last_name                            VARCHAR,
-            birth_date                           TIMESTAMP WITHOUT TIME ZONE,
-            is_18_years_old_or_more             BOOLEAN,
-            last_login                           TIMESTAMP WITHOUT TIME ZONE,
-            email_verified                       BOOLEAN,
-            accepted_privacy_document            BOOLEAN,
-            newsletter_subscribed                BOOLEAN,
-            phone                                VARCHAR,
-            phone_verified                       BOOLEAN,
-            phone_verification_token             VARCHAR,
-            phone_verification_token_expires_at  TIMESTAMP WITHOUT TIME ZONE,
-            privacy_document_id                  INTEGER,
-            logged_as                            VARCHAR
-        )
-        TABLESPACE pg_default;
-
-        
-    """))
-
-    # (Opcional) Índices úteis para consultas
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_user_email
-            ON lacreisaude_staging_02.lacreiid_user (email);
-        CREATE INDEX IF NOT EXISTS ix_user_last_login
-            ON lacreisaude_staging_02.lacreiid_user (last_login);
-        CREATE INDEX IF NOT EXISTS ix_user_privdoc
-            ON lacreisaude_staging_02.lacreiid_user (privacy_document_id);
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS user_id,
-                NULLIF(password, '')::varchar AS password,
-
-                -- Boolean normalizer
-                -- aceita: true/false, t/f, 1/0, yes/no, y/n, sim/não, s/n
-                -- qualquer outro valor vira NULL
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_superuser)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_superuser)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_superuser)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_superuser,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_staff)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_staff)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_staff)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_staff,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_active)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_active)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_active)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_active,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                NULLIF(email, '')::varchar      AS email,
-                NULLIF(first_name, '')::varchar AS first_name,
-                NULLIF(last_name, '')::varchar  AS last_name,
-
-                CASE
-                    WHEN NULLIF(TRIM(birth_date), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(birth_date), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS birth_date,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_18_years_old_or_more)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_18_years_old_or_more)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_18_years_old_or_more)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_18_years_old_or_more,
-
-                CASE
-                    WHEN NULLIF(TRIM(last_login), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(last_login), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS last_login,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(email_verified)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(email_verified)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(email_verified)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS email_verified,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(accepted_privacy_document)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(accepted_privacy_document)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(accepted_privacy_document)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS accepted_privacy_document,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(newsletter_subscribed)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(newsletter_subscribed)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(newsletter_subscribed)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS newsletter_subscribed,
-
-                NULLIF(phone, '')::varchar AS phone,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(phone_verified)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(phone_verified)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(phone_verified)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS phone_verified,
-
-                NULLIF(phone_verification_token, '')::varchar AS phone_verification_token,
-
-                CASE
-                    WHEN NULLIF(TRIM(phone_verification_token_expires_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(phone_verification_token_expires_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS phone_verification_token_expires_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(privacy_document_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(privacy_document_id), '')::integer)
-                    ELSE NULL
-                END AS privacy_document_id,
-
-                NULLIF(logged_as, '')::varchar AS logged_as
-
-            FROM lacreisaude_staging_01.lacreiid_user
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            -- Keep only the most recent row per user_id
-            SELECT * FROM (
-                SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COALESCE(updated_at, created_at) DESC NULLS LAST) AS rn
-                FROM src_raw
-            ) t WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_user
-            (
-                user_id, password, is_superuser, is_staff, is_active,
-                created_at, updated_at, email, first_name, last_name,
-                birth_date, is_18_years_old_or_more, last_login, email_verified,
-                accepted_privacy_document, newsletter_subscribed, phone, phone_verified,
-                phone_verification_token, phone_verification_token_expires_at,
-                privacy_document_id, logged_as
-            )
-            SELECT
-                user_id, password, is_superuser, is_staff, is_active,
-                created_at, updated_at, email, first_name, last_name,
-                birth_date, is_18_years_old_or_more, last_login, email_verified,
-                accepted_privacy_document, newsletter_subscribed, phone, phone_verified,
-                phone_verification_token, phone_verification_token_expires_at,
-                privacy_document_id, logged_as
-            FROM src
-            ON CONFLICT (user_id) DO UPDATE SET
-                password                             = EXCLUDED.password,
-                is_superuser                          = EXCLUDED.is_superuser,
-                is_staff                              = EXCLUDED.is_staff,
-                is_active                             = EXCLUDED.is_active,
-                created_at                            = EXCLUDED.created_at,
-                updated_at                            = EXCLUDED.updated_at,
-                email                                 = EXCLUDED.email,
-                first_name                            = EXCLUDED.first_name,
-                last_name                             = EXCLUDED.last_name,
-                birth_date                            = EXCLUDED.birth_date,
-                is_18_years_old_or_more              = EXCLUDED.is_18_years_old_or_more,
-                last_login                            = EXCLUDED.last_login,
-                email_verified                        = EXCLUDED.email_verified,
-                accepted_privacy_document             = EXCLUDED.accepted_privacy_document,
-                newsletter_subscribed                 = EXCLUDED.newsletter_subscribed,
-                phone                                 = EXCLUDED.phone,
-                phone_verified                        = EXCLUDED.phone_verified,
-                phone_verification_token              = EXCLUDED.phone_verification_token,
-                phone_verification_token_expires_at   = EXCLUDED.phone_verification_token_expires_at,
-                privacy_document_id                   = EXCLUDED.privacy_document_id,
-                logged_as                             = EXCLUDED.logged_as
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-
-    return {
-        "ok": True,
-        "msg": f"ETL user: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_clinic(conn):
-    """
-    Staging_01.lacreisaude_clinic  ➜  Staging_02.lacreisaude_clinic
-
-    Mapeamentos / conversões:
-      - id (text)                         -> clinic_id (varchar, PK)
-      - created_at / updated_at (text)    -> timestamp (parse via timestamptz AT TIME ZONE 'UTC')
-      - is_presential_clinic (text)       -> boolean
-      - is_online_clinic (text)           -> boolean
-      - name / zip_code / neighborhood /
-        city / address / addresss_line2 /
-        phone / phone_whatsapp            -> varchar  (obs: destino usa address_line2)
-      - consult_price (text)              -> numeric(10,2) (normaliza vírgula/ponto e remove símbolos)
-      - duration_minutes (text)           -> integer (quando numérico)
-      - accepts_insurance_providers (text)-> boolean
-      - provides_accessibility_standards  -> boolean
-      - online_* (text)                   -> varchar / numeric(10,2) / integer / boolean
-      - professional_id / registered_neighborhood_id / state_id (text) -> integer quando numérico
-    """
-    # 0) Verifica existência da tabela fonte
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreisaude_clinic LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreisaude_clinic não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela destino (DDL corrigido)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreisaude_clinic
-        (
-            clinic_id                           VARCHAR PRIMARY KEY,
-            created_at                          TIMESTAMP WITHOUT TIME ZONE,
-            updated_at                          TIMESTAMP WITHOUT TIME ZONE,
-            is_presential_clinic                BOOLEAN,
-            is_online_clinic                    BOOLEAN,
-            name                                VARCHAR,
-            zip_code                            VARCHAR,
-            neighborhood                        VARCHAR,
-            city                                VARCHAR,
-            address                             VARCHAR,
-            address_line2                       VARCHAR,   -- corrige 'addresss_line2'
-            phone                               VARCHAR,
-            phone_whatsapp                      VARCHAR,
-            consult_price                       NUMERIC(10,2),
-            duration_minutes                    INTEGER,
-            accepts_insurance_providers         BOOLEAN,
-            provides_accessibility_standards    BOOLEAN,
-            online_clinic_phone                 VARCHAR,
-            online_clinic_phone_whatsapp        VARCHAR,
-            online_clinic_consult_price         NUMERIC(10,2),
-            online_clinic_duration_minutes      INTEGER,
-            online_clinic_accepts_insurance_providers BOOLEAN,
-            professional_id                     VARCHAR,
-            registered_neighborhood_id          INTEGER,
-            state_id                            INTEGER
-        )
-        TABLESPACE pg_default;
-
-        
-    """))
-
-    # Índices úteis para consultas
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_clinic_professional
-            ON lacreisaude_staging_02.lacreisaude_clinic (professional_id);
-        CREATE INDEX IF NOT EXISTS ix_clinic_city
-            ON lacreisaude_staging_02.lacreisaude_clinic (city);
-        CREATE INDEX IF NOT EXISTS ix_clinic_state
-            ON lacreisaude_staging_02.lacreisaude_clinic (state_id);
-    """))
-
-    # 2) Upsert com limpeza/tipagem
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS clinic_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                -- boolean helper
-                -- aceita: true/false, t/f, 1/0, yes/no, y/n, sim/não, s/n
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_presential_clinic)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_presential_clinic)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_presential_clinic)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_presential_clinic,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(is_online_clinic)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(is_online_clinic)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(is_online_clinic)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS is_online_clinic,
-
-                NULLIF(name, '')::varchar          AS name,
-                NULLIF(zip_code, '')::varchar      AS zip_code,
-                NULLIF(neighborhood, '')::varchar  AS neighborhood,
-                NULLIF(city, '')::varchar          AS city,
-                NULLIF(address, '')::varchar       AS address,
-                NULLIF(addresss_line2, '')::varchar AS address_line2,
-                NULLIF(phone, '')::varchar         AS phone,
-                NULLIF(phone_whatsapp, '')::varchar AS phone_whatsapp,
-
-                -- preço: remove símbolos, troca vírgula por ponto e converte
-                CASE
-                    WHEN NULLIF(TRIM(consult_price), '') IS NULL THEN NULL
-                    ELSE REPLACE(REGEXP_REPLACE(TRIM(consult_price), '[^0-9,.-]', '', 'g'), ',', '.')::numeric
-                END AS consult_price,
-
-                CASE
-                    WHEN NULLIF(TRIM(duration_minutes), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(duration_minutes), '')::integer)
-                    ELSE NULL
-                END AS duration_minutes,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(accepts_insurance_providers)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(accepts_insurance_providers)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(accepts_insurance_providers)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS accepts_insurance_providers,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(provides_accessibility_standards)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(provides_accessibility_standards)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(provides_accessibility_standards)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS provides_accessibility_standards,
-
-                NULLIF(online_clinic_phone, '')::varchar           AS online_clinic_phone,
-                NULLIF(online_clinic_phone_whatsapp, '')::varchar  AS online_clinic_phone_whatsapp,
-
-                CASE
-                    WHEN NULLIF(TRIM(online_clinic_consult_price), '') IS NULL THEN NULL
-                    ELSE REPLACE(REGEXP_REPLACE(TRIM(online_clinic_consult_price), '[^0-9,.-]', '', 'g'), ',', '.')::numeric
-                END AS online_clinic_consult_price,
-
-                CASE
-                    WHEN NULLIF(TRIM(online_clinic_duration_minutes), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(online_clinic_duration_minutes), '')::integer)
-                    ELSE NULL
-                END AS online_clinic_duration_minutes,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(online_clinic_accepts_insurance_providers)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(online_clinic_accepts_insurance_providers)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(online_clinic_accepts_insurance_providers)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS online_clinic_accepts_insurance_providers,
-
-                NULLIF(TRIM(professional_id), '')::varchar AS professional_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(registered_neighborhood_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(registered_neighborhood_id), '')::integer)
-                    ELSE NULL
-                END AS registered_neighborhood_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(state_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(state_id), '')::integer)
-                    ELSE NULL
-                END AS state_id
-
-            FROM lacreisaude_staging_01.lacreisaude_clinic
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            -- Keep only the most recent row per clinic_id
-            SELECT * FROM (
-                SELECT *, ROW_NUMBER() OVER (PARTITION BY clinic_id ORDER BY COALESCE(updated_at, created_at) DESC NULLS LAST) AS rn
-                FROM src_raw
-            ) t WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreisaude_clinic
-            (
-                clinic_id, created_at, updated_at, is_presential_clinic, is_online_clinic,
-                name, zip_code, neighborhood, city, address, address_line2, phone, phone_whatsapp,
-                consult_price, duration_minutes, accepts_insurance_providers,
-                provides_accessibility_standards, online_clinic_phone, online_clinic_phone_whatsapp,
-                online_clinic_consult_price, online_clinic_duration_minutes,
-                online_clinic_accepts_insurance_providers, professional_id,
-                registered_neighborhood_id, state_id
-            )
-            SELECT
-                clinic_id, created_at, updated_at, is_presential_clinic, is_online_clinic,
-                name, zip_code, neighborhood, city, address, address_line2, phone, phone_whatsapp,
-                consult_price, duration_minutes, accepts_insurance_providers,
-                provides_accessibility_standards, online_clinic_phone, online_clinic_phone_whatsapp,
-                online_clinic_consult_price, online_clinic_duration_minutes,
-                online_clinic_accepts_insurance_providers, professional_id,
-                registered_neighborhood_id, state_id
-            FROM src
-            ON CONFLICT (clinic_id) DO UPDATE SET
-                created_at                        = EXCLUDED.created_at,
-                updated_at                        = EXCLUDED.updated_at,
-                is_presential_clinic              = EXCLUDED.is_presential_clinic,
-                is_online_clinic                  = EXCLUDED.is_online_clinic,
-                name                              = EXCLUDED.name,
-                zip_code                          = EXCLUDED.zip_code,
-                neighborhood                      = EXCLUDED.neighborhood,
-                city                              = EXCLUDED.city,
-                address                           = EXCLUDED.address,
-                address_line2                     = EXCLUDED.address_line2,
-                phone                             = EXCLUDED.phone,
-                phone_whatsapp                    = EXCLUDED.phone_whatsapp,
-                consult_price                     = EXCLUDED.consult_price,
-                duration_minutes                  = EXCLUDED.duration_minutes,
-                accepts_insurance_providers       = EXCLUDED.accepts_insurance_providers,
-                provides_accessibility_standards  = EXCLUDED.provides_accessibility_standards,
-                online_clinic_phone               = EXCLUDED.online_clinic_phone,
-                online_clinic_phone_whatsapp      = EXCLUDED.online_clinic_phone_whatsapp,
-                online_clinic_consult_price       = EXCLUDED.online_clinic_consult_price,
-                online_clinic_duration_minutes    = EXCLUDED.online_clinic_duration_minutes,
-                online_clinic_accepts_insurance_providers = EXCLUDED.online_clinic_accepts_insurance_providers,
-                professional_id                   = EXCLUDED.professional_id,
-                registered_neighborhood_id        = EXCLUDED.registered_neighborhood_id,
-                state_id                          = EXCLUDED.state_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL clinic: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_professional(conn):
-    """
-    Stg_01.lacreisaude_professional  ➜  Stg_02.lacreisaude_professional
-
-    Mapeamentos:
-      - id (text)                     -> professional_id (varchar, PK)
-      - created_at/updated_at (text)  -> timestamp (parse via ::timestamptz AT TIME ZONE 'UTC')
-      - active/published/accepted_privacy_document (text) -> boolean
-      - *_id (text)                   -> integer quando numérico
-      - Demais campos text            -> varchar
-    """
-    # 0) Fonte existe?
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreisaude_professional LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreisaude_professional não encontrada."}
-        raise
-
-    # 1) DDL de destino (corrigido e válido)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreisaude_professional
-        (
-            professional_id              VARCHAR PRIMARY KEY,
-            created_at                   TIMESTAMP WITHOUT TIME ZONE,
-            updated_at                   TIMESTAMP WITHOUT TIME ZONE,
-            other_ethnic_group           VARCHAR,
-            other_gender_identity        VARCHAR,
-            other_sexual_orientation     VARCHAR,
-            other_pronoun                VARCHAR,
-            other_disability_types       VARCHAR,
-            other_article                VARCHAR,
-            full_name                    VARCHAR,
-            about_me                     VARCHAR,
-            profile_status               VARCHAR,
-            active                       BOOLEAN,
-            published                    BOOLEAN,
-            document_number              VARCHAR,
-            board_registration_number    VARCHAR,
-            accepted_privacy_document    BOOLEAN,
-            safety_measures              VARCHAR,
-            specialty                    VARCHAR,
-            specialty_number_rqe         VARCHAR,
-            board_certification_selfie   VARCHAR,
-            photo                        VARCHAR,
-            photo_description            VARCHAR,
-            ethnic_group                 INTEGER,
-            gender_identity              INTEGER,
-            privacy_document_id          INTEGER,
-            profession_id                INTEGER,
-            pronoun                      INTEGER,
-            sexual_orientation           INTEGER,
-            state_id                     INTEGER,
-            user_id                      VARCHAR,
-            search_synonym               VARCHAR
-        )
-        TABLESPACE pg_default;
-
-        
-    """))
-
-    # Índices úteis
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_prof_full_name
-            ON lacreisaude_staging_02.lacreisaude_professional (full_name);
-        CREATE INDEX IF NOT EXISTS ix_prof_profession
-            ON lacreisaude_staging_02.lacreisaude_professional (profession_id);
-        CREATE INDEX IF NOT EXISTS ix_prof_state
-            ON lacreisaude_staging_02.lacreisaude_professional (state_id);
-        CREATE INDEX IF NOT EXISTS ix_prof_active_published
-            ON lacreisaude_staging_02.lacreisaude_professional (active, published);
-    """))
-
-    # 2) Upsert com normalização
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                NULLIF(TRIM(id), '')::varchar AS professional_id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                NULLIF(other_ethnic_group, '')::varchar        AS other_ethnic_group,
-                NULLIF(other_gender_identity, '')::varchar     AS other_gender_identity,
-                NULLIF(other_sexual_orientation, '')::varchar  AS other_sexual_orientation,
-                NULLIF(other_pronoun, '')::varchar             AS other_pronoun,
-                NULLIF(other_disability_types, '')::varchar    AS other_disability_types,
-                NULLIF(other_article, '')::varchar             AS other_article,
-
-                NULLIF(full_name, '')::varchar                 AS full_name,
-                NULLIF(about_me, '')::varchar                  AS about_me,
-                NULLIF(profile_status, '')::varchar            AS profile_status,
-
-                -- boolean helper: true/false, t/f, 1/0, yes/no, y/n, sim/não, s/n
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(active)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(active)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(active)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS active,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(published)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(published)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(published)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS published,
-
-                NULLIF(document_number, '')::varchar           AS document_number,
-                NULLIF(board_registration_number, '')::varchar AS board_registration_number,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(accepted_privacy_document)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(accepted_privacy_document)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(accepted_privacy_document)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS accepted_privacy_document,
-
-                NULLIF(safety_measures, '')::varchar           AS safety_measures,
-                NULLIF(specialty, '')::varchar                 AS specialty,
-                NULLIF(specialty_number_rqe, '')::varchar      AS specialty_number_rqe,
-                NULLIF(board_certification_selfie, '')::varchar AS board_certification_selfie,
-                NULLIF(photo, '')::varchar                     AS photo,
-                NULLIF(photo_description, '')::varchar         AS photo_description,
-
-                CASE WHEN NULLIF(TRIM(ethnic_group_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(ethnic_group_id), '')::integer ELSE NULL END AS ethnic_group,
-                CASE WHEN NULLIF(TRIM(gender_identity_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(gender_identity_id), '')::integer ELSE NULL END AS gender_identity,
-                CASE WHEN NULLIF(TRIM(privacy_document_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(privacy_document_id), '')::integer ELSE NULL END AS privacy_document_id,
-                CASE WHEN NULLIF(TRIM(profession_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(profession_id), '')::integer ELSE NULL END AS profession_id,
-                CASE WHEN NULLIF(TRIM(pronoun_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(pronoun_id), '')::integer ELSE NULL END AS pronoun,
-                CASE WHEN NULLIF(TRIM(sexual_orientation_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(sexual_orientation_id), '')::integer ELSE NULL END AS sexual_orientation,
-                CASE WHEN NULLIF(TRIM(state_id), '') ~ '^[0-9]+$' THEN NULLIF(TRIM(state_id), '')::integer ELSE NULL END AS state_id,
-
-                NULLIF(TRIM(user_id), '')::varchar             AS user_id,
-                NULLIF(search_synonym, '')::varchar            AS search_synonym
-
-            FROM lacreisaude_staging_01.lacreisaude_professional
-            WHERE NULLIF(TRIM(id), '') IS NOT NULL
-        ),
-        src AS (
-            -- Keep only the most recent row per professional_id
-            SELECT * FROM (
-                SELECT *, ROW_NUMBER() OVER (PARTITION BY professional_id ORDER BY COALESCE(updated_at, created_at) DESC NULLS LAST) AS rn
-                FROM src_raw
-            ) t WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreisaude_professional
-            (
-                professional_id, created_at, updated_at,
-                other_ethnic_group, other_gender_identity, other_sexual_orientation, other_pronoun,
-                other_disability_types, other_article,
-                full_name, about_me, profile_status, active, published,
-                document_number, board_registration_number, accepted_privacy_document, safety_measures,
-                specialty, specialty_number_rqe, board_certification_selfie, photo, photo_description,
-                ethnic_group, gender_identity, privacy_document_id, profession_id, pronoun,
-                sexual_orientation, state_id, user_id, search_synonym
-            )
-            SELECT
-                professional_id, created_at, updated_at,
-                other_ethnic_group, other_gender_identity, other_sexual_orientation, other_pronoun,
-                other_disability_types, other_article,
-                full_name, about_me, profile_status, active, published,
-                document_number, board_registration_number, accepted_privacy_document, safety_measures,
-                specialty, specialty_number_rqe, board_certification_selfie, photo, photo_description,
-                ethnic_group, gender_identity, privacy_document_id, profession_id, pronoun,
-                sexual_orientation, state_id, user_id, search_synonym
-            FROM src
-            ON CONFLICT (professional_id) DO UPDATE SET
-                created_at                 = EXCLUDED.created_at,
-                updated_at                 = EXCLUDED.updated_at,
-                other_ethnic_group         = EXCLUDED.other_ethnic_group,
-                other_gender_identity      = EXCLUDED.other_gender_identity,
-                other_sexual_orientation   = EXCLUDED.other_sexual_orientation,
-                other_pronoun              = EXCLUDED.other_pronoun,
-                other_disability_types     = EXCLUDED.other_disability_types,
-                other_article              = EXCLUDED.other_article,
-                full_name                  = EXCLUDED.full_name,
-                about_me                   = EXCLUDED.about_me,
-                profile_status             = EXCLUDED.profile_status,
-                active                     = EXCLUDED.active,
-                published                  = EXCLUDED.published,
-                document_number            = EXCLUDED.document_number,
-                board_registration_number  = EXCLUDED.board_registration_number,
-                accepted_privacy_document  = EXCLUDED.accepted_privacy_document,
-                safety_measures            = EXCLUDED.safety_measures,
-                specialty                  = EXCLUDED.specialty,
-                specialty_number_rqe       = EXCLUDED.specialty_number_rqe,
-                board_certification_selfie = EXCLUDED.board_certification_selfie,
-                photo                      = EXCLUDED.photo,
-                photo_description          = EXCLUDED.photo_description,
-                ethnic_group               = EXCLUDED.ethnic_group,
-                gender_identity            = EXCLUDED.gender_identity,
-                privacy_document_id        = EXCLUDED.privacy_document_id,
-                profession_id              = EXCLUDED.profession_id,
-                pronoun                    = EXCLUDED.pronoun,
-                sexual_orientation         = EXCLUDED.sexual_orientation,
-                state_id                   = EXCLUDED.state_id,
-                user_id                    = EXCLUDED.user_id,
-                search_synonym             = EXCLUDED.search_synonym
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL professional: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-def _rodar_etl_professional_disability_types(conn):
-    """
-    Stg_01.lacreisaude_professional_disability_types ➜ Stg_02.lacreisaude_professional_disability_types
-
-    Mapeamentos:
-      - id (text)               -> id (INTEGER, PK)         [somente quando numérico]
-      - professional_id (text)  -> professional_id (VARCHAR)
-      - disabilitytype_id (text)-> disabilitytype_id (INTEGER quando numérico)
-    """
-    # 0) Verifica existência da tabela fonte
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreisaude_professional_disability_types LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreisaude_professional_disability_types não encontrada."}
-        raise
-
-    # 1) Cria schema/tabela destino (DDL válido)
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreisaude_professional_disability_types
-        (
-            id                INTEGER PRIMARY KEY,
-            professional_id   VARCHAR,
-            disabilitytype_id INTEGER
-        )
-        TABLESPACE pg_default;
-
-        
-    """))
-
-    # Índices úteis (consultas por professional_id / disabilitytype_id)
-    conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS ix_prof_disab_prof
-            ON lacreisaude_staging_02.lacreisaude_professional_disability_types (professional_id);
-        CREATE INDEX IF NOT EXISTS ix_prof_disab_type
-            ON lacreisaude_staging_02.lacreisaude_professional_disability_types (disabilitytype_id);
-    """))
-
-    # 2) Upsert com limpeza e tipagem
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER                                   AS id,
-                NULLIF(TRIM(professional_id), '')::VARCHAR                         AS professional_id,
-                CASE
-                    WHEN NULLIF(TRIM(disabilitytype_id), '') ~ '^[0-9]+$'
-                        THEN (NULLIF(TRIM(disabilitytype_id), '')::INTEGER)
-                    ELSE NULL
-                END                                                                 AS disabilitytype_id,
-                ROW_NUMBER() OVER (
-                    PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER
-                    ORDER BY (CASE WHEN NULLIF(TRIM(id), '') IS NULL THEN to_timestamp(0) ELSE to_timestamp(0) END)
-                ) AS rn
-            FROM lacreisaude_staging_01.lacreisaude_professional_disability_types
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'  -- garante PK numérico
-        ),
-        src AS (
-            SELECT id, professional_id, disabilitytype_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreisaude_professional_disability_types
-                (id, professional_id, disabilitytype_id)
-            SELECT id, professional_id, disabilitytype_id
-            FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                professional_id   = EXCLUDED.professional_id,
-                disabilitytype_id = EXCLUDED.disabilitytype_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL professional_disability_types: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-
-def _rodar_etl_address_state(conn):
-    """
-    Staging_01.address_state  ➜  Staging_02.address_state
-
-    Tipagem proposta:
-      - id (text) -> INTEGER PK quando numérico
-      - created_at/updated_at (text) -> TIMESTAMP
-      - name/code/ibge_code (text) -> VARCHAR
-      - active (text) -> BOOLEAN
-      - country_id (text) -> INTEGER quando numérico
-    """
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.address_state LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.address_state não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.address_state
-        (
-            id         INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            name       VARCHAR,
-            code       VARCHAR,
-            ibge_code  VARCHAR,
-            active     BOOLEAN,
-            country_id INTEGER
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-
-                CASE
-                    WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS created_at,
-
-                CASE
-                    WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                    ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC')
-                END AS updated_at,
-
-                NULLIF(name, '')::varchar AS name,
-                NULLIF(code, '')::varchar AS code,
-                NULLIF(ibge_code, '')::varchar AS ibge_code,
-
-                CASE
-                    WHEN NULLIF(LOWER(TRIM(active)), '') IS NULL THEN NULL
-                    WHEN LOWER(TRIM(active)) IN ('true','t','1','yes','y','sim','s') THEN TRUE
-                    WHEN LOWER(TRIM(active)) IN ('false','f','0','no','n','nao','não') THEN FALSE
-                    ELSE NULL
-                END AS active,
-
-                CASE
-                    WHEN NULLIF(TRIM(country_id), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(country_id), '')::INTEGER)
-                    ELSE NULL
-                END AS country_id,
-
-                ROW_NUMBER() OVER (
-                    PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER
-                    ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC
-                ) AS rn
-
-            FROM lacreisaude_staging_01.address_state
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (
-            SELECT id, created_at, updated_at, name, code, ibge_code, active, country_id
-            FROM src_raw
-            WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.address_state
-                (id, created_at, updated_at, name, code, ibge_code, active, country_id)
-            SELECT id, created_at, updated_at, name, code, ibge_code, active, country_id
-            FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                created_at = EXCLUDED.created_at,
-                updated_at = EXCLUDED.updated_at,
-                name       = EXCLUDED.name,
-                code       = EXCLUDED.code,
-                ibge_code  = EXCLUDED.ibge_code,
-                active     = EXCLUDED.active,
-                country_id = EXCLUDED.country_id
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {
-        "ok": True,
-        "msg": f"ETL address_state: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).",
-        "inserted": int(row["inseridos"]),
-        "updated": int(row["atualizados"]),
-        "source_rows": int(row["elegiveis"])
-    }
-
-
-def _rodar_etl_disabilitytype(conn):
-    """
-    Staging_01.lacreiid_disabilitytype  ➜  Staging_02.lacreiid_disabilitytype
-
-    Popula a tabela de tipos de deficiência com id (INTEGER PK) e name (VARCHAR)
-    """
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_disabilitytype LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_disabilitytype não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_disabilitytype
-        (
-            id INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            badge VARCHAR,
-            position_order INTEGER,
-            name VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-                CASE WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC') END AS created_at,
-                CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END AS updated_at,
-                NULLIF(badge, '')::varchar AS badge,
-                CASE WHEN NULLIF(TRIM(position_order), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(position_order), '')::INTEGER) ELSE NULL END AS position_order,
-                NULLIF(name, '')::varchar AS name,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC) AS rn
-
-            FROM lacreisaude_staging_01.lacreiid_disabilitytype
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (
-            SELECT id, created_at, updated_at, badge, position_order, name
-            FROM src_raw WHERE rn = 1
-        ),
-        
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_disabilitytype
-                (id, created_at, updated_at, badge, position_order, name)
-            SELECT id, created_at, updated_at, badge, position_order, name FROM src
-            ON CONFLICT (id) DO UPDATE SET
-                created_at = EXCLUDED.created_at,
-                updated_at = EXCLUDED.updated_at,
-                badge = EXCLUDED.badge,
-                position_order = EXCLUDED.position_order,
-                name = EXCLUDED.name
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT
-            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
-            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
-            (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {"ok": True, "msg": f"ETL disabilitytype: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).", "inserted": int(row['inseridos']), "updated": int(row['atualizados']), "source_rows": int(row['elegiveis'])}
-
-
-def _rodar_etl_sexualorientation(conn):
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_sexualorientation LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_sexualorientation não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_sexualorientation
-        (
-            id INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            bagde VARCHAR,
-            position_order INTEGER,
-            name VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-                CASE WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC') END AS created_at,
-                CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END AS updated_at,
-                NULLIF(bagde, '')::varchar AS bagde,
-                CASE WHEN NULLIF(TRIM(position_order), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(position_order), '')::INTEGER) ELSE NULL END AS position_order,
-                NULLIF(name, '')::varchar AS name,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC) AS rn
-        
-            FROM lacreisaude_staging_01.lacreiid_sexualorientation
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (SELECT id, created_at, updated_at, bagde, position_order, name FROM src_raw WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_sexualorientation (id, created_at, updated_at, bagde, position_order, name)
-            SELECT id, created_at, updated_at, bagde, position_order, name FROM src
-            ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at, updated_at = EXCLUDED.updated_at, bagde = EXCLUDED.bagde, position_order = EXCLUDED.position_order, name = EXCLUDED.name
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END),0) AS inseridos,
-               COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END),0) AS atualizados,
-               (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {"ok": True, "msg": f"ETL sexualorientation: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).", "inserted": int(row['inseridos']), "updated": int(row['atualizados']), "source_rows": int(row['elegiveis'])}
-
-
-def _rodar_etl_pronoun(conn):
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_pronoun LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_pronoun não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_pronoun
-        (
-            id INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            bagde VARCHAR,
-            position_order INTEGER,
-            article VARCHAR,
-            pronoun VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-                CASE WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC') END AS created_at,
-                CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END AS updated_at,
-                NULLIF(bagde, '')::varchar AS bagde,
-                CASE WHEN NULLIF(TRIM(position_order), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(position_order), '')::INTEGER) ELSE NULL END AS position_order,
-                NULLIF(article, '')::varchar AS article,
-                NULLIF(pronoun, '')::varchar AS pronoun,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC) AS rn
-                
-            FROM lacreisaude_staging_01.lacreiid_pronoun
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (SELECT id, created_at, updated_at, bagde, position_order, article, pronoun FROM src_raw WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_pronoun (id, created_at, updated_at, bagde, position_order, article, pronoun)
-            SELECT id, created_at, updated_at, bagde, position_order, article, pronoun FROM src
-            ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at, updated_at = EXCLUDED.updated_at, bagde = EXCLUDED.bagde, position_order = EXCLUDED.position_order, article = EXCLUDED.article, pronoun = EXCLUDED.pronoun
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END),0) AS inseridos,
-               COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END),0) AS atualizados,
-               (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {"ok": True, "msg": f"ETL pronoun: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).", "inserted": int(row['inseridos']), "updated": int(row['atualizados']), "source_rows": int(row['elegiveis'])}
-
-
-def _rodar_etl_ethnicgroup(conn):
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_ethnicgroup LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_ethnicgroup não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_ethnicgroup
-        (
-            id INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            bagde VARCHAR,
-            position_order INTEGER,
-            name VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-                CASE WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC') END AS created_at,
-                CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END AS updated_at,
-                NULLIF(bagde, '')::varchar AS bagde,
-                CASE WHEN NULLIF(TRIM(position_order), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(position_order), '')::INTEGER) ELSE NULL END AS position_order,
-                NULLIF(name, '')::varchar AS name,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC) AS rn
-                
-            FROM lacreisaude_staging_01.lacreiid_ethnicgroup
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (SELECT id, created_at, updated_at, bagde, position_order, name FROM src_raw WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_ethnicgroup (id, created_at, updated_at, bagde, position_order, name)
-            SELECT id, created_at, updated_at, bagde, position_order, name FROM src
-            ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at, updated_at = EXCLUDED.updated_at, bagde = EXCLUDED.bagde, position_order = EXCLUDED.position_order, name = EXCLUDED.name
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END),0) AS inseridos,
-               COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END),0) AS atualizados,
-               (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {"ok": True, "msg": f"ETL ethnicgroup: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).", "inserted": int(row['inseridos']), "updated": int(row['atualizados']), "source_rows": int(row['elegiveis'])}
-
-
-def _rodar_etl_genderidentity(conn):
-    try:
-        conn.execute(text("SELECT 1 FROM lacreisaude_staging_01.lacreiid_genderidentity LIMIT 1"))
-    except ProgrammingError as e:
-        if isinstance(e.orig, UndefinedTable):
-            return {"ok": False, "msg": "Tabela fonte lacreisaude_staging_01.lacreiid_genderidentity não encontrada."}
-        raise
-
-    conn.execute(text("""
-        CREATE SCHEMA IF NOT EXISTS lacreisaude_staging_02;
-        CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.lacreiid_genderidentity
-        (
-            id INTEGER PRIMARY KEY,
-            created_at TIMESTAMP WITHOUT TIME ZONE,
-            updated_at TIMESTAMP WITHOUT TIME ZONE,
-            bagde VARCHAR,
-            position_order INTEGER,
-            name VARCHAR
-        )
-        TABLESPACE pg_default;
-    """))
-
-    upsert_sql = """
-        WITH src_raw AS (
-            SELECT
-                (NULLIF(TRIM(id), ''))::INTEGER AS id,
-                CASE WHEN NULLIF(TRIM(created_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(created_at), '')::timestamptz AT TIME ZONE 'UTC') END AS created_at,
-                CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN NULL
-                     ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END AS updated_at,
-                NULLIF(bagde, '')::varchar AS bagde,
-                CASE WHEN NULLIF(TRIM(position_order), '') ~ '^[0-9]+$' THEN (NULLIF(TRIM(position_order), '')::INTEGER) ELSE NULL END AS position_order,
-                NULLIF(name, '')::varchar AS name,
-                ROW_NUMBER() OVER (PARTITION BY (NULLIF(TRIM(id), ''))::INTEGER ORDER BY (CASE WHEN NULLIF(TRIM(updated_at), '') IS NULL THEN to_timestamp(0) ELSE (NULLIF(TRIM(updated_at), '')::timestamptz AT TIME ZONE 'UTC') END) DESC) AS rn
-                
-            FROM lacreisaude_staging_01.lacreiid_genderidentity
-            WHERE NULLIF(TRIM(id), '') ~ '^[0-9]+$'
-        ),
-        src AS (SELECT id, created_at, updated_at, bagde, position_order, name FROM src_raw WHERE rn = 1
-        ),
-        upsert AS (
-            INSERT INTO lacreisaude_staging_02.lacreiid_genderidentity (id, created_at, updated_at, bagde, position_order, name)
-            SELECT id, created_at, updated_at, bagde, position_order, name FROM src
-            ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at, updated_at = EXCLUDED.updated_at, bagde = EXCLUDED.bagde, position_order = EXCLUDED.position_order, name = EXCLUDED.name
-            RETURNING (xmax = 0) AS inserted_flag
-        )
-        SELECT COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END),0) AS inseridos,
-               COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END),0) AS atualizados,
-               (SELECT COUNT(*) FROM src) AS elegiveis
-        FROM upsert;
-    """
-
-    row = conn.execute(text(upsert_sql)).mappings().one()
-    return {"ok": True, "msg": f"ETL genderidentity: {int(row['inseridos'])} inseridos, {int(row['atualizados'])} atualizados (de {int(row['elegiveis'])} elegíveis).", "inserted": int(row['inseridos']), "updated": int(row['atualizados']), "source_rows": int(row['elegiveis'])}
 
 def _safe_run(name, func, conn):
     try:
         res = func(conn)
         if not res.get("ok"):
-            return {"name": name, "ok": False, "msg": res.get("msg"), "inserted": 0, "updated": 0, "source_rows": 0}
+            return {"name": name, "ok": False, "msg": res.get("msg"), "inserted": 0, "updated": 0, "unchanged": 0, "source_rows": 0}
+        # linhas elegíveis que não foram inseridas nem atualizadas: _row_digest igual ao já gravado
+        res.setdefault("unchanged", max(res.get("source_rows", 0) - res.get("inserted", 0) - res.get("updated", 0), 0))
         return {"name": name, "ok": True, **res}
     except Exception as e:
-        return {"name": name, "ok": False, "msg": str(e), "inserted": 0, "updated": 0, "source_rows": 0}
+        return {"name": name, "ok": False, "msg": str(e), "inserted": 0, "updated": 0, "unchanged": 0, "source_rows": 0}
 
 @bp_staging2.route('/upload/staging', methods=['GET'])
 @swag_from({
     'tags': ['ETL'],
     'summary': 'Roda TODOS os ETLs de staging_01 ➜ staging_02 e depois popula o MODEL',
-    'responses': {200: {'description': 'OK'}, 500: {'description': 'Erro'}}
+    'parameters': [
+        {'name': 'modo_extracao', 'in': 'query', 'type': 'string', 'required': False,
+         'enum': ['insert', 'copy', 'stream', 'files', 'fdw'],
+         'description': 'Modo de extração da fonte para o staging_01 (padrão: STAGING1_MODE)'},
+        {'name': 'tamanho_lote', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Linhas por lote no modo stream (padrão: STAGING1_BATCH_SIZE)'},
+        {'name': 'full_refresh', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': "Ignora as marcas d'água e relê as tabelas da fonte por completo"},
+        {'name': 'workers', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Tabelas extraídas em paralelo no staging_01 (padrão: STAGING1_WORKERS)'},
+        {'name': 'linhas_por_faixa', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Modo paralelo: divide tabelas maiores que isso em faixas (padrão: STAGING1_CHUNK_ROWS; 0 desliga)'},
+        {'name': 'snapshot_consistente', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Lê todas as tabelas da fonte no mesmo snapshot exportado (padrão: STAGING1_SNAPSHOT)'},
+        {'name': 'reiniciar_extracao', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Descarta o lote de extração interrompido em vez de retomá-lo pelos checkpoints'},
+        {'name': 'reimportar_fdw', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Modo fdw: reimporta as tabelas estrangeiras (após colunas mudarem na fonte)'},
+        {'name': 'workers_staging2', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Etapas do staging2 executadas em paralelo (padrão: STAGING2_WORKERS)'},
+        {'name': 'reconciliacao_completa', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Reprocessa todos os lotes retidos no staging_01, não só os novos '
+                        '(padrão: automática a cada STAGING2_RECONCILE_HOURS)'},
+        {'name': 'linhas_por_faixa_staging2', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Upsert do staging2 em faixas de chave com commit por faixa (padrão: STAGING2_CHUNK_ROWS; 0 desliga)'},
+        {'name': 'somente_falhas', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'Reexecuta só as etapas que falharam na última execução e as que dependem delas '
+                        '(sem nova extração do staging1)'}
+    ],
+    'responses': {200: {'description': 'OK'}, 409: {'description': 'Extração do staging1 já em execução'},
+                  500: {'description': 'Erro'}}
 })
 def consultar_indicadores_resumo():
     try:
-        criar_popular_staging1()
+        somente_falhas = request.args.get('somente_falhas', '').lower() in ('1', 'true', 'sim')
+        inicio_execucao = datetime.now(timezone.utc)
+        # WAL gerado por fase (aproximado: posição do WAL do cluster inteiro)
+        wal = {}
+        with engine.connect() as conn:
+            wal_inicio = current_wal_lsn(conn)
+        # resumo da extração (tempos por tabela, lote, memória, throttle...); None sem extração
+        staging1 = None
+        if not somente_falhas:
+            staging1_json, staging1_status = criar_popular_staging1(
+                modo=request.args.get('modo_extracao'),
+                batch_size=request.args.get('tamanho_lote', type=int),
+                full_refresh=request.args.get('full_refresh', '').lower() in ('1', 'true', 'sim'),
+                workers=request.args.get('workers', type=int),
+                chunk_rows=request.args.get('linhas_por_faixa', type=int),
+                snapshot=(request.args.get('snapshot_consistente', '').lower() in ('1', 'true', 'sim')
+                          if 'snapshot_consistente' in request.args else None),
+                force_restart=request.args.get('reiniciar_extracao', '').lower() in ('1', 'true', 'sim'),
+                reimportar_fdw=request.args.get('reimportar_fdw', '').lower() in ('1', 'true', 'sim'),
+            )
+            staging1 = staging1_json.get_json()
+            # parâmetros inválidos ou outra extração em andamento: devolve o erro em vez de
+            # seguir sem staging1
+            if staging1_status in (400, 409):
+                return jsonify({"sucesso": False, "mensagem": staging1.get('mensagem'), "staging1": staging1}), staging1_status
+        # extração com falha: o lote não é publicado e as etapas seguintes processam só os
+        # lotes já publicados; a execução continua, mas a resposta sai com sucesso false
+        staging1_ok = staging1 is None or bool(staging1.get('ok'))
+        # schema de staging_02/model/mart pelas migrações (DDL só quando a versão muda) e
+        # uma única leitura do catálogo para decidir quais etapas podem rodar
+        tabelas, migracoes = ensure_schema(engine)
         with engine.begin() as conn:
-            # 1) Rode TODOS os ETLs aqui
-            runs = []
-            runs.append(_safe_run("privacydocument", _rodar_etl_privacydocument, conn))
-            runs.append(_safe_run("appointment",     _rodar_etl_appointment, conn))
-            runs.append(_safe_run("cancellation",    _rodar_etl_cancellation, conn))
-            runs.append(_safe_run("profile",         _rodar_etl_profile, conn))
-            runs.append(_safe_run("profile_disability_types", _rodar_etl_profile_disability_types, conn))
-            runs.append(_safe_run("report",          _rodar_etl_report, conn))
-            runs.append(_safe_run("user",            _rodar_etl_user, conn))
-            runs.append(_safe_run("address_state",   _rodar_etl_address_state, conn))
-            runs.append(_safe_run("disabilitytype", _rodar_etl_disabilitytype, conn))
-            runs.append(_safe_run("sexualorientation", _rodar_etl_sexualorientation, conn))
-            runs.append(_safe_run("pronoun", _rodar_etl_pronoun, conn))
-            runs.append(_safe_run("ethnicgroup", _rodar_etl_ethnicgroup, conn))
-            runs.append(_safe_run("genderidentity", _rodar_etl_genderidentity, conn))
-            runs.append(_safe_run("clinic",          _rodar_etl_clinic, conn))
-            runs.append(_safe_run("professional",    _rodar_etl_professional, conn))
-            runs.append(_safe_run("professional_disability_types", _rodar_etl_professional_disability_types, conn))
-
-            # DEBUG: Adiciona retorno detalhado dos runs para diagnóstico
-            # Se algum ETL falhar, retorna imediatamente com o erro detalhado
-            for r in runs:
-                if not r["ok"]:
-                    return jsonify({
-                        "sucesso": False,
-                        "mensagem": f"Erro no ETL '{r['name']}': {r.get('msg')}",
-                        "etls": runs
-                    }), 500
-
-            # 2) Amostras (ainda DENTRO do with)
-            amostras = {}
-            amostras["lacrei_privacydocument"] = [dict(r) for r in conn.execute(text("""
-                SELECT id, created_at, updated_at, profile_type
-                FROM lacreisaude_staging_02.lacrei_privacydocument
-                ORDER BY id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_appointment"] = [dict(r) for r in conn.execute(text("""
-                SELECT id, appointment_date, status, professional_id, user_id
-                FROM lacreisaude_staging_02.lacreiid_appointment
-                ORDER BY appointment_date DESC NULLS LAST, id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_cancellation"] = [dict(r) for r in conn.execute(text("""
-                SELECT cancellation_id, created_at, reason, appointment_id
-                FROM lacreisaude_staging_02.lacreiid_cancellation
-                ORDER BY created_at DESC NULLS LAST, cancellation_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_profile"] = [dict(r) for r in conn.execute(text("""
-                SELECT profile_id, created_at, completed, user_id,
-                       ethnic_group, gender_identity, pronoun, sexual_orientation
-                FROM lacreisaude_staging_02.lacreiid_profile
-                ORDER BY updated_at DESC NULLS LAST, profile_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_profile_disability_types"] = [dict(r) for r in conn.execute(text("""
-                SELECT id, profile_id, disabilitytype_id
-                FROM lacreisaude_staging_02.lacreiid_profile_disability_types
-                ORDER BY id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_report"] = [dict(r) for r in conn.execute(text("""
-                SELECT report_id, created_at, eval, appointment_id
-                FROM lacreisaude_staging_02.lacreiid_report
-                ORDER BY created_at DESC NULLS LAST, report_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreiid_user"] = [dict(r) for r in conn.execute(text("""
-                SELECT user_id, email, is_active, is_staff, is_superuser,
-                       last_login, privacy_document_id
-                FROM lacreisaude_staging_02.lacreiid_user
-                ORDER BY updated_at DESC NULLS LAST, user_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreisaude_clinic"] = [dict(r) for r in conn.execute(text("""
-                SELECT clinic_id, name, city, state_id, consult_price,
-                       is_presential_clinic, is_online_clinic
-                FROM lacreisaude_staging_02.lacreisaude_clinic
-                ORDER BY updated_at DESC NULLS LAST, clinic_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreisaude_professional"] = [dict(r) for r in conn.execute(text("""
-                SELECT professional_id, full_name, profile_status,
-                       active, published, profession_id, state_id
-                FROM lacreisaude_staging_02.lacreisaude_professional
-                ORDER BY updated_at DESC NULLS LAST, professional_id DESC
-                LIMIT 20
-            """)).mappings().all()]
-            amostras["lacreisaude_professional_disability_types"] = [dict(r) for r in conn.execute(text("""
-                SELECT id, professional_id, disabilitytype_id
-                FROM lacreisaude_staging_02.lacreisaude_professional_disability_types
-                ORDER BY id DESC
-                LIMIT 20
-            """)).mappings().all()]
-
-            # 3) Resumo ainda DENTRO do with
+            wal['staging1'] = wal_bytes_since(conn, wal_inicio)
+            wal_fase = current_wal_lsn(conn)
+            # staging_02 acompanha STAGING_STORAGE (tabelas criadas nesta execução são convertidas na próxima)
+            set_schema_persistence(conn, 'lacreisaude_staging_02', STAGING_STORAGE == 'unlogged')
+
+        # 1) Rode TODOS os ETLs aqui: etapas independentes em paralelo, respeitando dependências
+        workers = request.args.get('workers_staging2', type=int) or STAGING2_WORKERS
+        # só os lotes novos de cada tabela; reconciliação completa sob pedido ou quando vencida
+        completo = True if request.args.get('reconciliacao_completa', '').lower() in ('1', 'true', 'sim') else None
+        # em faixas, cada tabela confirma o que já gravou; o MODEL/MART abaixo só roda se todas
+        # as etapas concluíram, então sempre lê um staging_02 completo
+        etapas_staging2 = staging2_etapas(completo, request.args.get('linhas_por_faixa_staging2', type=int), tabelas)
+        etapas_finais = _etapas_model_mart(etapas_staging2)
+        todas = etapas_staging2 + etapas_finais
+        deps = resolve_dependencies(todas)
+        # reexecução: só as etapas que falharam e as que dependem delas; as demais já estão gravadas
+        selecionadas = _etapas_a_reexecutar(todas) if somente_falhas else {e['name'] for e in todas}
+        reaproveitadas = [e['name'] for e in todas if e['name'] not in selecionadas]
+        dag, caminho_critico, dag_seconds = run_dag(
+            [e for e in etapas_staging2 if e['name'] in selecionadas], workers, _executar_etapa
+        )
+        _gravar_status(dag, inicio_execucao)
+        # etapas puladas (dependência falhou) só têm ok/msg: completa o formato do _safe_run
+        runs = [{"name": nome, "inserted": 0, "updated": 0, "unchanged": 0, "source_rows": 0, **r['result']}
+                for nome, r in dag.items()]
+        etapas = [
+            {"etapa": nome, **{k: v for k, v in r.items() if k != 'result'}}
+            for nome, r in dag.items()
+        ]
+        dag_resumo = {
+            "workers": workers,
+            "wall_seconds": dag_seconds,
+            "sum_step_seconds": round(sum(r['seconds'] for r in dag.values()), 3),
+            "critical_path": caminho_critico,
+            "etapas": etapas,
+        }
+
+        # Se algum ETL falhar, retorna imediatamente com o erro detalhado
+        # (MODEL/MART não rodam sobre um staging_02 incompleto)
+        for r in runs:
+            if not r["ok"]:
+                return jsonify({
+                    "sucesso": False,
+                    "mensagem": f"Erro no ETL '{r['name']}': {r.get('msg')}",
+                    "staging1": staging1,
+                    "dag": dag_resumo,
+                    "etapas_reaproveitadas": reaproveitadas,
+                    "etls": runs
+                }), 500
+
+        with engine.connect() as conn:
+            # 2) Resumo
             # Normaliza resultados para evitar NoneType quando algum ETL retornar inesperadamente None
             normalized_runs = []
             for r in runs:
@@ -2019,7 +592,8 @@ def consultar_indicadores_resumo():
                         "msg": "ETL returned no result (None)",
                         "source_rows": 0,
                         "inserted": 0,
-                        "updated": 0
+                        "updated": 0,
+                        "unchanged": 0
                     })
 
             resumo = [{
@@ -2028,23 +602,161 @@ def consultar_indicadores_resumo():
                 "mensagem": r.get("msg"),
                 "linhas_elegiveis": r.get("source_rows", 0),
                 "inseridos": r.get("inserted", 0),
-                "atualizados": r.get("updated", 0)
+                "atualizados": r.get("updated", 0),
+                "inalterados": r.get("unchanged", 0),
+                "modo": r.get("mode"),
+                "lotes": r.get("batches", []),
+                "faixas": r.get("chunks", 0)
             } for r in normalized_runs]
 
-            model_res = _rodar_etl_model(conn) or {"ok": False, "msg": "MODEL ETL returned no result"}
-            mart_res = _rodar_etl_mart(conn) or {"ok": False, "msg": "MART ETL returned no result"}
-
-            sucesso = all(r.get("ok", False) for r in normalized_runs) and model_res.get("ok", False) and mart_res.get("ok", False)
-            resposta = {
-                "sucesso": sucesso,
-                "resumo": (
-                    resumo
-                    + [{"tabela": "MODEL", "ok": model_res.get("ok", False), "mensagem": model_res.get("msg")}]
-                    + [{"tabela": "MART",  "ok": mart_res.get("ok",  False), "mensagem": mart_res.get("msg")}]
-                ),
-                "amostras": amostras,
-                "etls": runs # DEBUG: Retorna detalhes dos ETLs para diagnóstico
-            }
+            wal['staging2'] = wal_bytes_since(conn, wal_fase)
+            wal_fase = current_wal_lsn(conn)
+
+        # Manutenção antes do MODEL: ANALYZE só das tabelas que mudaram o bastante nesta
+        # execução (as junções do MODEL são planejadas com estimativas atuais); tempo à parte
+        manutencao = {'seconds': 0.0, 'tabelas': []}
+        if 'model' in selecionadas:
+            tabela_da_etapa = {spec['name']: spec['table'] for spec in STAGING2_SPECS}
+            manutencao = analyze_changed(engine, {
+                tabela_da_etapa[r['name']]: r.get('inserted', 0) + r.get('updated', 0)
+                for r in normalized_runs if r.get('ok') and r.get('name') in tabela_da_etapa
+            })
+            with engine.connect() as conn:
+                wal['manutencao'] = wal_bytes_since(conn, wal_fase)
+                wal_fase = current_wal_lsn(conn)
+
+        # 3) MODEL e MART: cada um em transação própria, com status gravado; na reexecução
+        # só rodam se selecionados (falharam antes ou dependem de etapa reexecutada)
+        finais = {}
+        for etapa in etapas_finais:
+            nome = etapa['name']
+            if nome not in selecionadas:
+                continue
+            falhas = [d for d in deps[nome] if finais.get(d, {}).get('status') in ('failed', 'skipped')]
+            if falhas:
+                finais[nome] = {'ok': False, 'status': 'skipped', 'seconds': 0.0,
+                                'result': {'ok': False, 'msg': f"não executada: dependência falhou ({', '.join(falhas)})"}}
+                continue
+            comeco = time.perf_counter()
+            res = _executar_etapa(etapa)
+            finais[nome] = {'ok': res['ok'], 'status': 'ok' if res['ok'] else 'failed',
+                            'seconds': round(time.perf_counter() - comeco, 3), 'result': res}
+            with engine.connect() as conn:
+                wal[nome] = wal_bytes_since(conn, wal_fase)
+                wal_fase = current_wal_lsn(conn)
+        _gravar_status(finais, inicio_execucao)
+        with engine.connect() as conn:
+            wal['total'] = wal_bytes_since(conn, wal_inicio)
+
+        reaproveitada = {"ok": True, "msg": "não reexecutada (concluída na execução anterior)"}
+        model_res = finais['model']['result'] if 'model' in finais else reaproveitada
+        mart_res = finais['mart']['result'] if 'mart' in finais else reaproveitada
+
+        sucesso = (staging1_ok and all(r.get("ok", False) for r in normalized_runs)
+                   and model_res.get("ok", False) and mart_res.get("ok", False))
+        resposta = {
+            "sucesso": sucesso,
+            "resumo": (
+                resumo
+                + [{"tabela": "MODEL", "ok": model_res.get("ok", False), "mensagem": model_res.get("msg"),
+                    "tabelas": model_res.get("tabelas", {})}]
+                + [{"tabela": "MART",  "ok": mart_res.get("ok",  False), "mensagem": mart_res.get("msg"),
+                    "tabelas": mart_res.get("tabelas", {})}]
+            ),
+            "staging1": staging1,
+            "staging_storage": STAGING_STORAGE,
+            "migracoes_aplicadas": migracoes,
+            "wal_bytes": wal,
+            "manutencao": manutencao,
+            "dag": dag_resumo,
+            "somente_falhas": somente_falhas,
+            "etapas_reaproveitadas": reaproveitadas,
+            "etls": runs # DEBUG: Retorna detalhes dos ETLs para diagnóstico
+        }
+        if not staging1_ok:
+            resposta["mensagem"] = (f"Extração do staging1 falhou ({staging1.get('mensagem') or staging1.get('failed_tables')}); "
+                                    "as etapas seguintes processaram só os lotes já publicados")
         return jsonify(resposta), 200
     except Exception as e:
-        return jsonify({"sucesso": False, "mensagem": f"Erro inesperado: {str(e)}"}), 500
\ No newline at end of file
+        return jsonify({"sucesso": False, "mensagem": f"Erro inesperado: {str(e)}"}), 500
+
+
+@bp_staging2.route('/upload/staging/progresso', methods=['GET'])
+@swag_from({
+    'tags': ['ETL'],
+    'summary': 'Progresso do upsert em faixas do staging2 (atualizado a cada faixa confirmada)',
+    'responses': {200: {'description': 'OK'}, 500: {'description': 'Erro'}}
+})
+def consultar_progresso_staging2():
+    try:
+        with engine.connect() as conn:
+            progresso = [dict(r) for r in conn.execute(text("""
+                SELECT table_name, chunks_done, chunks_total, rows_done, status,
+                       started_at, updated_at
+                FROM lacreisaude_etl_meta.staging2_progress
+                ORDER BY updated_at DESC
+            """)).mappings().all()]
+        return jsonify({"sucesso": True, "progresso": progresso}), 200
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro inesperado: {str(e)}"}), 500
+
+
+@bp_staging2.route('/upload/staging/amostras/<tabela>', methods=['GET'])
+@swag_from({
+    'tags': ['ETL'],
+    'summary': 'Amostra paginada (somente leitura) de uma tabela do staging_02',
+    'parameters': [
+        {'name': 'tabela', 'in': 'path', 'type': 'string', 'required': True,
+         'description': 'Tabela do staging_02 (ex.: lacreiid_appointment)'},
+        {'name': 'limite', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': f'Linhas por página (padrão 20, máximo {AMOSTRA_LIMITE_MAX})'},
+        {'name': 'cursor', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Chave da última linha da página anterior (proximo_cursor); as linhas vêm em ordem decrescente de chave'},
+        {'name': 'percentual', 'in': 'query', 'type': 'number', 'required': False,
+         'description': 'Lê só ~esse percentual das páginas da tabela (TABLESAMPLE SYSTEM)'},
+        {'name': 'semente', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Semente do TABLESAMPLE (REPEATABLE), para paginar sobre a mesma amostra (padrão 0)'}
+    ],
+    'responses': {200: {'description': 'OK'}, 400: {'description': 'Requisição inválida'}, 500: {'description': 'Erro'}}
+})
+def consultar_amostras_staging2(tabela):
+    spec = next((s for s in STAGING2_SPECS if s['table'] == tabela), None)
+    if spec is None or tabela not in AMOSTRA_COLUNAS:
+        return jsonify({"sucesso": False, "mensagem": f"Tabela desconhecida: {tabela}.",
+                        "tabelas": sorted(AMOSTRA_COLUNAS)}), 400
+    limite = min(max(request.args.get('limite', 20, type=int), 1), AMOSTRA_LIMITE_MAX)
+    cursor = request.args.get('cursor')
+    percentual = request.args.get('percentual', type=float)
+    if percentual is not None and not 0 < percentual <= 100:
+        return jsonify({"sucesso": False, "mensagem": "percentual deve estar entre 0 e 100."}), 400
+
+    chave = spec['key']
+    tipo_chave = REGRAS[next(c[1] for c in spec['columns'] if c[0] == chave)][0]
+    # cursor que o CAST da chave não aceitaria (ou o driver não envia) falharia no banco: 400 aqui
+    if cursor is not None:
+        if tipo_chave == 'INTEGER':
+            if not re.fullmatch(r'-?[0-9]{1,10}', cursor) or not -2**31 <= int(cursor) < 2**31:
+                return jsonify({"sucesso": False, "mensagem": "cursor inválido: esperado um inteiro."}), 400
+            cursor = int(cursor)
+        elif '\x00' in cursor:
+            return jsonify({"sucesso": False, "mensagem": "cursor inválido."}), 400
+    colunas = AMOSTRA_COLUNAS[tabela]
+    amostragem = "TABLESAMPLE SYSTEM (:pct) REPEATABLE (:semente)" if percentual is not None else ""
+    # keyset: continua da última chave vista, pela PK (sem OFFSET nem ordenação de colunas sem índice)
+    filtro = f"WHERE {chave} < CAST(:cursor AS {tipo_chave})" if cursor is not None else ""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+            linhas = [dict(r) for r in conn.execute(text(f"""
+                SELECT {', '.join(colunas)}
+                FROM lacreisaude_staging_02.{tabela} {amostragem}
+                {filtro}
+                ORDER BY {chave} DESC
+                LIMIT :n
+            """), {'cursor': cursor, 'pct': percentual, 'semente': request.args.get('semente', 0, type=int),
+                   'n': limite}).mappings().all()]
+        proximo = linhas[-1][chave] if len(linhas) == limite else None
+        return jsonify({"sucesso": True, "tabela": tabela, "linhas": linhas,
+                        "proximo_cursor": None if proximo is None else str(proximo)}), 200
+    except Exception as e:
+        return jsonify({"sucesso": False, "mensagem": f"Erro inesperado: {str(e)}"}), 500
@@ -0,0 +1,492 @@
+import hashlib
+import os
+import time
+
+from sqlalchemy import text
+
+from app.utils.logger import get_logger
+from app.utils.upsert import update_where, upsert_counts
+
+logger = get_logger(__name__)
+
+# Upserts do staging2 gerados a partir de especificações declarativas (ver STAGING2_SPECS).
+#
+# Cada spec descreve uma tabela do staging_02:
+#   name      nome da etapa (usado no relatório e nas mensagens)
+#   table     tabela de origem no staging_01 e de destino no staging_02 (mesmo nome)
+#   key       coluna de destino usada como PK / ON CONFLICT
+#   dedupe    colunas de destino que escolhem a linha mais recente por chave
+#             (mais de uma: COALESCE na ordem dada); vazio = qualquer linha
+#   columns   (destino, regra[, origem]) na ordem da tabela; origem padrão = destino
+#   indexes   (nome, colunas) de índices auxiliares
+#   join_indexes  (nome, colunas) das chaves de junção usadas pelo MODEL (migração 6)
+#   statistics    (nome, colunas) de estatísticas estendidas (ndistinct, dependencies) sobre
+#                 colunas correlacionadas (migração 6)
+#
+# Regras de conversão (a coluna de origem é sempre TEXT no staging_01):
+#   int_key   inteiro (chave: linhas com id não numérico são descartadas)
+#   int       inteiro quando numérico, senão NULL
+#   ts        timestamp ISO 8601 em UTC (com fuso: convertido; sem fuso: já é UTC); outro formato vira NULL
+#   bool      dicionário true/false, t/f, 1/0, yes/no, y/n, sim/não, s/n; outro valor vira NULL
+#   numeric   preço: remove símbolos, troca vírgula por ponto
+#   text      varchar, vazio vira NULL
+#   trim      varchar com TRIM, vazio vira NULL
+#   raw       varchar sem limpeza
+# int/ts/bool usam as funções de FUNCOES_SQL (instaladas pelas migrações no schema META).
+STAGING01 = 'lacreisaude_staging_01'
+STAGING02 = 'lacreisaude_staging_02'
+META = 'lacreisaude_etl_meta'
+REGRAS = {
+    'int_key': ('INTEGER', f"{META}.safe_int({{c}})"),
+    'int': ('INTEGER', f"{META}.safe_int({{c}})"),
+    'ts': ('TIMESTAMP WITHOUT TIME ZONE', f"{META}.safe_utc_ts({{c}})"),
+    'bool': ('BOOLEAN', f"{META}.safe_bool({{c}})"),
+    'numeric': (
+        'NUMERIC(10,2)',
+        "CASE WHEN NULLIF(TRIM({c}), '') IS NULL THEN NULL "
+        "ELSE REPLACE(REGEXP_REPLACE(TRIM({c}), '[^0-9,.-]', '', 'g'), ',', '.')::numeric END",
+    ),
+    'text': ('VARCHAR', "NULLIF({c}, '')::varchar"),
+    'trim': ('VARCHAR', "NULLIF(TRIM({c}), '')::varchar"),
+    'raw': ('VARCHAR', "{c}::varchar"),
+}
+
+# Regras aceitas na chave: linhas cuja chave convertida é NULL são descartadas
+REGRAS_CHAVE = ('int_key', 'trim', 'raw')
+
+# Formatos aceitos por safe_utc_ts (ISO 8601): data, hora opcional e, com hora, fuso opcional
+TS_DATA = '[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+TS_HORA = '([01][0-9]|2[0-3]):[0-5][0-9](:[0-5][0-9]([.][0-9]{1,6})?)?'
+TS_FUSO = '[ ]*(Z|z|[+-][0-9]{2}(:?[0-9]{2})?)'
+TS_SEM_FUSO = f'^{TS_DATA}([ Tt]{TS_HORA})?$'
+TS_COM_FUSO = f'^{TS_DATA}[ Tt]{TS_HORA}{TS_FUSO}$'
+
+# Funções de conversão do staging2: LANGUAGE sql de uma expressão só, sem bloco EXCEPTION,
+# para o planner poder embutir o corpo na consulta (inlining) e PARALLEL SAFE (não impedem
+# scans paralelos). O regex vem antes de todo cast, em CASE aninhado (o AND não garante a
+# ordem): valor fora do formato vira NULL em vez de erro. safe_utc_ts é STABLE porque o
+# cast de texto para timestamp é STABLE no Postgres (depende de DateStyle); uma função
+# IMMUTABLE com corpo STABLE não seria embutida.
+FUNCOES_SQL = [
+    f"""
+        CREATE OR REPLACE FUNCTION {META}.safe_int(v TEXT) RETURNS INTEGER
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $fn$
+            -- até 18 dígitos cabem em BIGINT; acima do INTEGER vira NULL em vez de erro
+            SELECT CASE WHEN btrim(v) ~ '^[0-9]{{1,18}}$' THEN
+                CASE WHEN btrim(v)::BIGINT <= 2147483647 THEN btrim(v)::INTEGER END
+            END
+        $fn$
+    """,
+    f"""
+        CREATE OR REPLACE FUNCTION {META}.safe_bool(v TEXT) RETURNS BOOLEAN
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $fn$
+            SELECT CASE
+                WHEN lower(btrim(v)) IN ('true', 't', '1', 'yes', 'y', 'sim', 's') THEN TRUE
+                WHEN lower(btrim(v)) IN ('false', 'f', '0', 'no', 'n', 'nao', 'não') THEN FALSE
+            END
+        $fn$
+    """,
+    f"""
+        CREATE OR REPLACE FUNCTION {META}.safe_utc_ts(v TEXT) RETURNS TIMESTAMP WITHOUT TIME ZONE
+        LANGUAGE sql STABLE PARALLEL SAFE AS $fn$
+            -- só ISO 8601 (ano primeiro: DateStyle não muda a leitura); 'now', 'today' e
+            -- outros formatos viram NULL. Sem fuso: já está em UTC (não depende do TimeZone
+            -- da sessão); com Z ou deslocamento (+03, -0300, +03:00): convertido para UTC
+            SELECT CASE
+                WHEN btrim(v) ~ '{TS_SEM_FUSO}' THEN btrim(v)::TIMESTAMP
+                WHEN btrim(v) ~ '{TS_COM_FUSO}' THEN btrim(v)::TIMESTAMPTZ AT TIME ZONE 'UTC'
+            END
+        $fn$
+    """,
+]
+
+# Upserts como prepared statements do servidor (PREPARE uma vez por conexão, depois EXECUTE)
+STAGING2_PREPARED = os.getenv('STAGING2_PREPARED', 'true').lower() in ('1', 'true', 'sim')
+
+# Staging2 incremental: cada tabela só processa os lotes do staging_01 que ainda não
+# processou (META.staging2_batch). Reconciliação completa (todos os lotes retidos + linhas
+# sem lote) na primeira execução, sob pedido, ou quando a última tem mais que isso (0 = só sob pedido)
+STAGING2_RECONCILE_HOURS = int(os.getenv('STAGING2_RECONCILE_HOURS', '168'))
+
+# Upsert em faixas de chave com commit por faixa (0 = um único statement por tabela).
+# Limita a duração de locks/transações; o progresso fica em META.staging2_progress
+STAGING2_CHUNK_ROWS = int(os.getenv('STAGING2_CHUNK_ROWS', '0'))
+
+# ANALYZE antes do MODEL só das tabelas do staging_02 com mudança relevante nesta execução:
+# inseridas + atualizadas >= max(STAGING2_ANALYZE_MIN_ROWS, STAGING2_ANALYZE_FRACTION * linhas
+# estimadas), ou tabela alterada que nunca foi analisada. false = deixa tudo para o autovacuum
+STAGING2_ANALYZE = os.getenv('STAGING2_ANALYZE', 'true').lower() in ('1', 'true', 'sim')
+STAGING2_ANALYZE_FRACTION = float(os.getenv('STAGING2_ANALYZE_FRACTION', '0.1'))
+STAGING2_ANALYZE_MIN_ROWS = int(os.getenv('STAGING2_ANALYZE_MIN_ROWS', '500'))
+
+# SQL gerado por spec, modo e limites da faixa:
+# {(nome, completo, limites): (nome do prepared statement, sql)}
+_sql_cache = {}
+
+
+def _colunas(spec):
+    # normaliza (destino, regra[, origem]) -> (destino, regra, origem)
+    return [(c[0], c[1], c[2] if len(c) > 2 else c[0]) for c in spec['columns']]
+
+
+def _validar(spec):
+    colunas = _colunas(spec)
+    for destino, regra, _ in colunas:
+        if regra not in REGRAS:
+            raise ValueError(f"Spec {spec['name']}: regra '{regra}' desconhecida na coluna {destino}")
+    regra_chave = {d: r for d, r, _ in colunas}.get(spec['key'])
+    if regra_chave not in REGRAS_CHAVE:
+        raise ValueError(f"Spec {spec['name']}: chave {spec['key']} precisa de uma das regras {sorted(REGRAS_CHAVE)}")
+    destinos = {d for d, _, _ in colunas}
+    for c in spec.get('dedupe', ()):
+        if c not in destinos:
+            raise ValueError(f"Spec {spec['name']}: coluna de dedupe {c} não existe")
+
+
+def ddl_sql(spec):
+    """CREATE TABLE / índices de destino da spec (idempotentes), aplicados pelas migrações."""
+    tabela = f"{STAGING02}.{spec['table']}"
+    defs = []
+    for destino, regra, _ in _colunas(spec):
+        tipo = REGRAS[regra][0]
+        defs.append(f"{destino} {tipo} PRIMARY KEY" if destino == spec['key'] else f"{destino} {tipo}")
+    partes = [
+        f"CREATE TABLE IF NOT EXISTS {tabela} ({', '.join(defs)})",
+        f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS _row_digest TEXT",
+    ]
+    for nome, cols in spec.get('indexes', ()):
+        partes.append(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({cols})")
+    return ';\n'.join(partes) + ';'
+
+
+def join_ddl_sql(spec):
+    """Índices das chaves de junção e estatísticas estendidas da spec (idempotentes), com
+    ANALYZE para a tabela já sair da migração com as estatísticas novas preenchidas."""
+    tabela = f"{STAGING02}.{spec['table']}"
+    partes = [f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({cols})"
+              for nome, cols in spec.get('join_indexes', ())]
+    partes += [f"CREATE STATISTICS IF NOT EXISTS {STAGING02}.{nome} (ndistinct, dependencies) "
+               f"ON {cols} FROM {tabela}"
+               for nome, cols in spec.get('statistics', ())]
+    if not partes:
+        return None
+    return ';\n'.join(partes + [f"ANALYZE {tabela}"]) + ';'
+
+
+def _chave_sql(spec, prefixo=''):
+    # chave convertida pela regra, a partir da coluna de origem do staging_01
+    origem_chave, regra_chave = next((o, r) for d, r, o in _colunas(spec) if d == spec['key'])
+    return REGRAS[regra_chave][1].format(c=f'{prefixo}{origem_chave}'), REGRAS[regra_chave][0]
+
+
+def chave_ddl_sql(spec):
+    """Índice (_batch_id, chave convertida) no staging_01, aplicado pelas migrações: a
+    leitura de uma faixa de chave dos lotes a processar vira um range scan, sem reler os
+    lotes inteiros a cada faixa."""
+    chave_sql, _ = _chave_sql(spec)
+    return (f"CREATE INDEX IF NOT EXISTS ix_{spec['table']}__batch_chave "
+            f"ON {STAGING01}.{spec['table']} (_batch_id, ({chave_sql}))")
+
+
+def upsert_sql(spec, completo=False, params=('$1', '$2', '$3'), limites=(False, False)):
+    """Upsert da spec: converte as linhas dos lotes do parâmetro 1 (array de batch_id;
+    completo = também as linhas sem lote) com chave na faixa (parâmetro 2, parâmetro 3],
+    deduplica por chave (linha mais recente) e faz ON CONFLICT. `limites` diz quais lados
+    da faixa existem; só esses entram no SQL, direto na leitura do staging_01 (a mesma
+    expressão do índice de chave_ddl_sql), e os parâmetros ausentes são ignorados. Com ETL_SKIP_UNCHANGED só atualiza linhas com _row_digest novo (ou sem
+    digest) e valores convertidos diferentes (IS DISTINCT FROM); sem ele o DO UPDATE é
+    incondicional, como no model e no mart. Devolve uma linha (inseridos, atualizados, elegiveis)."""
+    colunas = _colunas(spec)
+    tabela = spec['table']
+    chave = spec['key']
+    chave_sql, tipo_chave = _chave_sql(spec, 's.')
+    nomes = [d for d, _, _ in colunas]
+    lista = ', '.join(nomes)
+    # a chave já chega convertida (_k) da subconsulta; as demais colunas são convertidas
+    # uma vez por linha, só nas linhas que passam pelo filtro
+    selects = ',\n                '.join(
+        f"_k AS {d}" if d == chave else f"{REGRAS[r][1].format(c=o)} AS {d}" for d, r, o in colunas
+    )
+    dedupe = spec.get('dedupe', ())
+    # empate (mesma chave em mais de um lote): vence o lote mais novo
+    if not dedupe:
+        ordem = " ORDER BY _batch_id DESC NULLS LAST"
+    elif len(dedupe) == 1:
+        ordem = f" ORDER BY {dedupe[0]} DESC NULLS LAST, _batch_id DESC NULLS LAST"
+    else:
+        ordem = f" ORDER BY COALESCE({', '.join(dedupe)}) DESC NULLS LAST, _batch_id DESC NULLS LAST"
+    # o índice em _batch_id deixa a leitura incremental proporcional ao lote, não à tabela
+    lotes, de, ate = params
+    lote = f"_batch_id = ANY({lotes})"
+    if completo:
+        lote = f"(_batch_id IS NULL OR {lote})"
+    # faixa na própria leitura (sem "IS NULL OR", que impediria o range scan num plano genérico)
+    tem_de, tem_ate = limites
+    if tem_de:
+        lote += f"\n                  AND {chave_sql} > CAST({de} AS {tipo_chave})"
+    if tem_ate:
+        lote += f"\n                  AND {chave_sql} <= CAST({ate} AS {tipo_chave})"
+    sets = ',\n                '.join(f"{d} = EXCLUDED.{d}" for d in nomes if d != chave)
+    # o digest descarta barato as linhas que não mudaram na fonte; a comparação dos valores
+    # evita regravar as que mudaram só em colunas que a spec não carrega
+    onde = update_where(f"{STAGING02}.{tabela}", [d for d in nomes if d != chave], digest=True)
+    return f"""
+        WITH src_raw AS (
+            SELECT
+                _batch_id,
+                _row_digest,
+                {selects}
+            FROM (
+                -- OFFSET 0 impede o planner de achatar a subconsulta e repetir a conversão
+                -- da chave nos filtros de fora
+                SELECT s.*, {chave_sql} AS _k
+                FROM {STAGING01}.{tabela} s
+                WHERE {lote}
+                OFFSET 0
+            ) c
+            WHERE _k IS NOT NULL
+        ),
+        src AS (
+            -- mantém só a linha mais recente por chave (evita conflito duplo no INSERT)
+            SELECT {lista}, _row_digest FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY {chave}{ordem}) AS rn
+                FROM src_raw
+            ) t WHERE rn = 1
+        ),
+        upsert AS (
+            INSERT INTO {STAGING02}.{tabela} ({lista}, _row_digest)
+            SELECT {lista}, _row_digest FROM src
+            ON CONFLICT ({chave}) DO UPDATE SET
+                {sets},
+                _row_digest = EXCLUDED._row_digest
+            {onde}
+            RETURNING (xmax = 0) AS inserted_flag
+        )
+        SELECT
+            COALESCE(SUM(CASE WHEN inserted_flag THEN 1 ELSE 0 END), 0) AS inseridos,
+            COALESCE(SUM(CASE WHEN NOT inserted_flag THEN 1 ELSE 0 END), 0) AS atualizados,
+            (SELECT COUNT(*) FROM src) AS elegiveis
+        FROM upsert
+    """
+
+
+def _sql_da_spec(spec, completo, limites=(False, False)):
+    # gera uma vez por processo; o nome do statement leva o hash do SQL, então
+    # uma spec alterada nunca reaproveita um PREPARE antigo na mesma conexão
+    # (e cada combinação de limites da faixa tem o seu statement)
+    em_cache = _sql_cache.get((spec['name'], completo, limites))
+    if em_cache is None:
+        _validar(spec)
+        sql = upsert_sql(spec, completo, limites=limites)
+        nome = f"stg2_{spec['name']}_{hashlib.sha1(sql.encode()).hexdigest()[:10]}"
+        em_cache = _sql_cache[(spec['name'], completo, limites)] = (nome, sql)
+    return em_cache
+
+
+def _preparados(conn):
+    """Prepared statements desta conexão do DBAPI. Na primeira vez lê pg_prepared_statements
+    (a conexão pode vir do pool com statements de uso anterior); depois confia no cache."""
+    info = conn.connection.info
+    if 'stg2_prepared' not in info:
+        cur = conn.connection.cursor()
+        try:
+            cur.execute("SELECT name FROM pg_prepared_statements")
+            info['stg2_prepared'] = {r[0] for r in cur.fetchall()}
+        finally:
+            cur.close()
+    return info['stg2_prepared']
+
+
+def forget_prepared(conn):
+    """Descarta o cache de prepared statements da conexão (após erro/rollback); o próximo
+    uso relê pg_prepared_statements."""
+    conn.connection.info.pop('stg2_prepared', None)
+
+
+def _lotes_pendentes(conn, tabela, completo):
+    """Lotes concluídos do staging1 a processar: todos (completo) ou os que o staging2
+    ainda não processou para a tabela."""
+    return conn.execute(text(f"""
+        SELECT b.batch_id FROM {META}.staging1_batch b
+        WHERE b.status = 'ok'
+          AND (:completo OR NOT EXISTS (
+              SELECT 1 FROM {META}.staging2_batch p
+              WHERE p.table_name = :t AND p.batch_id = b.batch_id
+          ))
+        ORDER BY b.batch_id
+    """), {'t': tabela, 'completo': completo}).scalars().all()
+
+
+def _limites_faixas(conn, spec, lotes, completo, linhas):
+    """Limites das faixas de chave com ~`linhas` chaves cada, sobre as linhas dos lotes a
+    processar. Lista vazia = uma faixa só."""
+    chave_sql, _ = _chave_sql(spec)
+    lote = "_batch_id = ANY(:lotes)"
+    if completo:
+        lote = f"(_batch_id IS NULL OR {lote})"
+    return conn.execute(text(f"""
+        SELECT k FROM (
+            SELECT k, ROW_NUMBER() OVER (ORDER BY k) AS rn
+            FROM (
+                SELECT DISTINCT {chave_sql} AS k
+                FROM {STAGING01}.{spec['table']}
+                WHERE {lote}
+            ) chaves
+            WHERE k IS NOT NULL
+        ) x
+        WHERE rn % :n = 0
+        ORDER BY k
+    """), {'lotes': list(lotes), 'n': linhas}).scalars().all()
+
+
+def _progresso(conn, tabela, feitas, total, linhas, status):
+    conn.execute(text(f"""
+        INSERT INTO {META}.staging2_progress AS p
+            (table_name, chunks_done, chunks_total, rows_done, status, started_at, updated_at)
+        VALUES (:t, :f, :total, :n, :s, now(), now())
+        ON CONFLICT (table_name) DO UPDATE SET
+            chunks_done = EXCLUDED.chunks_done,
+            chunks_total = EXCLUDED.chunks_total,
+            rows_done = EXCLUDED.rows_done,
+            status = EXCLUDED.status,
+            started_at = CASE WHEN EXCLUDED.chunks_done = 1 THEN now() ELSE p.started_at END,
+            updated_at = now()
+    """), {'t': tabela, 'f': feitas, 'total': total, 'n': linhas, 's': status})
+
+
+def _reconciliacao_vencida(conn, tabela):
+    # sem marca (primeira execução) ou última reconciliação completa mais antiga que o limite
+    estado = conn.execute(text(f"""
+        SELECT full_reconciled_at IS NULL
+               OR (:h > 0 AND full_reconciled_at < now() - make_interval(hours => :h))
+        FROM {META}.staging2_watermark
+        WHERE table_name = :t
+    """), {'t': tabela, 'h': STAGING2_RECONCILE_HOURS}).scalar()
+    return estado is None or estado
+
+
+def _marcar_processados(conn, tabela, lotes, completo, linhas):
+    # mesma transação do upsert: a marca só avança se o upsert for confirmado
+    conn.execute(text(f"""
+        INSERT INTO {META}.staging2_batch (table_name, batch_id)
+        SELECT :t, UNNEST(CAST(:lotes AS BIGINT[]))
+        ON CONFLICT DO NOTHING
+    """), {'t': tabela, 'lotes': list(lotes)})
+    conn.execute(text(f"""
+        INSERT INTO {META}.staging2_watermark AS w
+            (table_name, batch_id, full_reconciled_at, rows_last_run, full_refresh, updated_at)
+        VALUES (:t, :b, CASE WHEN :completo THEN now() END, :n, :completo, now())
+        ON CONFLICT (table_name) DO UPDATE SET
+            batch_id = GREATEST(w.batch_id, EXCLUDED.batch_id),
+            full_reconciled_at = COALESCE(EXCLUDED.full_reconciled_at, w.full_reconciled_at),
+            rows_last_run = EXCLUDED.rows_last_run,
+            full_refresh = EXCLUDED.full_refresh,
+            updated_at = now()
+    """), {'t': tabela, 'b': max(lotes, default=None), 'completo': completo, 'n': linhas})
+
+
+def run_spec(conn, spec, completo=None, chunk_rows=None):
+    """Executa a etapa do staging2 descrita pela spec (fonte e destino já conferidos no
+    catálogo e criados pelas migrações): roda o upsert (via EXECUTE do statement preparado
+    quando STAGING2_PREPARED) sobre os lotes ainda não processados. completo=True força a
+    reconciliação completa; None decide pela marca da tabela (STAGING2_RECONCILE_HOURS).
+
+    Com chunk_rows > 0 (padrão STAGING2_CHUNK_ROWS) o upsert roda em faixas de chave e
+    confirma cada faixa antes da próxima; a última faixa e a marca dos lotes ficam na
+    transação do chamador, então os lotes só contam como processados com todas as faixas."""
+    tabela = spec['table']
+    if completo is None:
+        completo = _reconciliacao_vencida(conn, tabela)
+    modo = 'full' if completo else 'incremental'
+    lotes = _lotes_pendentes(conn, tabela, completo)
+    if not lotes and not completo:
+        return {
+            "ok": True,
+            "msg": f"ETL {spec['name']}: nenhum lote novo no staging_01.",
+            **upsert_counts(0, 0, 0),
+            "mode": modo,
+            "batches": [],
+        }
+
+    chunk_rows = STAGING2_CHUNK_ROWS if chunk_rows is None else int(chunk_rows)
+    limites = _limites_faixas(conn, spec, lotes, completo, chunk_rows) if chunk_rows > 0 else []
+    # faixas (de, ate]: a primeira e a última são abertas
+    faixas = list(zip([None] + limites, limites + [None]))
+
+    _, tipo_chave = _chave_sql(spec)
+    totais = [0, 0, 0]
+    preparo = 'off'
+    for i, (de, ate) in enumerate(faixas, start=1):
+        # cada faixa lê só as suas chaves (range scan no índice de chave_ddl_sql)
+        lados = (de is not None, ate is not None)
+        cur = conn.connection.cursor()
+        try:
+            if not STAGING2_PREPARED:
+                cur.execute(upsert_sql(spec, completo, ('%(lotes)s::BIGINT[]', '%(de)s', '%(ate)s'), lados),
+                            {'lotes': lotes, 'de': de, 'ate': ate})
+            else:
+                nome, sql = _sql_da_spec(spec, completo, lados)
+                preparados = _preparados(conn)
+                if nome not in preparados:
+                    cur.execute(f"PREPARE {nome} (BIGINT[], {tipo_chave}, {tipo_chave}) AS {sql}")
+                    preparados.add(nome)
+                    preparo = 'new'
+                elif i == 1:
+                    preparo = 'reused'
+                cur.execute(f"EXECUTE {nome} (%s, %s, %s)", (lotes, de, ate))
+            totais = [a + int(b) for a, b in zip(totais, cur.fetchone())]
+        finally:
+            cur.close()
+        if len(faixas) > 1:
+            _progresso(conn, tabela, i, len(faixas), totais[2], 'ok' if i == len(faixas) else 'running')
+            if i < len(faixas):
+                # libera os locks da faixa; as próximas seguem em transações novas
+                conn.commit()
+                logger.info(f"staging2 {spec['name']}: faixa {i}/{len(faixas)} confirmada ({totais[2]} linhas)")
+    contagens = upsert_counts(*totais)
+    _marcar_processados(conn, tabela, lotes, completo, contagens['source_rows'])
+    return {
+        "ok": True,
+        "msg": (f"ETL {spec['name']} ({modo}, {len(lotes)} lote(s)): {contagens['inserted']} inseridos, "
+                f"{contagens['updated']} atualizados, {contagens['unchanged']} inalterados "
+                f"(de {contagens['source_rows']} elegíveis)."),
+        **contagens,
+        "prepared": preparo,
+        "mode": modo,
+        "batches": lotes,
+        "chunks": len(faixas),
+    }
+
+
+def analyze_changed(engine, alteradas):
+    """ANALYZE, cada um em transação própria, das tabelas do staging_02 que mudaram o
+    suficiente nesta execução (ver STAGING2_ANALYZE_*). alteradas = {tabela: inseridas +
+    atualizadas}. Retorna {'seconds', 'tabelas': [{tabela, alteradas, estimadas, analisada, seconds}]}."""
+    comeco = time.perf_counter()
+    alteradas = {t: n for t, n in alteradas.items() if n > 0}
+    tabelas = []
+    if STAGING2_ANALYZE and alteradas:
+        with engine.connect() as conn:
+            estado = {r['relname']: r for r in conn.execute(text("""
+                SELECT c.relname,
+                       GREATEST(c.reltuples, 0)::BIGINT AS estimadas,
+                       COALESCE(st.last_analyze, st.last_autoanalyze) IS NULL AS nunca_analisada
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_stat_user_tables st ON st.relid = c.oid
+                WHERE n.nspname = :schema AND c.relname = ANY(:tabelas)
+            """), {'schema': STAGING02, 'tabelas': list(alteradas)}).mappings().all()}
+        for tabela, n in alteradas.items():
+            info = estado.get(tabela)
+            if info is None:
+                continue
+            limite = max(STAGING2_ANALYZE_MIN_ROWS, STAGING2_ANALYZE_FRACTION * info['estimadas'])
+            analisar = n >= limite or info['nunca_analisada']
+            inicio = time.perf_counter()
+            if analisar:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ANALYZE {STAGING02}.{tabela}"))
+            tabelas.append({'tabela': tabela, 'alteradas': n, 'estimadas': info['estimadas'],
+                            'analisada': analisar, 'seconds': round(time.perf_counter() - inicio, 3)})
+        logger.info(f"ANALYZE staging_02: {[t['tabela'] for t in tabelas if t['analisada']]}")
+    return {'seconds': round(time.perf_counter() - comeco, 3), 'tabelas': tabelas}
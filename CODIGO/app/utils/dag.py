@@ -0,0 +1,138 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def resolve_dependencies(steps):
+    """Calcula as dependências de cada etapa a partir das entradas/saídas declaradas:
+    B depende de A quando alguma entrada de B é saída de A.
+    Retorna {nome: [nomes das etapas anteriores]} e falha se houver ciclo."""
+    produtores = {}
+    for s in steps:
+        for saida in s['outputs']:
+            produtores.setdefault(saida, []).append(s['name'])
+    deps = {}
+    for s in steps:
+        anteriores = []
+        for entrada in s['inputs']:
+            for p in produtores.get(entrada, []):
+                if p != s['name'] and p not in anteriores:
+                    anteriores.append(p)
+        deps[s['name']] = anteriores
+
+    # ordenação topológica só para detectar ciclos
+    pendentes = {n: set(d) for n, d in deps.items()}
+    while pendentes:
+        prontas = [n for n, d in pendentes.items() if not d]
+        if not prontas:
+            raise ValueError(f"Ciclo de dependências entre as etapas: {', '.join(sorted(pendentes))}")
+        for n in prontas:
+            del pendentes[n]
+        for d in pendentes.values():
+            d.difference_update(prontas)
+    return deps
+
+
+def with_dependents(deps, names):
+    """`names` mais todas as etapas que dependem delas, direta ou indiretamente
+    (`deps` como devolvido por resolve_dependencies)."""
+    selecionadas = set(names)
+    mudou = True
+    while mudou:
+        mudou = False
+        for n, anteriores in deps.items():
+            if n not in selecionadas and selecionadas.intersection(anteriores):
+                selecionadas.add(n)
+                mudou = True
+    return selecionadas
+
+
+def critical_path(results, deps):
+    """Caminho crítico da execução: parte da etapa que terminou por último e volta
+    pela dependência que terminou mais tarde (a que de fato a segurou)."""
+    executadas = {n: r for n, r in results.items() if r.get('finished_at_s') is not None}
+    if not executadas:
+        return {'etapas': [], 'seconds': 0.0}
+    atual = max(executadas, key=lambda n: executadas[n]['finished_at_s'])
+    caminho = [atual]
+    while True:
+        anteriores = [d for d in deps.get(atual, []) if d in executadas]
+        if not anteriores:
+            break
+        atual = max(anteriores, key=lambda n: executadas[n]['finished_at_s'])
+        caminho.append(atual)
+    caminho.reverse()
+    return {
+        'etapas': caminho,
+        'seconds': round(executadas[caminho[-1]]['finished_at_s'] - executadas[caminho[0]]['started_at_s'], 3),
+    }
+
+
+def run_dag(steps, workers, run_step):
+    """Executa as etapas respeitando as dependências, com até `workers` em paralelo.
+    `steps`: lista de dicts com 'name', 'inputs' e 'outputs' (mais o que run_step usar).
+    `run_step(step)` roda uma etapa e devolve um dict com 'ok'. Etapas cujas
+    dependências falharam não rodam (status 'skipped').
+    Retorna (resultados por nome, na ordem de `steps`; caminho crítico; wall_seconds)."""
+    deps = resolve_dependencies(steps)
+    por_nome = {s['name']: s for s in steps}
+    inicio = time.perf_counter()
+    resultados = {}
+    estado = {n: 'pending' for n in por_nome}
+
+    def _rodar(step):
+        comeco = time.perf_counter()
+        try:
+            res = run_step(step)
+        except Exception as e:
+            res = {'ok': False, 'msg': str(e)}
+        fim = time.perf_counter()
+        return {
+            'ok': bool(res.get('ok')),
+            'status': 'ok' if res.get('ok') else 'failed',
+            'depends_on': deps[step['name']],
+            'worker': threading.current_thread().name,
+            'started_at_s': round(comeco - inicio, 3),
+            'finished_at_s': round(fim - inicio, 3),
+            'seconds': round(fim - comeco, 3),
+            'result': res,
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='dag') as pool:
+        em_execucao = {}
+        while True:
+            mudou = True
+            # repete enquanto houver mudança: um 'skipped' propaga para as etapas seguintes
+            while mudou:
+                mudou = False
+                for n in por_nome:
+                    if estado[n] != 'pending':
+                        continue
+                    status_deps = [estado[d] for d in deps[n]]
+                    if any(s in ('failed', 'skipped') for s in status_deps):
+                        mudou = True
+                        estado[n] = 'skipped'
+                        falhas = [d for d in deps[n] if estado[d] in ('failed', 'skipped')]
+                        resultados[n] = {
+                            'ok': False,
+                            'status': 'skipped',
+                            'depends_on': deps[n],
+                            'started_at_s': None,
+                            'finished_at_s': None,
+                            'seconds': 0.0,
+                            'result': {'ok': False, 'msg': f"não executada: dependência falhou ({', '.join(falhas)})"},
+                        }
+                    elif all(s == 'ok' for s in status_deps):
+                        estado[n] = 'running'
+                        em_execucao[pool.submit(_rodar, por_nome[n])] = n
+            if not em_execucao:
+                break
+            concluidos, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+            for f in concluidos:
+                n = em_execucao.pop(f)
+                resultados[n] = f.result()
+                estado[n] = resultados[n]['status']
+
+    wall_seconds = round(time.perf_counter() - inicio, 3)
+    ordenados = {s['name']: resultados[s['name']] for s in steps}
+    return ordenados, critical_path(ordenados, deps), wall_seconds
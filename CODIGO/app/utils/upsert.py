@@ -0,0 +1,63 @@
+import os
+
+from sqlalchemy import text
+
+# Upserts só regravam linhas cujos valores mudaram (evita tupla morta, churn de índice e WAL
+# para cada linha igual a cada execução); no staging2 o _row_digest também precisa ter mudado.
+# false = DO UPDATE incondicional em todas as camadas (staging2, model e mart), como antes.
+ETL_SKIP_UNCHANGED = os.getenv('ETL_SKIP_UNCHANGED', 'true').lower() in ('1', 'true', 'sim')
+
+# Fecha um upsert escrito como "WITH ..., src AS (...), upsert AS (INSERT ... RETURNING
+# (xmax = 0) AS inserted_flag)": conta inseridas/atualizadas e as linhas elegíveis de src.
+_CONTAGEM_SQL = """
+    SELECT
+        COUNT(*) FILTER (WHERE inserted_flag)     AS inseridos,
+        COUNT(*) FILTER (WHERE NOT inserted_flag) AS atualizados,
+        (SELECT COUNT(*) FROM src)                AS elegiveis
+    FROM upsert
+"""
+
+
+def update_where(tabela, colunas, digest=False):
+    """Cláusula WHERE do ON CONFLICT ... DO UPDATE que pula linhas sem mudança
+    (vazia quando ETL_SKIP_UNCHANGED está desligado). Com digest, a linha também
+    precisa ter _row_digest novo; sem digest (carregada por fora do staging1)
+    vale só a comparação dos valores."""
+    if not ETL_SKIP_UNCHANGED:
+        return ''
+    atuais = ', '.join(f'{tabela}.{c}' for c in colunas)
+    novos = ', '.join(f'EXCLUDED.{c}' for c in colunas)
+    valores = f'({atuais}) IS DISTINCT FROM ({novos})'
+    if not digest:
+        return f'WHERE {valores}'
+    return (f'WHERE (EXCLUDED._row_digest IS NULL OR {tabela}._row_digest IS DISTINCT FROM EXCLUDED._row_digest) '
+            f'AND {valores}')
+
+
+def update_set(tabela, colunas, digest=False):
+    """Corpo do ON CONFLICT ... DO UPDATE: SET c = EXCLUDED.c e o update_where das mesmas
+    colunas, montados de uma lista só (o SET e a comparação não têm como divergir)."""
+    sets = ',\n            '.join(f'{c} = EXCLUDED.{c}' for c in colunas)
+    return f'SET\n            {sets}\n        {update_where(tabela, colunas, digest)}'
+
+
+def upsert_counts(inseridos, atualizados, elegiveis):
+    inseridos, atualizados, elegiveis = int(inseridos), int(atualizados), int(elegiveis)
+    return {
+        'inserted': inseridos,
+        'updated': atualizados,
+        'unchanged': max(elegiveis - inseridos - atualizados, 0),
+        'source_rows': elegiveis,
+    }
+
+
+def run_counted_upsert(conn, sql):
+    """Executa o upsert (CTEs src + upsert, ver _CONTAGEM_SQL) e devolve
+    inserted/updated/unchanged/source_rows."""
+    row = conn.execute(text(sql + _CONTAGEM_SQL)).mappings().one()
+    return upsert_counts(row['inseridos'], row['atualizados'], row['elegiveis'])
+
+
+def counts_msg(nome, contagens):
+    return (f"{nome}: {contagens['inserted']} inseridos, {contagens['updated']} atualizados, "
+            f"{contagens['unchanged']} inalterados")
@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+
+
+class FakeSavepoint:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def commit(self):
+        self.conn.savepoints.append('commit')
+
+    def rollback(self):
+        self.conn.savepoints.append('rollback')
+
+
+class FakeCursor:
+    def __init__(self, copies=None, sqls=None, params=None, linha=None):
+        self.closed = False
+        self.copies = copies if copies is not None else []
+        self.sqls = sqls if sqls is not None else []
+        self.params = params if params is not None else []
+        self.linha = linha
+
+    def execute(self, sql, params=None):
+        self.sqls.append(sql)
+        self.params.append(params)
+
+    def fetchone(self):
+        return self.linha
+
+    def copy_expert(self, sql, arquivo, size=8192):
+        # lê o arquivo como o psycopg2, em blocos de `size`
+        partes = []
+        while True:
+            data = arquivo.read(size)
+            if not data:
+                break
+            partes.append(data if isinstance(data, str) else data.decode('utf-8'))
+        self.copies.append((sql, ''.join(partes)))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDbapi:
+    """Conexão do DBAPI; `linha` é o fetchone() de todo cursor (ex.: contagens do upsert)."""
+
+    def __init__(self, linha=None):
+        self.copies = []
+        self.sqls = []
+        self.params = []
+        self.linha = linha
+        self.info = {}
+
+    def cursor(self):
+        return FakeCursor(self.copies, self.sqls, self.params, self.linha)
+
+
+class FakeRows:
+    """Resultado de execute(): linhas (dicts) ou um escalar (também usado como rowcount)."""
+
+    def __init__(self, valor=None):
+        self.valor = valor
+        self.rowcount = valor if isinstance(valor, int) else -1
+
+    def mappings(self):
+        return self
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self.valor or [])
+
+    def first(self):
+        return (self.valor or [None])[0]
+
+    def scalar(self):
+        return self.valor
+
+
+class FakeConn:
+    """Conexão de destino mínima: savepoints e cursor cru (sem banco).
+    `resultados` são devolvidos em ordem pelas chamadas a execute()."""
+
+    def __init__(self, resultados=()):
+        self.savepoints = []
+        self.executed = []
+        self.commits = 0
+        self.resultados = list(resultados)
+        self.connection = FakeDbapi()
+
+    def begin_nested(self):
+        return FakeSavepoint(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def execute(self, sql, params=None):
+        self.executed.append((str(sql), params))
+        return FakeRows(self.resultados.pop(0) if self.resultados else None)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def partitions(self, size):
+        for i in range(0, len(self._rows), size):
+            yield self._rows[i:i + size]
+
+    def scalar(self):
+        return self._rows[0][0] if self._rows else None
+
+
+class FakeSourceConn:
+    def __init__(self, rows, erro=None):
+        self.rows = rows
+        self.erro = erro
+        self.options = {}
+        self.sql = None
+
+    def execution_options(self, **kw):
+        self.options.update(kw)
+        return self
+
+    def execute(self, sql, params=None):
+        if self.erro:
+            raise self.erro
+        self.sql = str(sql)
+        return FakeResult(self.rows)
+
+    def rollback(self):
+        self.options['rolled_back'] = True
+
+
+class FakeSourceEngine:
+    def __init__(self, rows=(), erro=None):
+        self.conn = FakeSourceConn(list(rows), erro)
+
+    @contextmanager
+    def connect(self):
+        yield self.conn
+
+
+class FakeEngine:
+    """Engine de destino: begin()/connect() entregam sempre a mesma FakeConn."""
+
+    def __init__(self, conn=None):
+        self.conn = conn or FakeConn()
+
+    @contextmanager
+    def begin(self):
+        yield self.conn
+
+    @contextmanager
+    def connect(self):
+        yield self.conn
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.dag import critical_path, resolve_dependencies, run_dag, with_dependents
+
+
+def _etapa(nome, entradas=(), saidas=()):
+    return {'name': nome, 'inputs': list(entradas), 'outputs': list(saidas)}
+
+
+ETAPAS = [
+    _etapa('usuarios', ['stg1.user'], ['stg2.user']),
+    _etapa('consultas', ['stg1.appointment'], ['stg2.appointment']),
+    _etapa('fato', ['stg2.user', 'stg2.appointment'], ['model.fato']),
+    _etapa('mart', ['model.fato'], ['mart.resumo']),
+]
+
+
+def test_resolve_dependencies_por_entradas_e_saidas():
+    assert resolve_dependencies(ETAPAS) == {
+        'usuarios': [], 'consultas': [], 'fato': ['usuarios', 'consultas'], 'mart': ['fato'],
+    }
+
+
+def test_resolve_dependencies_ignora_a_propria_saida():
+    deps = resolve_dependencies([_etapa('a', ['x'], ['x'])])
+    assert deps == {'a': []}
+
+
+def test_resolve_dependencies_detecta_ciclo():
+    with pytest.raises(ValueError, match='a, b'):
+        resolve_dependencies([_etapa('a', ['y'], ['x']), _etapa('b', ['x'], ['y']), _etapa('c', [], ['z'])])
+
+
+def test_with_dependents_inclui_dependentes_indiretos():
+    deps = resolve_dependencies(ETAPAS)
+    assert with_dependents(deps, ['usuarios']) == {'usuarios', 'fato', 'mart'}
+    assert with_dependents(deps, ['mart']) == {'mart'}
+    assert with_dependents(deps, []) == set()
+
+
+def test_critical_path_segue_a_dependencia_mais_lenta():
+    deps = resolve_dependencies(ETAPAS)
+    resultados = {
+        'usuarios': {'started_at_s': 0.0, 'finished_at_s': 1.0},
+        'consultas': {'started_at_s': 0.0, 'finished_at_s': 3.0},
+        'fato': {'started_at_s': 3.0, 'finished_at_s': 4.0},
+        'mart': {'started_at_s': None, 'finished_at_s': None},
+    }
+    assert critical_path(resultados, deps) == {'etapas': ['consultas', 'fato'], 'seconds': 4.0}
+    assert critical_path({}, deps) == {'etapas': [], 'seconds': 0.0}
+
+
+def test_run_dag_respeita_dependencias_e_roda_em_paralelo():
+    # as duas primeiras só passam da barreira se rodarem ao mesmo tempo
+    barreira = threading.Barrier(2, timeout=5)
+    ordem = []
+    trava = threading.Lock()
+
+    def _rodar(step):
+        if step['name'] in ('usuarios', 'consultas'):
+            barreira.wait()
+        else:
+            time.sleep(0.01)
+        with trava:
+            ordem.append(step['name'])
+        return {'ok': True}
+
+    resultados, caminho, wall = run_dag(ETAPAS, 2, _rodar)
+    assert list(resultados) == ['usuarios', 'consultas', 'fato', 'mart']
+    assert all(r['status'] == 'ok' for r in resultados.values())
+    assert ordem[2:] == ['fato', 'mart']
+    assert resultados['fato']['depends_on'] == ['usuarios', 'consultas']
+    assert caminho['etapas'][-2:] == ['fato', 'mart']
+    assert wall >= 0
+
+
+def test_run_dag_pula_dependentes_de_etapa_com_falha():
+    rodadas = []
+
+    def _rodar(step):
+        rodadas.append(step['name'])
+        if step['name'] == 'usuarios':
+            raise RuntimeError('sem conexão')
+        return {'ok': step['name'] != 'consultas'}
+
+    resultados, _, _ = run_dag(ETAPAS, 1, _rodar)
+    assert resultados['usuarios']['status'] == 'failed'
+    assert resultados['usuarios']['result']['msg'] == 'sem conexão'
+    assert resultados['consultas']['status'] == 'failed'
+    # 'skipped' propaga: mart depende de fato, que nem rodou
+    assert resultados['fato']['status'] == 'skipped' and resultados['mart']['status'] == 'skipped'
+    assert 'usuarios' in resultados['fato']['result']['msg']
+    assert sorted(rodadas) == ['consultas', 'usuarios']
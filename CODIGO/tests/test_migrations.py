@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app.routes.etl import migrations
+from app.routes.etl.migrations import META, _checksum, ensure_schema, migrate
+
+from fakes import FakeRows
+
+V1 = ['CREATE TABLE a (id INT)']
+V2 = ['CREATE TABLE b (id INT)', 'CREATE INDEX ix_b ON b (id)']
+
+
+class MigracaoEngine:
+    """Banco falso: schema_version em memória; cada begin()/connect() é uma transação
+    numerada e cada statement fica registrado com o número dela."""
+
+    def __init__(self, gravadas=None, tabelas=()):
+        self.gravadas = dict(gravadas or {})
+        self.tabelas = list(tabelas)
+        self.statements = []
+        self.transacoes = 0
+
+    @contextmanager
+    def _transacao(self):
+        self.transacoes += 1
+        yield _Conn(self, self.transacoes)
+
+    begin = connect = _transacao
+
+
+class _Conn:
+    def __init__(self, banco, transacao):
+        self.banco = banco
+        self.transacao = transacao
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(str(sql).split())
+        self.banco.statements.append((self.transacao, sql))
+        if sql.startswith(f'SELECT checksum FROM {META}.schema_version'):
+            return FakeRows(self.banco.gravadas.get(params['v']))
+        if sql.startswith(f'INSERT INTO {META}.schema_version'):
+            self.banco.gravadas[params['v']] = params['c']
+        if sql.startswith('SELECT table_schema, table_name'):
+            return FakeRows([tuple(t.split('.')) for t in self.banco.tabelas])
+        if sql.startswith(f'SELECT MAX(version) FROM {META}.schema_version'):
+            return FakeRows(max(self.banco.gravadas, default=None))
+        return FakeRows()
+
+
+@pytest.fixture(autouse=True)
+def versoes(monkeypatch):
+    monkeypatch.setattr(migrations, 'MIGRACOES', [(1, 'a', lambda: V1), (2, 'b', lambda: V2)])
+    monkeypatch.setattr(migrations, 'VERSAO_ATUAL', 2)
+    monkeypatch.setattr(migrations, '_versao_conferida', None)
+    avisos = []
+    monkeypatch.setattr(migrations.logger, 'warning', avisos.append)
+    return avisos
+
+
+def _por_transacao(banco):
+    transacoes = {}
+    for t, sql in banco.statements:
+        transacoes.setdefault(t, []).append(sql)
+    return transacoes
+
+
+def test_cada_versao_em_transacao_propria_sob_lock():
+    banco = MigracaoEngine()
+    assert migrate(banco) == [1, 2]
+    _, v1, v2 = _por_transacao(banco).values()
+    for statements, ddl in ((v1, V1), (v2, V2)):
+        assert statements[0] == "SELECT pg_advisory_xact_lock(hashtext('lacreisaude_schema_version'))"
+        assert statements[2:-1] == [' '.join(s.split()) for s in ddl]
+        # a versão é gravada na mesma transação do DDL
+        assert statements[-1].startswith(f'INSERT INTO {META}.schema_version')
+    assert banco.gravadas == {1: _checksum(V1), 2: _checksum(V2)}
+
+
+def test_versao_ja_aplicada_e_pulada(versoes):
+    banco = MigracaoEngine({1: _checksum(V1)})
+    assert migrate(banco) == [2]
+    assert not any(sql.startswith('CREATE TABLE a') for _, sql in banco.statements)
+    assert versoes == []
+
+
+def test_checksum_diferente_so_avisa(versoes):
+    banco = MigracaoEngine({1: 'editada', 2: _checksum(V2)})
+    assert migrate(banco) == []
+    assert not any(sql.startswith(('CREATE TABLE a', 'CREATE TABLE b')) for _, sql in banco.statements)
+    assert banco.gravadas[1] == 'editada'
+    aviso, = versoes
+    assert aviso.startswith('migração 1 (a) mudou depois de aplicada')
+
+
+def test_ensure_schema_na_versao_atual_nao_migra(monkeypatch):
+    monkeypatch.setattr(migrations, 'migrate', lambda engine: pytest.fail('não devia migrar'))
+    banco = MigracaoEngine({1: _checksum(V1), 2: _checksum(V2)}, [f'{META}.schema_version', 'lacreisaude_mart.patients'])
+    tabelas, aplicadas = ensure_schema(banco)
+    assert aplicadas == [] and 'lacreisaude_mart.patients' in tabelas
+    assert banco.transacoes == 1
+    # versão conferida neste processo: as próximas chamadas só leem o catálogo
+    banco.statements.clear()
+    ensure_schema(banco)
+    assert [sql.split()[0:2] for _, sql in banco.statements] == [['SELECT', 'table_schema,']]
+
+
+@pytest.mark.parametrize('gravadas, tabelas', [
+    ({}, []),                                            # banco novo
+    ({1: _checksum(V1)}, [f'{META}.schema_version']),    # versão antiga
+])
+def test_ensure_schema_migra_e_rele_o_catalogo(gravadas, tabelas):
+    banco = MigracaoEngine(gravadas, tabelas)
+    _, aplicadas = ensure_schema(banco)
+    assert aplicadas == [v for v in (1, 2) if v not in gravadas]
+    assert migrations._versao_conferida == 2
+    catalogo = [t for t, sql in banco.statements if sql.startswith('SELECT table_schema, table_name')]
+    assert len(catalogo) == 2 and catalogo[-1] == banco.transacoes
@@ -0,0 +1,44 @@
+import re
+
+import pytest
+
+from app.routes.etl import mart, model
+from app.utils import upsert
+from app.utils.upsert import update_set, upsert_counts
+
+from fakes import FakeConn
+
+
+def test_update_set_monta_set_e_where_da_mesma_lista(monkeypatch):
+    monkeypatch.setattr(upsert, 'ETL_SKIP_UNCHANGED', True)
+    sql = ' '.join(update_set('s.t', ('a', 'b')).split())
+    assert sql == 'SET a = EXCLUDED.a, b = EXCLUDED.b WHERE (s.t.a, s.t.b) IS DISTINCT FROM (EXCLUDED.a, EXCLUDED.b)'
+    monkeypatch.setattr(upsert, 'ETL_SKIP_UNCHANGED', False)
+    assert ' '.join(update_set('s.t', ('a',)).split()) == 'SET a = EXCLUDED.a'
+
+
+def _upserts(monkeypatch, modulo, rodar):
+    sqls = []
+    monkeypatch.setattr(upsert, 'ETL_SKIP_UNCHANGED', True)
+    monkeypatch.setattr(modulo, 'run_counted_upsert', lambda conn, sql: sqls.append(sql) or upsert_counts(0, 0, 0))
+    rodar(FakeConn())
+    return sqls
+
+
+@pytest.mark.parametrize('modulo, rodar', [
+    (model, model._rodar_etl_model),
+    (mart, mart._rodar_etl_mart),
+])
+def test_set_e_comparacao_de_mudanca_usam_as_mesmas_colunas(monkeypatch, modulo, rodar):
+    sqls = _upserts(monkeypatch, modulo, rodar)
+    assert len(sqls) == len(modulo.ATUALIZAVEIS) == 4
+    for sql in sqls:
+        tabela = re.search(r'INSERT INTO [\w{}_]+\.(\w+)', sql).group(1)
+        colunas = modulo.ATUALIZAVEIS[tabela]
+        set_sql, atuais, novos = re.search(
+            r'DO UPDATE\s+SET\s+(.*?)\s+WHERE \((.*?)\) IS DISTINCT FROM \((.*?)\)\s+RETURNING', sql, re.S
+        ).groups()
+        assert [c.split('=')[0].strip() for c in set_sql.split(',')] == list(colunas)
+        assert [c.strip().rsplit('.', 1)[1] for c in atuais.split(',')] == list(colunas)
+        assert [c.strip() for c in novos.split(',')] == [f'EXCLUDED.{c}' for c in colunas]
+        assert f'.{tabela}.{colunas[0]}' in atuais
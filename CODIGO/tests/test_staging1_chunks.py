@@ -0,0 +1,60 @@
+import pytest
+
+from app.routes.etl import staging1
+from app.routes.etl.staging1 import _combine_where, _plan_chunks
+
+from fakes import FakeSourceEngine
+
+
+@pytest.fixture
+def estimativa(monkeypatch):
+    def _definir(linhas):
+        monkeypatch.setattr(staging1, '_estimate_source_rows', lambda *a: linhas)
+    return _definir
+
+
+def test_plan_chunks_faixas_contiguas_por_id(estimativa):
+    estimativa(1000)
+    fonte = FakeSourceEngine([('250',), ('500',), ('750',)])
+    predicados = _plan_chunks(fonte, 'public', 'lacreiid_appointment', {'id': 'integer'}, 250)
+    assert predicados == [
+        '"id" < \'250\'',
+        '"id" >= \'250\' AND "id" < \'500\'',
+        '"id" >= \'500\' AND "id" < \'750\'',
+        '"id" >= \'750\'',
+        '"id" IS NULL',
+    ]
+    assert 'generate_series' in fonte.conn.sql
+
+
+def test_plan_chunks_usa_created_at_sem_id_numerico(estimativa):
+    estimativa(10)
+    fonte = FakeSourceEngine([('2024-01-01 00:00:00',)])
+    predicados = _plan_chunks(fonte, 'public', 't', {'id': 'text', 'created_at': 'timestamp with time zone'}, 5)
+    assert predicados[0] == '"created_at" < \'2024-01-01 00:00:00\''
+
+
+@pytest.mark.parametrize('colunas, linhas, chunk_rows', [
+    ({'id': 'integer'}, 100, 0),          # faixas desligadas
+    ({'id': 'integer'}, 100, 500),        # tabela pequena
+    ({'id': 'uuid'}, 10 ** 6, 500),       # sem coluna de particionamento
+])
+def test_plan_chunks_sem_divisao(estimativa, colunas, linhas, chunk_rows):
+    estimativa(linhas)
+    assert _plan_chunks(FakeSourceEngine(), 'public', 't', colunas, chunk_rows) == [None]
+
+
+def test_plan_chunks_tabela_sem_intervalo(estimativa):
+    # MIN = MAX (ou tabela vazia): nenhum limite interno
+    estimativa(1000)
+    assert _plan_chunks(FakeSourceEngine([]), 'public', 't', {'id': 'bigint'}, 100) == [None]
+
+
+@pytest.mark.parametrize('where_sql, predicado, esperado', [
+    ('', None, ''),
+    ('WHERE "id" > 1', None, 'WHERE "id" > 1'),
+    ('', '"id" < 5', 'WHERE "id" < 5'),
+    ('WHERE "id" > 1', '"id" < 5 OR "id" IS NULL', 'WHERE "id" > 1 AND ("id" < 5 OR "id" IS NULL)'),
+])
+def test_combine_where(where_sql, predicado, esperado):
+    assert _combine_where(where_sql, predicado) == esperado
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from app.routes.etl import staging1
+from app.routes.etl.staging1 import _CopyPipe, _projected_select
+
+
+def _consumir(pipe, tamanho=4):
+    partes = []
+    while True:
+        data = pipe.read(tamanho)
+        if not data:
+            return b''.join(partes)
+        partes.append(data)
+
+
+def test_copy_pipe_entrega_os_bytes_na_ordem():
+    pipe = _CopyPipe(max_chunks=2)
+
+    def _produtor():
+        for parte in ('1,a\n', b'2,b\n', '3,c\n'):
+            pipe.write(parte)
+        pipe.finish()
+
+    t = threading.Thread(target=_produtor)
+    t.start()
+    assert _consumir(pipe) == b'1,a\n2,b\n3,c\n'
+    t.join()
+    assert pipe.bytes == 12
+
+
+def test_copy_pipe_propaga_erro_da_fonte():
+    pipe = _CopyPipe()
+    pipe.write(b'1,a\n')
+    pipe.finish(error=RuntimeError('conexão perdida'))
+    with pytest.raises(RuntimeError, match='conexão perdida'):
+        _consumir(pipe, tamanho=-1)
+
+
+def test_copy_pipe_abortado_interrompe_o_produtor():
+    pipe = _CopyPipe(max_chunks=1)
+    pipe.write(b'x')
+    pipe.abort()
+    with pytest.raises(RuntimeError, match='abortado'):
+        pipe.write(b'y')
+
+
+def test_projected_select_projeta_anula_sensiveis_e_marca_lote():
+    cols, sql = _projected_select(
+        'public', 'lacreiid_user', ['id', 'first_name', 'phone', 'inexistente'],
+        {'id': 'integer', 'first_name': 'text', 'phone': 'text'}, 'WHERE "id" > 10', batch_id=7,
+    )
+    assert 'phone' in staging1.SENSITIVE_NULL
+    assert cols == ['id', 'first_name', 'phone', '_row_digest', '_batch_id']
+    assert '"id"::text AS "id"' in sql
+    assert 'NULL::text AS "phone"' in sql
+    assert 'md5(ROW("id"::text, "first_name"::text, NULL::text)::text) AS "_row_digest"' in sql
+    assert '7::bigint AS "_batch_id"' in sql
+    assert sql.endswith('FROM "public"."lacreiid_user" WHERE "id" > 10')
+    assert 'inexistente' not in sql
+
+
+def test_projected_select_sem_colunas_em_comum():
+    assert _projected_select('public', 'x', ['a'], {'b': 'text'}) == ([], '')
@@ -0,0 +1,25 @@
+import hashlib
+
+import pytest
+
+from app.routes.etl.staging1 import _row_digest_py, _row_literal
+
+
+@pytest.mark.parametrize('valores, literal', [
+    # saídas de SELECT ROW(...)::text no Postgres
+    (['1', None, 'ok'], '(1,,ok)'),
+    (['', None], '("",)'),
+    (['a b', 'x,y', '(p)'], '("a b","x,y","(p)")'),
+    (['diz "oi"', 'c:\\dir'], '("diz ""oi""","c:\\\\dir")'),
+    (['linha\nquebrada', 'tab\there'], '("linha\nquebrada","tab\there")'),
+    (['ação', '2024-01-01 10:00:00+00'], '(ação,"2024-01-01 10:00:00+00")'),
+    ([None], '()'),
+])
+def test_row_literal_igual_ao_record_out(valores, literal):
+    assert _row_literal(valores) == literal
+
+
+def test_row_digest_py_e_o_md5_do_row_literal():
+    # mesmo valor de md5(ROW('1'::text, NULL::text, 'ok'::text)::text) na fonte
+    assert _row_digest_py(['1', None, 'ok']) == hashlib.md5(b'(1,,ok)').hexdigest()
+    assert _row_digest_py(['1', None, 'ok']) != _row_digest_py(['1', '', 'ok'])
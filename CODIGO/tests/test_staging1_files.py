@@ -0,0 +1,119 @@
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from app.routes.etl import staging1
+from app.routes.etl.staging1 import (
+    _file_value_text, _find_table_file, _ingest_table_file, _iter_file_chunks, _iter_jsonl_chunks,
+    _records_chunk, _row_digest_py,
+)
+
+from fakes import FakeConn
+
+
+def _linhas(chunks):
+    return [(colunas, [list(r) for r in linhas]) for colunas, linhas in chunks]
+
+
+@pytest.mark.parametrize('valor, texto', [
+    (None, None),
+    ('abc', 'abc'),
+    (True, 'true'),
+    (1.0, '1'),
+    (2.5, '2.5'),
+    (float('nan'), None),
+    (7, '7'),
+    (Decimal('10.20'), '10.20'),
+    (datetime(2024, 1, 2, 3, 4, 5), '2024-01-02T03:04:05'),
+    (date(2024, 1, 2), '2024-01-02'),
+    ({'a': 'é'}, '{"a": "é"}'),
+])
+def test_file_value_text(valor, texto):
+    assert _file_value_text(valor) == texto
+
+
+def test_find_table_file_respeita_a_ordem_das_extensoes(tmp_path):
+    assert _find_table_file(str(tmp_path), 'lacreiid_user') is None
+    (tmp_path / 'lacreiid_user.parquet').write_bytes(b'')
+    (tmp_path / 'lacreiid_user.csv.gz').write_bytes(b'')
+    assert _find_table_file(str(tmp_path), 'lacreiid_user').endswith('lacreiid_user.csv.gz')
+
+
+def test_records_chunk_une_as_chaves_do_bloco():
+    colunas, linhas = _records_chunk([{'id': 1}, {'id': 2, 'email': 'x'}])
+    assert colunas == ['id', 'email']
+    assert list(linhas) == [[1, None], [2, 'x']]
+
+
+@pytest.mark.parametrize('nome, abrir', [('t.jsonl', open), ('t.jsonl.gz', gzip.open)])
+def test_iter_jsonl_chunks_em_blocos(tmp_path, nome, abrir):
+    path = str(tmp_path / nome)
+    with abrir(path, 'wt', encoding='utf-8') as f:
+        for i in range(5):
+            f.write(json.dumps({'id': i}) + '\n')
+        f.write('\n')
+    blocos = _linhas(_iter_jsonl_chunks(path, 2))
+    assert [len(linhas) for _, linhas in blocos] == [2, 2, 1]
+    assert blocos[-1] == (['id'], [[4]])
+
+
+def test_iter_csv_chunks_le_tudo_como_texto(tmp_path):
+    pytest.importorskip('pandas')
+    path = tmp_path / 't.csv'
+    path.write_text('﻿id, status\n001,NA\n2,\n3,ok\n', encoding='utf-8')
+    blocos = _linhas(_iter_file_chunks(str(path), 2, {'id', 'status'}))
+    assert blocos == [(['id', 'status'], [['001', 'NA'], ['2', '']]), (['id', 'status'], [['3', 'ok']])]
+
+
+def test_iter_parquet_chunks_le_so_as_colunas_do_staging(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 't.parquet')
+    pq.write_table(pa.table({'id': [1, 2, 3], 'extra': ['a', 'b', 'c']}), path)
+    blocos = _linhas(_iter_file_chunks(path, 2, {'id'}))
+    assert blocos == [(['id'], [[1], [2]]), (['id'], [[3]])]
+
+
+def test_iter_xlsx_chunks_usa_a_primeira_linha_como_cabecalho(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append([' id ', 'status'])
+    ws.append([1, 'ok'])
+    ws.append([2, None])
+    path = str(tmp_path / 't.xlsx')
+    wb.save(path)
+    assert _linhas(_iter_file_chunks(path, 10, {'id'})) == [(['id', 'status'], [[1, 'ok'], [2, None]])]
+
+
+def test_ingest_table_file_projeta_anula_sensiveis_e_grava_digest(tmp_path):
+    path = tmp_path / 'lacreiid_user.jsonl'
+    path.write_text(
+        json.dumps({'id': 1, 'email': 'a@b.c', 'first_name': 'Ana', 'nao_existe': 'x'}) + '\n'
+        + json.dumps({'id': 2.0, 'first_name': None}) + '\n',
+        encoding='utf-8',
+    )
+    conn = FakeConn()
+    n = _ingest_table_file(conn, 'lacreiid_user', staging1.TABLE_COLUMNS['lacreiid_user'], str(tmp_path), 1,
+                           batch_id=9)
+    assert n == 2
+    assert conn.savepoints == ['commit']
+    copias = conn.connection.copies
+    # um COPY por bloco; só as colunas do staging_01 presentes no arquivo, na ordem de TABLE_COLUMNS
+    assert len(copias) == 2
+    assert copias[0][0].startswith('COPY lacreisaude_staging_01."lacreiid_user" '
+                                   '("id","email","first_name","_row_digest","_batch_id") FROM STDIN')
+    linhas = [next(csv.reader(io.StringIO(dados))) for _, dados in copias]
+    assert linhas[0] == ['1', '\\N', 'Ana', _row_digest_py(['1', None, 'Ana']), '9']
+    # o 2º bloco não tem email: cada bloco projeta só as colunas que o arquivo trouxe nele
+    assert '("id","first_name","_row_digest","_batch_id")' in copias[1][0]
+    assert linhas[1] == ['2', '\\N', _row_digest_py(['2', None]), '9']
+
+
+def test_ingest_table_file_sem_arquivo(tmp_path):
+    assert _ingest_table_file(FakeConn(), 'lacreiid_user', ['id'], str(tmp_path), 10) == 0
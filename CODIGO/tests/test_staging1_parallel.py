@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from app.routes.etl import staging1
+
+from fakes import FakeConn, FakeEngine
+
+PLANO = {'column': None, 'from': None, 'to': None, 'where_sql': '', 'source_cols': {}}
+
+
+@pytest.fixture
+def extracao(monkeypatch):
+    """_extrair com planejamento, cópia e fechamento de tabela substituídos."""
+    tabelas = staging1.STAGING1_TABLES
+    unidades = [(tabelas[0], 1, '"id" < 10'), (tabelas[0], 2, '"id" >= 10'), (tabelas[1], 1, None)]
+    monkeypatch.setattr(staging1, '_planejar_extracao', lambda *a: (
+        {t: dict(PLANO) for t in tabelas}, unidades, {t: [] for t in tabelas}, {t: 'new' for t in tabelas},
+    ))
+    monkeypatch.setattr(staging1, 'engine', FakeEngine())
+    copiadas = []
+
+    def _unidade(t, faixa, modo, batch_size, where_sql, predicado, retries, inicio, batch_id, snapshot_id=None,
+                 truncate=False):
+        copiadas.append((t, faixa, threading.current_thread().name, truncate))
+        return {'faixa': faixa, 'predicado': predicado, 'rows': 10 * faixa, 'ok': t != tabelas[1],
+                'attempts': 1, 'erro': None if t != tabelas[1] else 'falhou', 'checkpoint': 'copied', 'truncated': truncate,
+                'worker': threading.current_thread().name, 'started_at_s': 0.0, 'finished_at_s': float(faixa),
+                'seconds': float(faixa)}
+
+    monkeypatch.setattr(staging1, '_extrair_unidade', _unidade)
+    monkeypatch.setattr(staging1, '_finish_table', lambda conn, t, modo, plano, loaded, ok, elapsed, b: {
+        'tabela': t, 'rows_copied_from_source': loaded, 'extraction_ok': ok, 'seconds': round(elapsed, 3),
+    })
+    return copiadas
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_extrair_junta_as_faixas_de_cada_tabela(extracao, workers):
+    resumo = staging1._extrair('copy', 100, False, workers, 10, 0.0, 1, {})
+    tabelas = staging1.STAGING1_TABLES
+    assert [r['tabela'] for r in resumo] == tabelas
+    grande, falha = resumo[0], resumo[1]
+    assert grande['rows_copied_from_source'] == 30
+    assert grande['extraction_ok'] is True
+    assert [c['faixa'] for c in grande['chunks']] == [1, 2]
+    assert grande['table_seconds'] == 2.0
+    assert falha['extraction_ok'] is False and falha['erro'] == 'falhou'
+    # tabelas sem unidade (já concluídas) continuam no resumo
+    assert all(r['rows_copied_from_source'] == 0 for r in resumo[2:])
+    prefixo = 'MainThread' if workers == 1 else 'staging1'
+    assert all(nome.startswith(prefixo) for _, _, nome, _ in extracao)
+    assert len(extracao) == 3
+
+
+def test_extrair_trunca_so_tabelas_de_unidade_unica(extracao):
+    resumo = staging1._extrair('copy', 100, True, 3, 10, 0.0, 1, {}, truncate=True)
+    tabelas = staging1.STAGING1_TABLES
+    # a tabela em duas faixas não é truncada: o TRUNCATE de uma faixa apagaria a outra
+    assert {(t, f): trunca for t, f, _, trunca in extracao} == {
+        (tabelas[0], 1): False, (tabelas[0], 2): False, (tabelas[1], 1): True,
+    }
+    assert [r['tabela'] for r in resumo if r['truncated']] == [tabelas[1]]
+
+
+def test_extrair_sem_truncate(extracao):
+    staging1._extrair('copy', 100, True, 1, 10, 0.0, 1, {})
+    assert not any(trunca for *_, trunca in extracao)
+
+
+@pytest.mark.parametrize('uploads_pendentes', [True, False])
+def test_truncate_replaceable_preserva_uploads(uploads_pendentes):
+    conn = FakeConn([None, uploads_pendentes])
+    assert staging1._truncate_replaceable(conn, 'lacreiid_user') is not uploads_pendentes
+    sqls = [sql for sql, _ in conn.executed]
+    assert sqls[0].startswith('LOCK TABLE lacreisaude_staging_01.lacreiid_user')
+    assert "b.modo = 'upload'" in sqls[1]
+    assert any(s.startswith('TRUNCATE') for s in sqls) is not uploads_pendentes
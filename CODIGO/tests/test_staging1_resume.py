@@ -0,0 +1,116 @@
+import pytest
+
+from app import create_app
+from app.routes.etl import staging1
+
+from fakes import FakeConn, FakeEngine
+
+PLANO = {'column': 'updated_at', 'from': None, 'to': '2024-01-01', 'where_sql': ''}
+
+
+def _unidade(faixa, status, rows=None, predicado=None):
+    return {'tabela': 't', 'faixa': faixa, 'predicado': predicado, 'plano': None, 'status': status,
+            'rows': rows, 'attempts': 1}
+
+
+def test_load_checkpoints_agrupa_plano_e_unidades():
+    linhas = [
+        {'tabela': 'a', 'faixa': 0, 'predicado': None, 'plano': PLANO, 'status': 'ok', 'rows': 5, 'attempts': None},
+        dict(_unidade(1, 'ok', 5), tabela='a'),
+        {'tabela': 'b', 'faixa': 0, 'predicado': None, 'plano': PLANO, 'status': None, 'rows': None, 'attempts': None},
+        dict(_unidade(1, 'ok', 3, '"id" < 10'), tabela='b'),
+        dict(_unidade(2, 'failed', None, '"id" >= 10'), tabela='b'),
+    ]
+    cps = staging1._load_checkpoints(FakeConn([linhas]), 7)
+    assert set(cps) == {'a', 'b'}
+    assert cps['a']['status'] == 'ok' and cps['a']['rows'] == 5 and len(cps['a']['unidades']) == 1
+    assert cps['b']['plano'] == PLANO and cps['b']['status'] is None
+    assert [u['faixa'] for u in cps['b']['unidades']] == [1, 2]
+
+
+def test_planejar_extracao_retoma_so_o_pendente(monkeypatch):
+    tabelas = staging1.STAGING1_TABLES
+    checkpoints = {
+        tabelas[0]: {'plano': PLANO, 'status': 'ok', 'rows': 5, 'unidades': [_unidade(1, 'ok', 5)]},
+        tabelas[1]: {'plano': PLANO, 'status': None, 'rows': None, 'unidades': [
+            _unidade(1, 'ok', 3, '"id" < 10'), _unidade(2, 'failed', None, '"id" >= 10')]},
+    }
+    planejadas, gravadas = [], []
+    monkeypatch.setattr(staging1, 'engine', FakeEngine())
+    monkeypatch.setattr(staging1, '_plan_table', lambda conn, t, full, modo: planejadas.append(t) or dict(
+        PLANO, source_cols={}))
+    monkeypatch.setattr(staging1, '_save_plan_checkpoint', lambda conn, b, t, plano, preds: gravadas.append((t, preds)))
+
+    planos, unidades, concluidas, estado = staging1._planejar_extracao('copy', False, 0, 7, checkpoints)
+
+    assert estado[tabelas[0]] == 'skipped' and estado[tabelas[1]] == 'resumed'
+    assert all(estado[t] == 'new' for t in tabelas[2:])
+    # plano gravado é reaproveitado; só tabelas novas são planejadas e gravadas
+    assert planejadas == tabelas[2:] and [t for t, _ in gravadas] == tabelas[2:]
+    assert planos[tabelas[1]]['to'] == '2024-01-01'
+    # da tabela retomada, só a faixa com falha volta a ser copiada
+    assert unidades[0] == (tabelas[1], 2, '"id" >= 10')
+    assert [(t, f) for t, f, _ in unidades[1:]] == [(t, 1) for t in tabelas[2:]]
+    assert [c['faixa'] for c in concluidas[tabelas[1]]] == [1]
+    assert concluidas[tabelas[0]][0]['checkpoint'] == 'skipped'
+
+
+@pytest.mark.parametrize('obtido', [True, False])
+def test_run_lock(monkeypatch, obtido):
+    conn = FakeConn([obtido])
+    monkeypatch.setattr(staging1, 'engine', FakeEngine(conn))
+    with staging1._run_lock() as lock:
+        assert lock is obtido
+    sqls = [sql for sql, _ in conn.executed]
+    assert 'pg_try_advisory_lock' in sqls[0]
+    assert any('pg_advisory_unlock' in s for s in sqls) is obtido
+
+
+def test_extracao_concorrente_falha_com_409(monkeypatch):
+    conn = FakeConn([False])
+    monkeypatch.setattr(staging1, 'engine', FakeEngine(conn))
+    with create_app().app_context():
+        resposta, status = staging1.criar_popular_staging1(modo='copy')
+    assert status == 409
+    assert resposta.get_json()['ok'] is False
+    # nada além da tentativa de lock: nenhum lote iniciado ou abandonado
+    assert len(conn.executed) == 1
+
+
+def test_retencao_nunca_poda_lote_que_o_staging2_nao_processou(monkeypatch):
+    # corte pelos 2 últimos lotes = 10; lote 5 (ok) ainda não está em staging2_batch
+    conn = FakeConn([10, 5, 3])
+    monkeypatch.setattr(staging1, 'engine', FakeEngine(conn))
+    assert staging1._prune_batches(2, tables=['lacreiid_appointment']) == {'lacreiid_appointment': 3}
+    pendente_sql = conn.executed[1][0]
+    assert 'staging2_batch' in pendente_sql
+    # vale mesmo sem marca do staging2 (uploads antes da primeira execução do staging2)
+    assert 'staging2_watermark' not in pendente_sql
+    delete_sql, params = conn.executed[2]
+    assert delete_sql.startswith('DELETE FROM lacreisaude_staging_01.lacreiid_appointment')
+    assert params == {'c': 5}
+    # poda só de uma tabela: lotes e checkpoints ficam
+    assert len(conn.executed) == 3
+
+
+@pytest.mark.parametrize('resultados, perdido', [
+    ([True], False),
+    ([False, False], False),
+    ([False, True], True),
+])
+def test_sentinela_so_le_e_repoe_a_linha(resultados, perdido):
+    conn = FakeConn(resultados)
+    assert staging1._staging_lost_by_crash(conn) is perdido
+    sqls = [sql for sql, _ in conn.executed]
+    # DDL da sentinela fica na migração; por execução só SELECT/INSERT
+    assert all(sql.lstrip().startswith(('SELECT', 'INSERT')) for sql in sqls)
+    assert any(sql.startswith('INSERT') for sql in sqls) is (resultados[0] is False)
+
+
+def test_sentinela_criada_pela_migracao():
+    from app.routes.etl.migrations import MIGRACOES
+    ddl = next(ddl for versao, _, ddl in MIGRACOES if versao == 8)
+    sql, = ddl()
+    assert 'CREATE TABLE IF NOT EXISTS lacreisaude_staging_01._storage_sentinel' in sql
+    # sem UNLOGGED fixo: set_schema_persistence converte a sentinela junto com o staging_01
+    assert 'UNLOGGED' not in sql
@@ -0,0 +1,45 @@
+import pytest
+
+from app.routes.etl import staging1
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """RSS do processo controlado pelo teste, em MB."""
+    atual = {'mb': 100.0}
+    monkeypatch.setattr(staging1, '_current_rss_mb', lambda: atual['mb'])
+    return atual
+
+
+def test_rss_sampler_mede_so_a_execucao(rss):
+    amostrador = staging1._RssSampler(intervalo=0)
+    # pico anterior do processo não conta: a medição começa no reset
+    rss['mb'] = 180.0
+    amostrador.reset()
+    rss['mb'] = 250.0
+    amostrador.sample()
+    rss['mb'] = 190.0
+    assert amostrador.resumo() == {'rss_start_mb': 180.0, 'rss_peak_mb': 250.0, 'rss_peak_delta_mb': 70.0}
+    amostrador.reset()
+    assert amostrador.resumo() == {'rss_start_mb': 190.0, 'rss_peak_mb': 190.0, 'rss_peak_delta_mb': 0.0}
+
+
+def test_rss_sampler_respeita_o_intervalo(rss):
+    amostrador = staging1._RssSampler(intervalo=60)
+    rss['mb'] = 300.0
+    # amostras seguidas dentro do intervalo não releem /proc; o resumo sempre lê
+    amostrador.sample()
+    assert amostrador.pico == 100.0
+    assert amostrador.resumo()['rss_peak_mb'] == 300.0
+
+
+def test_rss_sampler_sem_proc(monkeypatch):
+    monkeypatch.setattr(staging1, '_current_rss_mb', lambda: None)
+    amostrador = staging1._RssSampler(intervalo=0)
+    amostrador.sample()
+    assert amostrador.resumo() == {'rss_start_mb': None, 'rss_peak_mb': None, 'rss_peak_delta_mb': None}
+
+
+def test_current_rss_mb_no_linux():
+    valor = staging1._current_rss_mb()
+    assert valor is None or valor > 0
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app import create_app
+from app.routes.etl import staging1
+
+from fakes import FakeEngine
+
+
+def _item(tabela, ok=True):
+    return {'tabela': tabela, 'extraction_ok': ok, 'checkpoint': 'new', 'table_seconds': 1.0, 'truncated': False}
+
+
+@pytest.fixture
+def execucao(monkeypatch):
+    """criar_popular_staging1 com banco, fonte e extração substituídos; registra as chamadas."""
+    chamadas = []
+    estado = {'resumo': [_item(t) for t in staging1.STAGING1_TABLES]}
+
+    @contextmanager
+    def _lock():
+        yield True
+
+    monkeypatch.setattr(staging1, '_run_lock', _lock)
+    monkeypatch.setattr(staging1, 'ensure_schema', lambda engine: (set(), []))
+    monkeypatch.setattr(staging1, 'engine', FakeEngine())
+    monkeypatch.setattr(staging1, 'source_engine', None)
+    monkeypatch.setattr(staging1, 'current_wal_lsn', lambda conn: None)
+    monkeypatch.setattr(staging1, 'wal_bytes_since', lambda conn, inicio: None)
+    monkeypatch.setattr(staging1, '_staging_lost_by_crash', lambda conn: False)
+    monkeypatch.setattr(staging1, 'set_schema_persistence', lambda conn, schema, unlogged: False)
+    monkeypatch.setattr(staging1, '_pending_batch', lambda conn: None)
+    monkeypatch.setattr(staging1, '_start_batch', lambda conn, modo, full: 42)
+    monkeypatch.setattr(staging1, '_abandon_batches', lambda conn, keep: [])
+    monkeypatch.setattr(staging1, '_extrair', lambda *a, **kw: estado['resumo'])
+    monkeypatch.setattr(staging1, '_finish_batch', lambda b, status: chamadas.append(('finish', b, status)))
+    monkeypatch.setattr(staging1, '_publish_batch', lambda b, full: chamadas.append(('publish', b, full)))
+    monkeypatch.setattr(staging1, '_prune_batches', lambda keep: chamadas.append(('prune', keep)) or {})
+    with create_app().app_context():
+        yield chamadas, estado
+
+
+def _rodar(**kw):
+    resposta, status = staging1.criar_popular_staging1(modo='copy', **kw)
+    return resposta.get_json(), status
+
+
+def test_lote_publicado_so_sem_falhas(execucao):
+    chamadas, _ = execucao
+    corpo, status = _rodar()
+    assert status == 200 and corpo['ok'] is True and corpo['batch_status'] == 'ok'
+    # publicar grava as marcas d'água; a retenção vem depois
+    assert chamadas == [('publish', 42, False), ('prune', staging1.STAGING1_KEEP_BATCHES)]
+
+
+def test_marca_dagua_nao_avanca_com_falha(execucao):
+    chamadas, estado = execucao
+    estado['resumo'][1] = _item(staging1.STAGING1_TABLES[1], ok=False)
+    corpo, status = _rodar()
+    assert corpo['ok'] is False and corpo['batch_status'] == 'failed'
+    assert corpo['failed_tables'] == [staging1.STAGING1_TABLES[1]]
+    # sem _publish_batch nenhuma marca é gravada, nem das tabelas que deram certo
+    assert chamadas == [('finish', 42, 'failed')]
+
+
+def test_erro_na_extracao_marca_o_lote_como_falho(execucao, monkeypatch):
+    chamadas, _ = execucao
+
+    def _quebra(*a, **kw):
+        raise RuntimeError('fonte caiu')
+
+    monkeypatch.setattr(staging1, '_extrair', _quebra)
+    corpo, status = _rodar()
+    assert status == 500 and corpo['mensagem'] == 'fonte caiu'
+    assert chamadas == [('finish', 42, 'failed')]
@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from app import create_app
+from app.routes.etl import staging1, staging2
+
+from fakes import FakeCursor, FakeEngine, FakeSourceEngine
+
+
+class _Dbapi:
+    def __init__(self):
+        self.cursor_ = FakeCursor()
+
+    def cursor(self):
+        return self.cursor_
+
+
+@pytest.fixture(autouse=True)
+def sem_snapshot():
+    staging1._source_snapshot.id = None
+    yield
+    staging1._source_snapshot.id = None
+
+
+def test_checkout_prende_a_transacao_ao_snapshot():
+    dbapi = _Dbapi()
+    staging1._source_snapshot.id = '00000003-0000001B-1'
+    staging1._attach_source_snapshot(dbapi, None, None)
+    assert dbapi.cursor_.sqls == [
+        'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ',
+        "SET TRANSACTION SNAPSHOT '00000003-0000001B-1'",
+    ]
+    assert dbapi.cursor_.closed
+
+
+def test_checkout_sem_snapshot_nao_mexe_na_conexao():
+    dbapi = _Dbapi()
+    staging1._attach_source_snapshot(dbapi, None, None)
+    assert dbapi.cursor_.sqls == []
+
+
+def test_exported_snapshot(monkeypatch):
+    fonte = FakeSourceEngine([('00000003-0000001B-1',)])
+    monkeypatch.setattr(staging1, 'source_engine', fonte)
+    with staging1._exported_snapshot(True) as snapshot_id:
+        assert snapshot_id == '00000003-0000001B-1'
+        assert fonte.conn.options == {'isolation_level': 'REPEATABLE READ'}
+    assert fonte.conn.sql == 'SELECT pg_export_snapshot()'
+    # a transação exportadora só fecha no fim do bloco
+    assert fonte.conn.options['rolled_back'] is True
+    with staging1._exported_snapshot(False) as snapshot_id:
+        assert snapshot_id is None
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_planejamento_unidades_e_retentativas_usam_o_snapshot(monkeypatch, workers):
+    """Toda leitura da fonte acontece numa thread com o snapshot ativo, então o checkout
+    de cada conexão (planejamento, workers, faixas e novas tentativas) roda SET TRANSACTION SNAPSHOT."""
+    tabelas = staging1.STAGING1_TABLES[:2]
+    vistos = []
+    trava = threading.Lock()
+
+    def _ver(origem):
+        with trava:
+            vistos.append((origem, getattr(staging1._source_snapshot, 'id', None)))
+
+    def _planejar(*a):
+        _ver('planejamento')
+        plano = {'column': None, 'from': None, 'to': None, 'where_sql': '', 'source_cols': {}}
+        return ({t: plano for t in staging1.STAGING1_TABLES},
+                [(tabelas[0], 1, '"id" < 10'), (tabelas[0], 2, '"id" >= 10'), (tabelas[1], 1, None)],
+                {t: [] for t in staging1.STAGING1_TABLES}, {t: 'new' for t in staging1.STAGING1_TABLES})
+
+    tentativas = {}
+
+    def _copy_slice(conn, t, modo, batch_size, where_sql, batch_id):
+        _ver(f'{t}:{where_sql}')
+        tentativas[(t, where_sql)] = tentativas.get((t, where_sql), 0) + 1
+        # primeira tentativa da faixa 2 falha: a retentativa também precisa do snapshot
+        if '>=' in (where_sql or '') and tentativas[(t, where_sql)] == 1:
+            return None
+        return 1
+
+    monkeypatch.setattr(staging1, '_planejar_extracao', _planejar)
+    monkeypatch.setattr(staging1, '_copy_slice', _copy_slice)
+    monkeypatch.setattr(staging1, '_save_checkpoint', lambda *a, **kw: None)
+    monkeypatch.setattr(staging1, '_finish_table', lambda conn, t, *a: {'tabela': t})
+    monkeypatch.setattr(staging1, 'engine', FakeEngine())
+    monkeypatch.setattr(staging1.time, 'sleep', lambda s: None)
+
+    staging1._source_snapshot.id = 'snap-1'
+    staging1._extrair('copy', 100, True, workers, 10, 0.0, 7, {}, snapshot_id='snap-1')
+
+    assert len(vistos) == 5
+    assert {snap for _, snap in vistos} == {'snap-1'}
+    assert sum(1 for origem, _ in vistos if '>=' in origem) == 2
+
+
+def test_fdw_com_snapshot_explicito_devolve_400_na_rota(monkeypatch):
+    monkeypatch.setattr(staging1, 'SOURCE_DATABASE_URL', 'postgresql://u:s@fonte/db')
+    monkeypatch.setattr(staging1, 'SOURCE_SCHEMA', 'public')
+    monkeypatch.setattr(staging2, 'engine', FakeEngine())
+    monkeypatch.setattr(staging2, 'current_wal_lsn', lambda conn: None)
+    resp = create_app().test_client().get('/upload/staging?modo_extracao=fdw&snapshot_consistente=true')
+    assert resp.status_code == 400
+    assert 'fdw' in resp.get_json()['mensagem']
@@ -0,0 +1,50 @@
+import pytest
+
+from app.routes.etl import staging1
+
+from fakes import FakeConn, FakeSourceEngine
+
+
+@pytest.fixture
+def colunas_fonte(monkeypatch):
+    monkeypatch.setattr(staging1, '_source_columns', lambda *a: {'id': 'integer', 'status': 'text'})
+
+
+@pytest.fixture
+def inserts(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(staging1, 'execute_values',
+                        lambda cur, sql, linhas, page_size: chamadas.append((sql, linhas, page_size)))
+    return chamadas
+
+
+def test_stream_grava_em_lotes_pelo_cursor_da_fonte(colunas_fonte, inserts):
+    fonte = FakeSourceEngine([(str(i), 'ok', 'digest', 3) for i in range(5)])
+    conn = FakeConn()
+    n = staging1._stream_table_from_source(conn, fonte, 'public', 'lacreiid_appointment',
+                                           ['id', 'status'], batch_size=2, batch_id=3)
+    assert n == 5
+    assert fonte.conn.options == {'yield_per': 2}
+    assert [len(linhas) for _, linhas, _ in inserts] == [2, 2, 1]
+    assert inserts[0][0] == ('INSERT INTO lacreisaude_staging_01."lacreiid_appointment" '
+                             '("id","status","_row_digest","_batch_id") VALUES %s')
+    assert conn.savepoints == ['commit']
+
+
+def test_stream_falha_desfaz_o_savepoint(colunas_fonte, inserts):
+    fonte = FakeSourceEngine(erro=RuntimeError('fonte caiu'))
+    conn = FakeConn()
+    assert staging1._stream_table_from_source(conn, fonte, 'public', 'lacreiid_appointment',
+                                              ['id', 'status'], batch_size=2) is None
+    assert conn.savepoints == ['rollback']
+    assert inserts == []
+
+
+def test_stream_sem_fonte_ou_sem_colunas():
+    assert staging1._stream_table_from_source(FakeConn(), None, 'public', 't', ['id'], 10) == 0
+
+
+def test_stream_tabela_inexistente_na_fonte(monkeypatch, inserts):
+    monkeypatch.setattr(staging1, '_source_columns', lambda *a: {})
+    assert staging1._stream_table_from_source(FakeConn(), FakeSourceEngine(), 'public', 't', ['id'], 10) == 0
+    assert inserts == []
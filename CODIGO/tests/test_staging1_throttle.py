@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from app.routes.etl import staging1
+
+
+class Relogio:
+    """Relógio falso do módulo: monotonic/perf_counter só andam quando o teste manda;
+    sleep() só registra a espera."""
+
+    def __init__(self):
+        self.agora = 0.0
+        self.esperas = []
+        self.leituras = 0
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.agora
+
+    def perf_counter(self):
+        with self._lock:
+            self.leituras += 1
+            return self.agora
+
+    def sleep(self, segundos):
+        with self._lock:
+            self.esperas.append(segundos)
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(staging1, 'time', relogio)
+    return relogio
+
+
+def _throttle(**limites):
+    throttle = staging1._SourceThrottle()
+    throttle.configure(**limites)
+    return throttle
+
+
+def test_taxa_somada_entre_workers(relogio):
+    throttle = _throttle(rows_per_sec=100)
+    # 4 workers lendo 50 linhas no mesmo instante: cada um espera atrás dos anteriores
+    workers = [threading.Thread(target=throttle.consume, args=(50,)) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert sorted(relogio.esperas) == [0.5, 1.0, 1.5, 2.0]
+    assert throttle.resumo()['rows'] == 200
+    assert throttle.resumo()['sleep_seconds'] == 5.0
+
+
+def test_rajada_de_um_segundo_depois_de_ocioso(relogio):
+    throttle = _throttle(rows_per_sec=100)
+    throttle.consume(100)
+    assert relogio.esperas == [1.0]
+    relogio.agora = 10.0
+    # ocioso por muito tempo: só 1s de crédito acumula
+    throttle.consume(100)
+    throttle.consume(100)
+    assert relogio.esperas == [1.0, 1.0]
+
+
+def test_limite_em_bytes(relogio):
+    throttle = _throttle(bytes_per_sec=1000)
+    assert throttle.mede_bytes
+    throttle.consume(rows=1, nbytes=2000)
+    assert relogio.esperas == [2.0]
+
+
+def test_recuo_divide_pela_metade_ate_5_por_cento_e_recupera(relogio):
+    throttle = _throttle(rows_per_sec=100, backoff_ratio=2)
+    # primeira leitura define a referência da tabela (0,01 s/linha), sem pausa
+    throttle.observe('t', 1.0, 100)
+    assert relogio.esperas == []
+    fatores = []
+    for _ in range(6):
+        throttle.observe('t', 3.0, 100)
+        fatores.append(throttle._fator)
+    assert fatores == [0.5, 0.25, 0.125, 0.0625, 0.05, 0.05]
+    # pausa do ciclo de trabalho: segundos * (1/fator - 1), no máximo PAUSA_MAXIMA
+    assert relogio.esperas[:2] == [3.0, 9.0]
+    assert relogio.esperas[-1] == throttle.PAUSA_MAXIMA
+    resumo = throttle.resumo()
+    assert resumo['backoffs'] == 6 and resumo['min_factor'] == 0.05
+    # com recuo a taxa permitida cai junto: 100 linhas a 5% de 100/s = 20s (menos 1s de rajada)
+    relogio.esperas.clear()
+    relogio.agora = 1000.0
+    throttle.consume(100)
+    assert relogio.esperas == [pytest.approx(19.0)]
+    # latência normal: recupera 5 pontos por leitura até o fator 1, com pausas cada vez menores
+    relogio.esperas.clear()
+    for _ in range(25):
+        throttle.observe('t', 1.0, 100)
+    assert throttle._fator == pytest.approx(1.0)
+    assert relogio.esperas == sorted(relogio.esperas, reverse=True)
+    assert relogio.esperas[0] == pytest.approx(1 / 0.1 - 1)
+
+
+def test_sem_recuo_configurado_observe_nao_pausa(relogio):
+    throttle = _throttle()
+    throttle.observe('t', 1.0, 100)
+    throttle.observe('t', 50.0, 100)
+    assert relogio.esperas == [] and throttle._fator == 1.0
+
+
+def test_slot_limita_conexoes_e_mede_a_espera(relogio):
+    throttle = _throttle(max_connections=1)
+    entrou = threading.Event()
+
+    def _worker():
+        with throttle.slot():
+            entrou.set()
+
+    with throttle.slot():
+        segundo = threading.Thread(target=_worker)
+        segundo.start()
+        # o segundo worker já marcou o início da espera e está bloqueado no semáforo
+        while relogio.leituras < 1:
+            pass
+        relogio.agora = 2.5
+        assert not entrou.wait(0.05)
+    segundo.join()
+    assert entrou.is_set()
+    assert throttle.resumo()['slot_wait_seconds'] == 2.5
+    assert throttle.resumo()['max_source_connections'] == 1
@@ -0,0 +1,134 @@
+import csv
+import gzip
+import io
+
+import pytest
+
+from app import create_app
+from app.routes.etl import staging1
+from app.routes.etl.staging1 import _copy_upload, _IterFile, _row_digest_py, _UploadBody, _write_copy_rows
+
+from fakes import FakeConn, FakeEngine
+
+CSV = b'id,status,phone,extra\n1,ok,555,x\n2,"a,b",,y\n'
+BOUNDARY = 'xYzBoUnDaRy'
+
+
+def _multipart(conteudo, nome='dados.csv'):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="obs"\r\n\r\nqualquer\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="arquivo"; filename="{nome}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + conteudo + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def _ler(body):
+    return io.BufferedReader(body, buffer_size=7).read()
+
+
+@pytest.mark.parametrize('gz', [False, True])
+def test_upload_body_corpo_cru(gz):
+    dados = gzip.compress(CSV) if gz else CSV
+    body = _UploadBody(io.BytesIO(dados), chunk_size=5)
+    assert _ler(body) == CSV
+    assert body.bytes_in == len(dados)
+
+
+@pytest.mark.parametrize('gz', [False, True])
+def test_upload_body_multipart_extrai_o_arquivo(gz):
+    dados = _multipart(gzip.compress(CSV) if gz else CSV)
+    body = _UploadBody(io.BytesIO(dados), BOUNDARY, chunk_size=11)
+    assert _ler(body) == CSV
+    assert body.filename == 'dados.csv'
+
+
+def test_upload_body_vazio():
+    assert _ler(_UploadBody(io.BytesIO(b''))) == b''
+
+
+def test_iter_file_junta_e_divide_os_blocos():
+    arquivo = _IterFile(iter([b'abc', b'de', b'f']))
+    assert arquivo.read(4) == b'abcd'
+    assert arquivo.read(-1) == b'ef'
+    assert arquivo.read(4) == b''
+
+
+def test_write_copy_rows():
+    buf = io.StringIO()
+    posicoes = [('id', 0), ('phone', 2), ('status', 1), ('user_id', 9)]
+    n = _write_copy_rows(csv.writer(buf, lineterminator='\n'), posicoes, [['1', 'ok', '555']], batch_id=4)
+    assert n == 1
+    # phone é sensível e user_id não existe na linha: ambos NULL
+    assert buf.getvalue() == f'1,\\N,ok,\\N,{_row_digest_py(["1", None, "ok", None])},4\n'
+
+
+def test_copy_upload_mapeia_o_cabecalho():
+    conn = FakeConn()
+    linhas, ignoradas = _copy_upload(conn, 'lacreiid_appointment', io.BytesIO(CSV), 12)
+    assert linhas == 2
+    assert ignoradas == ['phone', 'extra']
+    sql, dados = conn.connection.copies[0]
+    assert '("id","status","_row_digest","_batch_id")' in sql
+    assert list(csv.reader(io.StringIO(dados))) == [
+        ['1', 'ok', _row_digest_py(['1', 'ok']), '12'],
+        ['2', 'a,b', _row_digest_py(['2', 'a,b']), '12'],
+    ]
+
+
+def test_copy_upload_sem_colunas_da_tabela():
+    with pytest.raises(ValueError, match='Nenhuma coluna'):
+        _copy_upload(FakeConn(), 'lacreiid_appointment', io.BytesIO(b'foo,bar\n1,2\n'), 1)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(staging1, 'STAGING1_UPLOAD_TOKEN', 'segredo')
+    return create_app().test_client()
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'Authorization': 'Bearer errado'},
+    {'Authorization': 'Bearer segrédo'},
+    {'Authorization': 'Basic segredo'},
+])
+def test_upload_sem_token_valido_devolve_401(client, headers):
+    resp = client.post('/upload/staging1/lacreiid_appointment', data=CSV, headers=headers)
+    assert resp.status_code == 401
+
+
+def test_upload_tabela_desconhecida_devolve_400(client):
+    resp = client.post('/upload/staging1/nao_existe', data=CSV, headers={'Authorization': 'Bearer segredo'})
+    assert resp.status_code == 400
+
+
+@pytest.fixture
+def lote(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(staging1, 'ensure_schema', lambda eng: ([], []))
+    monkeypatch.setattr(staging1, 'engine', FakeEngine())
+    monkeypatch.setattr(staging1, '_start_batch', lambda conn, modo, completo: 9)
+    monkeypatch.setattr(staging1, '_finish_batch', lambda b, status: chamadas.append((b, status)))
+    monkeypatch.setattr(staging1, '_prune_batches', lambda keep, tables=None: chamadas.append(('prune', tables)))
+    return chamadas
+
+
+@pytest.mark.parametrize('dados', [
+    b'foo,bar\n1,2\n',
+    b'id,status\n1,\xff\n',
+    b'\x1f\x8b' + b'nao e gzip' * 10,
+])
+def test_upload_arquivo_invalido_devolve_400(client, lote, dados):
+    resp = client.post('/upload/staging1/lacreiid_appointment', data=dados,
+                       headers={'Authorization': 'Bearer segredo'})
+    assert resp.status_code == 400
+    assert resp.get_json()['batch_id'] == 9
+    assert lote == [(9, 'failed')]
+
+
+def test_upload_valido_conclui_e_poda_so_a_tabela(client, lote):
+    resp = client.post('/upload/staging1/lacreiid_appointment', data=CSV,
+                       headers={'Authorization': 'Bearer segredo'})
+    assert resp.status_code == 200
+    assert resp.get_json()['rows'] == 2
+    assert lote == [(9, 'ok'), ('prune', ['lacreiid_appointment'])]
@@ -0,0 +1,30 @@
+import pytest
+
+from app import create_app
+from app.routes.etl import staging1
+
+
+@pytest.fixture
+def app_ctx(monkeypatch):
+    monkeypatch.setattr(staging1, 'SOURCE_DATABASE_URL', 'postgresql://u:s@fonte/db')
+    monkeypatch.setattr(staging1, 'SOURCE_SCHEMA', 'public')
+    with create_app().app_context():
+        yield
+
+
+def test_fdw_recusa_snapshot_explicito(app_ctx):
+    resposta, status = staging1.criar_popular_staging1(modo='fdw', snapshot=True)
+    assert status == 400
+    assert 'fdw' in resposta.get_json()['mensagem']
+
+
+def test_modo_invalido(app_ctx):
+    resposta, status = staging1.criar_popular_staging1(modo='ftp')
+    assert status == 400
+    assert resposta.get_json()['ok'] is False
+
+
+def test_fdw_sem_fonte(app_ctx, monkeypatch):
+    monkeypatch.setattr(staging1, 'SOURCE_SCHEMA', None)
+    _, status = staging1.criar_popular_staging1(modo='fdw')
+    assert status == 400
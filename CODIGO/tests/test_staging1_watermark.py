@@ -0,0 +1,91 @@
+import pytest
+
+from app.routes.etl import staging1
+
+from fakes import FakeConn, FakeSourceEngine
+
+COLUNAS = {'id': 'integer', 'updated_at': 'timestamp with time zone', 'status': 'text'}
+MAX_FONTE = '2024-02-01 10:00:00+00'
+
+
+def _salvo(coluna='updated_at', valor='2024-01-01 00:00:00+00'):
+    return [{'watermark_column': coluna, 'watermark_value': valor}]
+
+
+def _planejar(conn, colunas=COLUNAS, full_refresh=False, maximo=MAX_FONTE):
+    fonte = FakeSourceEngine([(maximo,)])
+    plano = staging1._plan_incremental(conn, fonte, 'public', 'lacreiid_user', colunas, full_refresh)
+    return plano, fonte.conn.sql
+
+
+@pytest.fixture(autouse=True)
+def sem_sobreposicao(monkeypatch):
+    monkeypatch.setattr(staging1, 'STAGING1_WATERMARK_OVERLAP_SECONDS', 0)
+
+
+def test_delta_entre_a_marca_e_o_max_da_fonte():
+    plano, sql_max = _planejar(FakeConn([_salvo()]))
+    assert sql_max == 'SELECT MAX("updated_at")::text FROM "public"."lacreiid_user"'
+    assert plano == {
+        'column': 'updated_at', 'from': '2024-01-01 00:00:00+00', 'to': MAX_FONTE,
+        'where_sql': """WHERE "updated_at" > '2024-01-01 00:00:00+00' AND "updated_at" <= '2024-02-01 10:00:00+00'""",
+    }
+
+
+def test_primeira_carga_le_tudo():
+    plano, _ = _planejar(FakeConn([None]))
+    assert plano['where_sql'] == '' and plano['from'] is None and plano['to'] == MAX_FONTE
+
+
+def test_full_refresh_ignora_a_marca_e_reposiciona():
+    conn = FakeConn([_salvo()])
+    plano, _ = _planejar(conn, full_refresh=True)
+    assert plano['where_sql'] == '' and plano['to'] == MAX_FONTE
+    # nem lê a marca salva
+    assert conn.executed == []
+
+
+def test_coluna_da_marca_mudou_na_fonte():
+    plano, _ = _planejar(FakeConn([_salvo(coluna='created_at')]))
+    assert plano['where_sql'] == ''
+
+
+def test_tabela_esvaziada_na_fonte():
+    plano, _ = _planejar(FakeConn([_salvo()]), maximo=None)
+    assert plano['where_sql'] == 'WHERE false'
+
+
+def test_tabela_sem_coluna_de_marca():
+    conn = FakeConn()
+    plano, sql_max = _planejar(conn, colunas={'status': 'text'})
+    assert plano == {'column': None, 'from': None, 'to': None, 'where_sql': ''}
+    assert sql_max is None and conn.executed == []
+
+
+def test_janela_de_sobreposicao_no_tipo_da_coluna(monkeypatch):
+    monkeypatch.setattr(staging1, 'STAGING1_WATERMARK_OVERLAP_SECONDS', 300)
+    plano, _ = _planejar(FakeConn([_salvo()]))
+    assert plano['from'] == '2024-01-01 00:00:00+00'
+    assert plano['where_sql'] == (
+        """WHERE "updated_at" > CAST('2024-01-01 00:00:00+00' AS timestamp with time zone) """
+        """- make_interval(secs => 300) AND "updated_at" <= '2024-02-01 10:00:00+00'"""
+    )
+
+
+def test_marca_em_id_sem_sobreposicao(monkeypatch):
+    monkeypatch.setattr(staging1, 'STAGING1_WATERMARK_OVERLAP_SECONDS', 300)
+    plano, _ = _planejar(FakeConn([_salvo(coluna='id', valor='10')]), colunas={'id': 'integer'}, maximo='25')
+    assert plano['where_sql'] == """WHERE "id" > '10' AND "id" <= '25'"""
+
+
+def test_save_watermark_grava_o_max_planejado():
+    conn = FakeConn()
+    plano = {'column': 'updated_at', 'from': 'a', 'to': MAX_FONTE, 'where_sql': ''}
+    staging1._save_watermark(conn, 'lacreiid_user', plano, 7, False)
+    (sql, params), = conn.executed
+    assert params == {'t': 'lacreiid_user', 'c': 'updated_at', 'v': MAX_FONTE, 'n': 7, 'f': False}
+    # delta vazio (MAX NULL) não regride a marca
+    assert 'COALESCE(EXCLUDED.watermark_value' in sql
+    conn = FakeConn()
+    staging1._save_watermark(conn, 't', dict(plano, column=None), 0, False)
+    assert conn.executed == []
@@ -0,0 +1,51 @@
+import pytest
+
+from app import create_app
+from app.routes.etl import staging2
+
+from fakes import FakeConn, FakeEngine
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    # 1ª execução: SET TRANSACTION READ ONLY; 2ª: a página
+    conn = FakeConn([None, [{'id': 9}, {'id': 7}]])
+    monkeypatch.setattr(staging2, 'engine', FakeEngine(conn))
+    return conn
+
+
+@pytest.fixture
+def client(conn):
+    return create_app().test_client()
+
+
+@pytest.mark.parametrize('cursor', ['abc', '1.5', '', ' 7', '1_000', '2147483648', '-2147483649', '99999999999'])
+def test_cursor_invalido_devolve_400(client, conn, cursor):
+    resp = client.get('/upload/staging/amostras/lacrei_privacydocument', query_string={'cursor': cursor})
+    assert resp.status_code == 400
+    assert resp.get_json()['sucesso'] is False
+    # rejeitado antes de chegar ao banco
+    assert conn.executed == []
+
+
+def test_cursor_inteiro_vai_como_parametro(client, conn):
+    resp = client.get('/upload/staging/amostras/lacrei_privacydocument', query_string={'cursor': '-12', 'limite': 2})
+    assert resp.status_code == 200
+    assert resp.get_json()['proximo_cursor'] == '7'
+    sql, params = conn.executed[1]
+    assert 'WHERE id < CAST(:cursor AS INTEGER)' in sql
+    assert params['cursor'] == -12
+
+
+def test_cursor_texto_em_chave_varchar(client, conn):
+    resp = client.get('/upload/staging/amostras/lacreiid_appointment', query_string={'cursor': 'abc'})
+    assert resp.status_code == 200
+    assert conn.executed[1][1]['cursor'] == 'abc'
+    resp = client.get('/upload/staging/amostras/lacreiid_appointment', query_string={'cursor': 'a\x00b'})
+    assert resp.status_code == 400
+
+
+def test_tabela_desconhecida(client):
+    resp = client.get('/upload/staging/amostras/nao_existe')
+    assert resp.status_code == 400
+    assert 'lacreiid_appointment' in resp.get_json()['tabelas']
@@ -0,0 +1,126 @@
+import pytest
+
+from app.routes.etl import table_spec
+from app.routes.etl.table_spec import _limites_faixas, run_spec
+
+from fakes import FakeConn, FakeCursor
+
+SPEC = {'name': 'pessoa', 'table': 'pessoa', 'key': 'id', 'columns': [('id', 'int_key'), ('nome', 'trim')]}
+
+
+class _Cursor(FakeCursor):
+    def __init__(self, conn):
+        super().__init__(linha=(1, 0, 2))
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.eventos.append(('sql', sql, params))
+        if not sql.startswith('PREPARE'):
+            self.conn.upserts += 1
+            if self.conn.upserts == self.conn.falhar_em:
+                raise RuntimeError('deadlock detected')
+
+
+class _Dbapi:
+    def __init__(self, conn):
+        self.conn = conn
+        self.info = {'stg2_prepared': set()}
+
+    def cursor(self):
+        return _Cursor(self.conn)
+
+
+class ChunkConn(FakeConn):
+    """Registra, em ordem, statements do cursor cru, progresso, commits e a marca dos lotes."""
+
+    def __init__(self, falhar_em=None):
+        super().__init__()
+        self.eventos = []
+        self.upserts = 0
+        self.falhar_em = falhar_em
+        self.connection = _Dbapi(self)
+
+    def commit(self):
+        super().commit()
+        self.eventos.append(('commit',))
+
+    def upserts_sql(self):
+        return [e for e in self.eventos if e[0] == 'sql' and not e[1].startswith('PREPARE')]
+
+    def resumo(self):
+        return [e[0] if e[0] != 'sql' else ('prepare' if e[1].startswith('PREPARE') else 'upsert')
+                for e in self.eventos]
+
+
+@pytest.fixture
+def faixas(monkeypatch):
+    monkeypatch.setattr(table_spec, '_sql_cache', {})
+    monkeypatch.setattr(table_spec, '_lotes_pendentes', lambda conn, t, completo: [3, 4])
+    monkeypatch.setattr(table_spec, '_limites_faixas', lambda conn, spec, lotes, completo, n: [10, 20])
+    monkeypatch.setattr(table_spec, '_progresso',
+                        lambda conn, t, feitas, total, n, status: conn.eventos.append(('progresso', feitas, status)))
+    monkeypatch.setattr(table_spec, '_marcar_processados',
+                        lambda conn, t, lotes, completo, n: conn.eventos.append(('marca', lotes, n)))
+
+
+def test_limites_faixas():
+    conn = FakeConn([[10, 20]])
+    assert _limites_faixas(conn, SPEC, [3, 4], False, 1000) == [10, 20]
+    sql, params = conn.executed[0]
+    assert 'SELECT DISTINCT lacreisaude_etl_meta.safe_int(id) AS k' in sql
+    assert 'WHERE _batch_id = ANY(:lotes)' in sql and 'WHERE rn % :n = 0' in sql
+    assert params == {'lotes': [3, 4], 'n': 1000}
+
+
+def test_faixas_sem_prepare_filtram_a_leitura_e_commitam_uma_vez_por_faixa(monkeypatch, faixas):
+    monkeypatch.setattr(table_spec, 'STAGING2_PREPARED', False)
+    conn = ChunkConn()
+    resultado = run_spec(conn, SPEC, completo=False, chunk_rows=2)
+    assert resultado['chunks'] == 3 and resultado['source_rows'] == 6
+    assert conn.resumo() == [
+        'upsert', 'progresso', 'commit',
+        'upsert', 'progresso', 'commit',
+        # última faixa e marca dos lotes na transação do chamador (sem commit aqui)
+        'upsert', 'progresso', 'marca',
+    ]
+    assert [e for e in conn.eventos if e[0] == 'marca'] == [('marca', [3, 4], 6)]
+    primeira, meio, ultima = (sql for _, sql, _ in conn.upserts_sql())
+    chave = 'lacreisaude_etl_meta.safe_int(s.id)'
+    # só os limites de cada faixa, aplicados na leitura do staging_01
+    assert f'{chave} <= CAST(%(ate)s AS INTEGER)' in primeira and f'{chave} >' not in primeira
+    assert f'{chave} > CAST(%(de)s AS INTEGER)' in meio and f'{chave} <= CAST(%(ate)s AS INTEGER)' in meio
+    assert f'{chave} > CAST(%(de)s AS INTEGER)' in ultima and f'{chave} <=' not in ultima
+    assert [(p['de'], p['ate']) for _, _, p in conn.upserts_sql()] == [(None, 10), (10, 20), (20, None)]
+
+
+def test_faixas_preparadas_um_statement_por_forma(monkeypatch, faixas):
+    monkeypatch.setattr(table_spec, 'STAGING2_PREPARED', True)
+    conn = ChunkConn()
+    resultado = run_spec(conn, SPEC, completo=False, chunk_rows=2)
+    assert resultado['prepared'] == 'new'
+    assert conn.resumo().count('prepare') == 3 and conn.commits == 2
+    executes = conn.upserts_sql()
+    assert [p for _, _, p in executes] == [([3, 4], None, 10), ([3, 4], 10, 20), ([3, 4], 20, None)]
+    assert len({sql.split()[1] for _, sql, _ in executes}) == 3
+    # mesma conexão: as formas já preparadas são reaproveitadas
+    conn.eventos.clear()
+    assert run_spec(conn, SPEC, completo=False, chunk_rows=2)['prepared'] == 'reused'
+    assert 'prepare' not in conn.resumo()
+
+
+def test_falha_numa_faixa_nao_marca_os_lotes(monkeypatch, faixas):
+    monkeypatch.setattr(table_spec, 'STAGING2_PREPARED', False)
+    conn = ChunkConn(falhar_em=2)
+    with pytest.raises(RuntimeError):
+        run_spec(conn, SPEC, completo=False, chunk_rows=2)
+    # a primeira faixa ficou confirmada; os lotes seguem pendentes para a próxima execução
+    assert conn.resumo() == ['upsert', 'progresso', 'commit', 'upsert']
+
+
+def test_sem_faixas_um_upsert_sem_commit(monkeypatch, faixas):
+    monkeypatch.setattr(table_spec, 'STAGING2_PREPARED', False)
+    monkeypatch.setattr(table_spec, '_limites_faixas', lambda *a: [])
+    conn = ChunkConn()
+    assert run_spec(conn, SPEC, completo=False, chunk_rows=2)['chunks'] == 1
+    assert conn.resumo() == ['upsert', 'marca']
+    assert 'CAST(%(de)s' not in conn.upserts_sql()[0][1]
@@ -0,0 +1,115 @@
+import pytest
+
+from app.routes.etl import table_spec
+from app.routes.etl.table_spec import _lotes_pendentes, _marcar_processados, _reconciliacao_vencida, run_spec
+
+from fakes import FakeConn, FakeDbapi
+
+SPEC = {'name': 'pessoa', 'table': 'pessoa', 'key': 'id', 'columns': [('id', 'int_key')]}
+
+
+@pytest.mark.parametrize('completo', [False, True])
+def test_lotes_pendentes(completo):
+    conn = FakeConn([[3, 5]])
+    assert _lotes_pendentes(conn, 'pessoa', completo) == [3, 5]
+    (sql, params), = conn.executed
+    # incremental: só lotes 'ok' ainda sem registro em staging2_batch para a tabela
+    assert "b.status = 'ok'" in sql
+    assert f'(:completo OR NOT EXISTS (\n              SELECT 1 FROM {table_spec.META}.staging2_batch p' in sql
+    assert params == {'t': 'pessoa', 'completo': completo}
+
+
+@pytest.mark.parametrize('estado, vencida', [
+    (None, True),   # sem marca: primeira execução da tabela
+    (True, True),   # nunca reconciliou ou passou de STAGING2_RECONCILE_HOURS
+    (False, False),
+])
+def test_reconciliacao_vencida(monkeypatch, estado, vencida):
+    monkeypatch.setattr(table_spec, 'STAGING2_RECONCILE_HOURS', 24)
+    conn = FakeConn([estado])
+    assert _reconciliacao_vencida(conn, 'pessoa') is vencida
+    (sql, params), = conn.executed
+    assert 'full_reconciled_at < now() - make_interval(hours => :h)' in sql
+    assert params == {'t': 'pessoa', 'h': 24}
+
+
+def test_reconciliacao_so_sob_pedido_com_zero_horas(monkeypatch):
+    monkeypatch.setattr(table_spec, 'STAGING2_RECONCILE_HOURS', 0)
+    conn = FakeConn([False])
+    assert _reconciliacao_vencida(conn, 'pessoa') is False
+    # :h = 0 desliga o vencimento por idade; só a falta de marca força a completa
+    assert 'full_reconciled_at IS NULL\n               OR (:h > 0 AND' in conn.executed[0][0]
+    assert conn.executed[0][1]['h'] == 0
+
+
+@pytest.mark.parametrize('completo', [False, True])
+def test_marcar_processados(completo):
+    conn = FakeConn()
+    _marcar_processados(conn, 'pessoa', [4, 9, 7], completo, 120)
+    (lotes_sql, lotes), (marca_sql, marca) = conn.executed
+    assert f'INSERT INTO {table_spec.META}.staging2_batch' in lotes_sql and 'ON CONFLICT DO NOTHING' in lotes_sql
+    assert lotes == {'t': 'pessoa', 'lotes': [4, 9, 7]}
+    # marca d'água: maior lote; full_reconciled_at só avança na reconciliação completa
+    assert marca == {'t': 'pessoa', 'b': 9, 'completo': completo, 'n': 120}
+    assert 'batch_id = GREATEST(w.batch_id, EXCLUDED.batch_id)' in marca_sql
+    assert 'full_reconciled_at = COALESCE(EXCLUDED.full_reconciled_at, w.full_reconciled_at)' in marca_sql
+
+
+def test_marcar_processados_sem_lotes():
+    conn = FakeConn()
+    _marcar_processados(conn, 'pessoa', [], True, 0)
+    assert conn.executed[1][1]['b'] is None
+
+
+@pytest.fixture
+def decisao(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(table_spec, '_reconciliacao_vencida', lambda conn, t: chamadas.append('vencida') or estado['vencida'])
+    monkeypatch.setattr(table_spec, '_lotes_pendentes',
+                        lambda conn, t, completo: chamadas.append(('lotes', completo)) or estado['lotes'])
+    monkeypatch.setattr(table_spec, '_marcar_processados', lambda *a: chamadas.append(('marca',) + a[2:]))
+    estado = {'vencida': False, 'lotes': [], 'chamadas': chamadas}
+    return estado
+
+
+def test_incremental_sem_lotes_novos_nao_roda_o_upsert(decisao):
+    conn = FakeConn()
+    resultado = run_spec(conn, SPEC)
+    assert resultado['mode'] == 'incremental' and resultado['batches'] == []
+    assert resultado['source_rows'] == 0
+    assert decisao['chamadas'] == ['vencida', ('lotes', False)]
+    assert conn.executed == []
+
+
+def _conn_upsert(monkeypatch):
+    monkeypatch.setattr(table_spec, 'STAGING2_PREPARED', False)
+    conn = FakeConn()
+    conn.connection = FakeDbapi(linha=(2, 1, 5))
+    return conn
+
+
+def test_reconciliacao_vencida_escolhe_o_modo_completo(monkeypatch, decisao):
+    decisao['vencida'] = True
+    conn = _conn_upsert(monkeypatch)
+    # no modo completo o upsert roda mesmo sem lotes (linhas sem lote do staging_01)
+    resultado = run_spec(conn, SPEC, chunk_rows=0)
+    assert resultado['mode'] == 'full' and resultado['inserted'] == 2 and resultado['updated'] == 1
+    assert decisao['chamadas'] == ['vencida', ('lotes', True), ('marca', [], True, 5)]
+    assert '_batch_id IS NULL OR' in conn.connection.sqls[0]
+
+
+def test_completo_explicito_nao_consulta_a_marca(monkeypatch, decisao):
+    decisao['lotes'] = [1]
+    conn = _conn_upsert(monkeypatch)
+    run_spec(conn, SPEC, completo=True, chunk_rows=0)
+    assert decisao['chamadas'] == [('lotes', True), ('marca', [1], True, 5)]
+
+
+def test_incremental_processa_e_marca_so_os_lotes_pendentes(monkeypatch, decisao):
+    decisao['lotes'] = [7, 8]
+    conn = _conn_upsert(monkeypatch)
+    resultado = run_spec(conn, SPEC, chunk_rows=0)
+    assert resultado['mode'] == 'incremental' and resultado['batches'] == [7, 8]
+    assert decisao['chamadas'] == ['vencida', ('lotes', False), ('marca', [7, 8], False, 5)]
+    assert conn.connection.params[0]['lotes'] == [7, 8]
+    assert '_batch_id IS NULL OR' not in conn.connection.sqls[0]
@@ -0,0 +1,71 @@
+import pytest
+from flask import jsonify
+
+from app import create_app
+from app.routes.etl import staging2
+
+from fakes import FakeEngine
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """/upload/staging com staging1 e etapas substituídos; `staging1` define a resposta da extração."""
+    estado = {'staging1': ({'ok': True, 'batch_id': 42, 'resumo': [{'tabela': 'lacreiid_user', 'seconds': 1.5}],
+                            'critical_path': {'tabela': 'lacreiid_user', 'seconds': 1.5}}, 200),
+              'chamadas': []}
+
+    def _staging1(**kw):
+        estado['chamadas'].append(kw)
+        corpo, status = estado['staging1']
+        return jsonify(corpo), status
+
+    monkeypatch.setattr(staging2, 'criar_popular_staging1', _staging1)
+    monkeypatch.setattr(staging2, 'engine', FakeEngine())
+    monkeypatch.setattr(staging2, 'current_wal_lsn', lambda conn: None)
+    monkeypatch.setattr(staging2, 'wal_bytes_since', lambda conn, inicio: None)
+    monkeypatch.setattr(staging2, 'set_schema_persistence', lambda conn, schema, unlogged: False)
+    monkeypatch.setattr(staging2, 'ensure_schema', lambda engine: (set(), []))
+    monkeypatch.setattr(staging2, 'staging2_etapas', lambda completo, linhas, tabelas: [])
+    monkeypatch.setattr(staging2, '_etapas_model_mart', lambda etapas: [])
+    monkeypatch.setattr(staging2, '_gravar_status', lambda resultados, inicio: None)
+    cliente = create_app().test_client()
+    return cliente, estado
+
+
+def test_resposta_traz_o_resumo_do_staging1(pipeline):
+    cliente, _ = pipeline
+    resp = cliente.get('/upload/staging')
+    corpo = resp.get_json()
+    assert resp.status_code == 200 and corpo['sucesso'] is True
+    assert corpo['staging1']['batch_id'] == 42
+    assert corpo['staging1']['critical_path'] == {'tabela': 'lacreiid_user', 'seconds': 1.5}
+
+
+@pytest.mark.parametrize('staging1', [
+    ({'ok': False, 'batch_status': 'failed', 'failed_tables': ['lacreiid_user']}, 200),
+    ({'ok': False, 'mensagem': 'fonte caiu'}, 500),
+])
+def test_falha_do_staging1_marca_a_execucao_como_falha(pipeline, staging1):
+    cliente, estado = pipeline
+    estado['staging1'] = staging1
+    corpo = cliente.get('/upload/staging').get_json()
+    assert corpo['sucesso'] is False
+    assert corpo['staging1'] == staging1[0]
+    assert 'staging1 falhou' in corpo['mensagem']
+
+
+@pytest.mark.parametrize('status', [400, 409])
+def test_staging1_recusado_interrompe(pipeline, status):
+    cliente, estado = pipeline
+    estado['staging1'] = ({'ok': False, 'mensagem': 'recusado'}, status)
+    resp = cliente.get('/upload/staging')
+    assert resp.status_code == status
+    assert resp.get_json() == {'sucesso': False, 'mensagem': 'recusado', 'staging1': {'ok': False, 'mensagem': 'recusado'}}
+
+
+def test_somente_falhas_nao_extrai(pipeline, monkeypatch):
+    cliente, estado = pipeline
+    monkeypatch.setattr(staging2, '_etapas_a_reexecutar', lambda todas: set())
+    corpo = cliente.get('/upload/staging?somente_falhas=true').get_json()
+    assert estado['chamadas'] == []
+    assert corpo['sucesso'] is True and corpo['staging1'] is None
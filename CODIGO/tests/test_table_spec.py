@@ -0,0 +1,184 @@
+import re
+
+import pytest
+
+from app.routes.etl import table_spec
+from app.utils import upsert
+from app.routes.etl.staging2 import STAGING2_SPECS
+from app.routes.etl.table_spec import (
+    FUNCOES_SQL, TS_COM_FUSO, TS_SEM_FUSO, _sql_da_spec, _validar, chave_ddl_sql, ddl_sql, join_ddl_sql,
+    upsert_sql,
+)
+from app.utils.upsert import update_where
+
+SPEC = {
+    'name': 'pessoa',
+    'table': 'pessoa',
+    'key': 'id',
+    'dedupe': ('updated_at',),
+    'columns': [
+        ('id', 'int_key'),
+        ('updated_at', 'ts'),
+        ('ativo', 'bool'),
+        ('nome', 'trim', 'first_name'),
+    ],
+    'indexes': [('ix_pessoa_nome', 'nome')],
+}
+
+
+def _spec(**kw):
+    return dict(SPEC, **kw)
+
+
+@pytest.mark.parametrize('spec', STAGING2_SPECS, ids=lambda s: s['name'])
+def test_specs_do_staging2_sao_validas(spec):
+    _validar(spec)
+    assert f"ON CONFLICT ({spec['key']})" in upsert_sql(spec)
+
+
+@pytest.mark.parametrize('spec, erro', [
+    (_spec(columns=SPEC['columns'] + [('x', 'float')]), "regra 'float' desconhecida"),
+    (_spec(key='ativo'), 'chave ativo'),
+    (_spec(key='sem_coluna'), 'chave sem_coluna'),
+    (_spec(dedupe=('created_at',)), 'dedupe created_at'),
+])
+def test_validar_rejeita_spec_invalida(spec, erro):
+    with pytest.raises(ValueError, match=erro):
+        _validar(spec)
+
+
+def test_ddl_sql_tipos_chave_e_indices():
+    sql = ddl_sql(SPEC)
+    assert ('CREATE TABLE IF NOT EXISTS lacreisaude_staging_02.pessoa (id INTEGER PRIMARY KEY, '
+            'updated_at TIMESTAMP WITHOUT TIME ZONE, ativo BOOLEAN, nome VARCHAR)') in sql
+    assert 'ADD COLUMN IF NOT EXISTS _row_digest TEXT' in sql
+    assert 'CREATE INDEX IF NOT EXISTS ix_pessoa_nome ON lacreisaude_staging_02.pessoa (nome)' in sql
+
+
+def test_upsert_sql_converte_com_as_regras():
+    sql = upsert_sql(SPEC)
+    # chave convertida uma vez na subconsulta; demais colunas pela regra, a partir da origem
+    assert 'lacreisaude_etl_meta.safe_int(s.id) AS _k' in sql
+    assert '_k AS id' in sql
+    assert 'lacreisaude_etl_meta.safe_utc_ts(updated_at) AS updated_at' in sql
+    assert 'lacreisaude_etl_meta.safe_bool(ativo) AS ativo' in sql
+    assert "NULLIF(TRIM(first_name), '')::varchar AS nome" in sql
+    # a chave não é atualizada; o digest sim
+    sets = re.search(r'DO UPDATE SET(.*?)RETURNING', sql, re.S).group(1)
+    assert 'id = EXCLUDED.id' not in sets
+    assert 'nome = EXCLUDED.nome' in sets and '_row_digest = EXCLUDED._row_digest' in sets
+
+
+def _leitura(sql):
+    return ' '.join(re.search(r'FROM lacreisaude_staging_01\.pessoa s\s+WHERE (.*?)\s+OFFSET 0', sql, re.S).group(1).split())
+
+
+def test_upsert_sql_lotes_e_faixa_de_chave():
+    # sem faixa: nenhum filtro de chave (e nenhum "IS NULL OR" que impeça o range scan)
+    incremental = upsert_sql(SPEC)
+    assert _leitura(incremental) == '_batch_id = ANY($1)'
+    assert '$2' not in incremental and '$3' not in incremental
+    # a faixa vai na própria leitura do staging_01, com a expressão do índice de chave_ddl_sql
+    chave = 'lacreisaude_etl_meta.safe_int(s.id)'
+    assert _leitura(upsert_sql(SPEC, limites=(True, True))) == (
+        f'_batch_id = ANY($1) AND {chave} > CAST($2 AS INTEGER) AND {chave} <= CAST($3 AS INTEGER)'
+    )
+    assert _leitura(upsert_sql(SPEC, limites=(False, True))) == f'_batch_id = ANY($1) AND {chave} <= CAST($3 AS INTEGER)'
+    completo = upsert_sql(SPEC, completo=True, params=(':lotes', ':de', ':ate'), limites=(True, False))
+    assert _leitura(completo) == (
+        f'(_batch_id IS NULL OR _batch_id = ANY(:lotes)) AND {chave} > CAST(:de AS INTEGER)'
+    )
+
+
+def test_chave_ddl_sql_indexa_a_mesma_expressao_da_leitura():
+    assert chave_ddl_sql(SPEC) == (
+        'CREATE INDEX IF NOT EXISTS ix_pessoa__batch_chave ON lacreisaude_staging_01.pessoa '
+        '(_batch_id, (lacreisaude_etl_meta.safe_int(id)))'
+    )
+
+
+@pytest.mark.parametrize('dedupe, ordem', [
+    ((), 'ORDER BY _batch_id DESC NULLS LAST'),
+    (('updated_at',), 'ORDER BY updated_at DESC NULLS LAST, _batch_id DESC NULLS LAST'),
+    (('updated_at', 'nome'), 'ORDER BY COALESCE(updated_at, nome) DESC NULLS LAST, _batch_id DESC NULLS LAST'),
+])
+def test_upsert_sql_dedupe(dedupe, ordem):
+    assert f'PARTITION BY id {ordem}' in upsert_sql(_spec(dedupe=dedupe))
+
+
+def test_sql_da_spec_nome_muda_com_o_sql(monkeypatch):
+    monkeypatch.setattr(table_spec, '_sql_cache', {})
+    nome, sql = _sql_da_spec(SPEC, False)
+    assert nome.startswith('stg2_pessoa_') and _sql_da_spec(SPEC, False) == (nome, sql)
+    table_spec._sql_cache.clear()
+    outro, _ = _sql_da_spec(_spec(dedupe=()), False)
+    assert outro != nome
+
+
+def test_join_ddl_sql():
+    assert join_ddl_sql(SPEC) is None
+    sql = join_ddl_sql(_spec(join_indexes=[('ix_j', 'nome')], statistics=[('st_p', 'id, nome')]))
+    assert 'CREATE INDEX IF NOT EXISTS ix_j ON lacreisaude_staging_02.pessoa (nome)' in sql
+    assert ('CREATE STATISTICS IF NOT EXISTS lacreisaude_staging_02.st_p (ndistinct, dependencies) '
+            'ON id, nome FROM lacreisaude_staging_02.pessoa') in sql
+    assert sql.endswith('ANALYZE lacreisaude_staging_02.pessoa;')
+
+
+def _clausula_update(sql):
+    return re.search(r'_row_digest = EXCLUDED._row_digest\s*(.*?)\s*RETURNING', sql, re.S).group(1)
+
+
+def test_upsert_sql_pula_linhas_sem_mudanca(monkeypatch):
+    monkeypatch.setattr(upsert, 'ETL_SKIP_UNCHANGED', True)
+    onde = _clausula_update(upsert_sql(SPEC))
+    assert onde == (
+        'WHERE (EXCLUDED._row_digest IS NULL OR lacreisaude_staging_02.pessoa._row_digest IS DISTINCT FROM '
+        'EXCLUDED._row_digest) AND (lacreisaude_staging_02.pessoa.updated_at, lacreisaude_staging_02.pessoa.ativo, '
+        'lacreisaude_staging_02.pessoa.nome) IS DISTINCT FROM (EXCLUDED.updated_at, EXCLUDED.ativo, EXCLUDED.nome)'
+    )
+
+
+def test_upsert_sql_update_incondicional_sem_skip_unchanged(monkeypatch):
+    monkeypatch.setattr(upsert, 'ETL_SKIP_UNCHANGED', False)
+    assert _clausula_update(upsert_sql(SPEC)) == ''
+    # mesma regra do model e do mart
+    assert update_where('lacreisaude_model.dim', ['a']) == ''
+
+
+@pytest.mark.parametrize('funcao, volatilidade', [
+    ('safe_int', 'IMMUTABLE'), ('safe_bool', 'IMMUTABLE'), ('safe_utc_ts', 'STABLE'),
+])
+def test_funcoes_de_conversao_sao_sql_embutivel(funcao, volatilidade):
+    sql = next(f for f in FUNCOES_SQL if f'.{funcao}(' in f)
+    # uma expressão só, sem plpgsql nem EXCEPTION: o planner embute o corpo na consulta
+    assert f'LANGUAGE sql {volatilidade} PARALLEL SAFE' in sql
+    assert 'EXCEPTION' not in sql and 'plpgsql' not in sql
+    assert sql.count('SELECT') == 1
+
+
+def test_safe_int_regex_antes_do_cast():
+    sql = next(f for f in FUNCOES_SQL if '.safe_int(' in f)
+    # CASE aninhado: o cast só é avaliado depois do regex
+    assert re.search(r"CASE WHEN btrim\(v\) ~ '\^\[0-9\]\{1,18\}\$' THEN\s+CASE WHEN btrim\(v\)::BIGINT", sql)
+
+
+@pytest.mark.parametrize('valor', [
+    '2024-01-31', '2024-01-31 10:00', '2024-01-31T10:00:59', '2024-01-31t23:59:59.123456',
+])
+def test_safe_utc_ts_sem_fuso(valor):
+    assert re.match(TS_SEM_FUSO, valor) and not re.match(TS_COM_FUSO, valor)
+
+
+@pytest.mark.parametrize('valor', [
+    '2024-01-31T10:00:00Z', '2024-01-31 10:00:00.5 +03', '2024-01-31T10:00-0300', '2024-01-31 10:00:00+03:00',
+])
+def test_safe_utc_ts_com_fuso(valor):
+    assert re.match(TS_COM_FUSO, valor) and not re.match(TS_SEM_FUSO, valor)
+
+
+@pytest.mark.parametrize('valor', [
+    'now', 'today', 'epoch', 'infinity', '31/01/2024', '01/31/2024', 'January 31 2024', '2024-13-01',
+    '2024-01-32', '2024-01-31 24:00', '2024-01-31Z', '2024-01-31 10:00 America/Sao_Paulo', '',
+])
+def test_safe_utc_ts_rejeita_outros_formatos(valor):
+    assert not re.match(TS_SEM_FUSO, valor) and not re.match(TS_COM_FUSO, valor)